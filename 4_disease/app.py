@@ -1,4 +1,5 @@
 import os
+import sys
 import uuid
 from pathlib import Path
 from datetime import datetime
@@ -10,8 +11,15 @@ from fastapi.responses import HTMLResponse, JSONResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 
+# Scheduler, retention and metrics modules are shared with the other
+# backends and live in dental_common/ at the repository root
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
 # Import model loader
 from model_loader import DentalDiseasePredictor
+from dental_common.janitor import Janitor
+from dental_common.scheduler import InferenceScheduler, DeadlineMiddleware, DeadlineExceeded, INTERACTIVE, BATCH
+from dental_common.metrics import MetricsMiddleware, watch_scheduler, metrics_response, label_request, timed, registry as metrics_registry
 
 # Initialize FastAPI app
 app = FastAPI(
@@ -20,11 +28,21 @@ app = FastAPI(
     version="1.0.0"
 )
 
+# Per-request deadlines (X-Request-Timeout / X-Request-Deadline)
+app.add_middleware(DeadlineMiddleware)
+
+# Stage latency histograms and request counters, served at /metrics
+app.add_middleware(MetricsMiddleware, routes={"/predict", "/predict_batch"})
+
 # Create necessary directories
 BASE_DIR = Path(__file__).parent
 UPLOAD_DIR = BASE_DIR / "static" / "uploads"
 UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
 
+# Background retention (TTL + quota) for uploads
+janitor = Janitor()
+janitor.add_directory("uploads", UPLOAD_DIR)
+
 # Setup static files and templates
 app.mount("/static", StaticFiles(directory=BASE_DIR / "static"), name="static")
 templates = Jinja2Templates(directory=BASE_DIR / "templates")
@@ -36,17 +54,32 @@ print("=" * 50)
 
 model_predictor = DentalDiseasePredictor()
 
+# Model calls run off the event loop, queued by priority lane
+scheduler = InferenceScheduler(workers=int(os.getenv("DENTAL_INFERENCE_WORKERS", "1")))
+watch_scheduler(scheduler)
+metrics_registry.gauge(
+    "dental_models_loaded", "Whether each model is loaded (1) or missing (0)", ("model",),
+    lambda: {("dental",): model_predictor.is_loaded}
+)
+
 @app.on_event("startup")
 async def startup_event():
     """Initialize on startup"""
     print("\n📊 System Information:")
     print(f"   Upload directory: {UPLOAD_DIR}")
+    janitor.start()
     print(f"   Model loaded: {model_predictor.is_loaded}")
     print(f"   Classes: {', '.join(model_predictor.class_names)}")
     print(f"   Using {'REAL' if model_predictor.is_loaded else 'TEST'} model")
     print("\n✅ System ready! Access at: http://localhost:8000")
     print("=" * 50)
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Stop background tasks"""
+    await janitor.stop()
+    scheduler.shutdown()
+
 @app.get("/", response_class=HTMLResponse)
 async def home(request: Request):
     """Home page"""
@@ -86,6 +119,8 @@ async def predict_single_image(
                 }
             )
         
+        label_request(model="dental")
+        
         # Save file
         filename = f"{uuid.uuid4().hex[:8]}_{file.filename}"
         file_path = UPLOAD_DIR / filename
@@ -102,10 +137,11 @@ async def predict_single_image(
                         "class_info": [model_predictor.get_class_info(c) for c in model_predictor.class_names]
                     }
                 )
-            await buffer.write(content)
+            with timed("persist"):
+                await buffer.write(content)
         
         # Predict
-        result = model_predictor.predict(str(file_path))
+        result = await scheduler.run(INTERACTIVE, model_predictor.predict, str(file_path))
         
         # Add display info
         result["image_url"] = f"/static/uploads/{filename}"
@@ -126,6 +162,8 @@ async def predict_single_image(
             }
         )
         
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         class_info = [model_predictor.get_class_info(c) for c in model_predictor.class_names]
         return templates.TemplateResponse(
@@ -156,6 +194,7 @@ async def predict_batch_images(
             }
         )
     
+    label_request(model="dental", batch_size=len(files))
     results = []
     for file in files:
         if file.content_type.startswith("image/"):
@@ -166,10 +205,11 @@ async def predict_batch_images(
                 
                 async with aiofiles.open(file_path, 'wb') as buffer:
                     content = await file.read()
-                    await buffer.write(content)
+                    with timed("persist"):
+                        await buffer.write(content)
                 
                 # Predict
-                result = model_predictor.predict(str(file_path))
+                result = await scheduler.run(BATCH, model_predictor.predict, str(file_path))
                 
                 # Add display info
                 result["image_url"] = f"/static/uploads/{filename}"
@@ -178,6 +218,8 @@ async def predict_batch_images(
                 
                 results.append(result)
                 
+            except DeadlineExceeded:
+                raise
             except Exception as e:
                 results.append({
                     "filename": file.filename,
@@ -203,20 +245,18 @@ async def predict_batch_images(
 @app.get("/clear")
 async def clear_files():
     """Clear uploaded files"""
-    deleted = 0
-    for file_path in UPLOAD_DIR.iterdir():
-        if file_path.is_file():
-            try:
-                file_path.unlink()
-                deleted += 1
-            except:
-                pass
+    deleted = await janitor.purge("uploads")
     
     return JSONResponse({
         "message": f"Cleared {deleted} files",
         "status": "success"
     })
 
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics: stage latency histograms, queue and model gauges"""
+    return metrics_response()
+
 @app.get("/health")
 async def health_check():
     """Health check"""
@@ -224,6 +264,7 @@ async def health_check():
         "status": "running",
         "model_loaded": model_predictor.is_loaded,
         "classes": model_predictor.class_names,
+        "scheduler": scheduler.stats(),
         "timestamp": datetime.now().isoformat()
     })
 
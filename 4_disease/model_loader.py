@@ -7,6 +7,8 @@ import time
 from pathlib import Path
 from typing import Dict, Any, List
 
+from dental_common.metrics import timed
+
 # Disable TensorFlow warnings
 os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
 tf.get_logger().setLevel('ERROR')
@@ -115,24 +117,27 @@ class DentalDiseasePredictor:
     def preprocess_image(self, image_path: str) -> np.ndarray:
         """Preprocess image for ResNet50 model"""
         try:
-            # Read image
-            img = Image.open(image_path)
-            
-            # Convert to RGB if needed
-            if img.mode != 'RGB':
-                img = img.convert('RGB')
-            
-            # Resize
-            img = img.resize(self.img_size)
-            
-            # Convert to numpy array
-            img_array = np.array(img, dtype=np.float32)
-            
-            # Apply ResNet50 preprocessing
-            img_array = tf.keras.applications.resnet.preprocess_input(img_array)
-            
-            # Add batch dimension
-            img_array = np.expand_dims(img_array, axis=0)
+            with timed("decode", "dental"):
+                # Read image
+                img = Image.open(image_path)
+                img.load()
+                
+                # Convert to RGB if needed
+                if img.mode != 'RGB':
+                    img = img.convert('RGB')
+            
+            with timed("preprocess", "dental"):
+                # Resize
+                img = img.resize(self.img_size)
+                
+                # Convert to numpy array
+                img_array = np.array(img, dtype=np.float32)
+                
+                # Apply ResNet50 preprocessing
+                img_array = tf.keras.applications.resnet.preprocess_input(img_array)
+                
+                # Add batch dimension
+                img_array = np.expand_dims(img_array, axis=0)
             
             return img_array
             
@@ -157,7 +162,8 @@ class DentalDiseasePredictor:
             processed_image = self.preprocess_image(image_path)
             
             # Make prediction
-            predictions = self.model.predict(processed_image, verbose=0, batch_size=1)
+            with timed("inference", "dental", 1):
+                predictions = self.model.predict(processed_image, verbose=0, batch_size=1)
             
             # Get results
             predicted_idx = np.argmax(predictions[0])
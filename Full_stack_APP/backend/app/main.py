@@ -1,18 +1,55 @@
 import os
-import uuid
+import json
+import time
+import asyncio
+import tempfile
 from pathlib import Path
 from datetime import datetime
-from typing import List
+from typing import Optional
 
-import aiofiles
-from fastapi import FastAPI, File, UploadFile, Request, Form
-from fastapi.responses import HTMLResponse, JSONResponse
-from fastapi.staticfiles import StaticFiles
+from fastapi import FastAPI, Request, WebSocket
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import HTMLResponse, JSONResponse, StreamingResponse
 from fastapi.templating import Jinja2Templates
+from starlette.requests import HTTPConnection
 from fastapi.middleware.cors import CORSMiddleware
 
 # Import model loaders
-from services.model_loader import DentalDiseasePredictor, GingivitisPredictor
+from services.model_loader import DentalDiseasePredictor, GingivitisPredictor, load_image
+from services.upload_ingest import (
+    ingest_upload, sniff_image_type, IngestedFile, UploadRejected,
+    MAX_BATCH_FILES, MAX_VIDEO_BYTES, MAX_REQUEST_BYTES, SNIFF_BYTES
+)
+from services.upload_store import UploadStore
+from dental_common.janitor import Janitor
+from services.job_queue import (
+    JobQueue, MAX_JOB_FILES, MAX_JOB_REQUEST_BYTES, RESULTS_PAGE_SIZE, FINISHED_STATUSES
+)
+from services.renditions import RenditionWriter, RenditionStaticFiles
+from services.frame_stream import LatestFrameSlot, decode_frame, MAX_FRAME_BYTES
+from services.video_analysis import analyze_video, VideoDecodeError
+from services.admission import AdmissionController, AdmissionMiddleware, watch_admission
+from dental_common.scheduler import (
+    InferenceScheduler, LaneFull, DeadlineMiddleware, DeadlineExceeded,
+    DEADLINE, check_deadline, INTERACTIVE, BATCH
+)
+from services.degradation import DegradationPolicy, allows_degraded
+from services.cascade import ModelCascade, wants_cascade, CASCADE_ENABLED
+from services.tta import tta_mode, DEFAULT_MODE as DEFAULT_TTA_MODE
+from services.tiling import predict_tiled, wants_tiled, tile_budget
+from services.multihead import MultiHeadModel
+from services.similar_cases import SimilarCases
+from services.near_duplicates import NearDuplicateIndex, wants_near_dup
+from services.quality_gate import (
+    quality_mode, check_file, check_image, THRESHOLDS as QUALITY_THRESHOLDS, DEFAULT_MODE as DEFAULT_QUALITY_MODE
+)
+from dental_common.metrics import (
+    MetricsMiddleware, watch_scheduler, metrics_response, label_request, request_labels, timed,
+    attach_timing, registry as metrics_registry
+)
+from services.response_encoding import (
+    dumps, encode_response, compact_result, metadata_version, wants_compact
+)
 
 # Initialize FastAPI app
 app = FastAPI(
@@ -21,6 +58,33 @@ app = FastAPI(
     version="2.0.0"
 )
 
+INFERENCE_WORKERS = int(os.getenv("DENTAL_INFERENCE_WORKERS", "1"))
+
+# Admission control for inference routes: bounded queue, in-flight upload
+# bytes and per-client rate limits. Added before CORS so rejections still
+# carry CORS headers.
+admission = AdmissionController(workers=INFERENCE_WORKERS)
+app.add_middleware(
+    AdmissionMiddleware,
+    controller=admission,
+    guarded={
+        ("POST", "/api/predict"),
+        ("POST", "/api/predict_batch"),
+        ("POST", "/api/predict_batch/stream"),
+        ("POST", "/api/analyze_video"),
+        ("POST", "/api/analyze_all"),
+        ("POST", "/predict"),
+        ("POST", "/predict_batch"),
+    },
+    # Jobs queue durably on disk; only the submission rate is limited
+    rate_limited={("POST", "/api/jobs")},
+    fallback_bytes=MAX_REQUEST_BYTES
+)
+
+# Per-request deadlines (X-Request-Timeout / X-Request-Deadline); outside
+# admission so requests that are already late never take a slot
+app.add_middleware(DeadlineMiddleware)
+
 # Add CORS middleware for React frontend
 app.add_middleware(
     CORSMiddleware,
@@ -30,13 +94,39 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Stage latency histograms and request counters for /metrics; outermost,
+# so requests turned away by admission control are counted too
+app.add_middleware(
+    MetricsMiddleware,
+    routes={
+        "/api/predict", "/api/predict_batch", "/api/predict_batch/stream", "/api/analyze_all",
+        "/api/analyze_video", "/api/jobs", "/predict", "/predict_batch"
+    }
+)
+
 # Create necessary directories
 BASE_DIR = Path(__file__).parent.parent
 UPLOAD_DIR = BASE_DIR / "static" / "uploads"
 UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
+DATA_DIR = BASE_DIR / "data"
+
+# Content-addressed upload storage (index lives outside the static mount)
+upload_store = UploadStore(UPLOAD_DIR, DATA_DIR / "uploads.sqlite3", url_prefix="/static/uploads")
+
+# Display renditions are encoded after the response, off the request path
+rendition_writer = RenditionWriter(upload_store)
+
+# Background retention (TTL + quota) for stored uploads
+janitor = Janitor()
+janitor.add_store("uploads", upload_store)
+
+# Embeddings of analysed images, for similar-case search
+similar_cases = SimilarCases(DATA_DIR / "similar", DATA_DIR / "similar_cases.sqlite3")
 
 # Setup static files and templates
-app.mount("/static", StaticFiles(directory=BASE_DIR / "static"), name="static")
+# Hashed upload names are served as immutable; everything else revalidates.
+# A rendition fetched before it has been written waits for it.
+app.mount("/static", RenditionStaticFiles(directory=BASE_DIR / "static", writer=rendition_writer), name="static")
 templates = Jinja2Templates(directory=BASE_DIR / "templates")
 
 # Initialize model predictors
@@ -47,11 +137,50 @@ print("=" * 60)
 dental_predictor = DentalDiseasePredictor()
 gingivitis_predictor = GingivitisPredictor()
 
+# Model inference runs on a dedicated pool so the event loop stays free
+# to parse uploads and flush streamed results. Calls are queued in priority
+# lanes so single predictions overtake batch work.
+scheduler = InferenceScheduler(workers=INFERENCE_WORKERS)
+watch_scheduler(scheduler)
+watch_admission(admission, metrics_registry)
+
+# Opted-in requests fall back to lite models while the queue is over its SLO
+degradation = DegradationPolicy(scheduler)
+
+# Lite model first, full model only for uncertain images (per-class thresholds)
+cascade = ModelCascade()
+
+# Optional fused teeth + gum model: one backbone pass for /api/analyze_all
+multihead = MultiHeadModel()
+
+# Re-sent copies of recent images reuse their prediction (perceptual hash)
+near_duplicates = NearDuplicateIndex()
+
+metrics_registry.gauge(
+    "dental_models_loaded", "Whether each model is loaded (1) or missing (0)", ("model",),
+    lambda: {
+        ("dental",): dental_predictor.is_loaded,
+        ("gingivitis",): gingivitis_predictor.is_loaded,
+        ("dental-lite",): dental_predictor.lite_model is not None,
+        ("gingivitis-lite",): gingivitis_predictor.lite_model is not None,
+        ("multihead",): multihead.available
+    }
+)
+
+def busy_response(error: LaneFull) -> JSONResponse:
+    return JSONResponse(
+        status_code=503,
+        content={"error": error.message},
+        headers={"Retry-After": str(error.retry_after)}
+    )
+
 @app.on_event("startup")
 async def startup_event():
     """Initialize on startup"""
     print("\n📊 System Information:")
     print(f"   Upload directory: {UPLOAD_DIR}")
+    janitor.start()
+    job_queue.start()
     print(f"   Dental model loaded: {dental_predictor.is_loaded}")
     print(f"   Gingivitis model loaded: {gingivitis_predictor.is_loaded}")
     print(f"   Dental classes: {', '.join(dental_predictor.class_names)}")
@@ -59,141 +188,873 @@ async def startup_event():
     print("\n✅ System ready! Access at: http://localhost:8000")
     print("=" * 60)
 
-# API endpoint to get model info
-@app.get("/api/models")
-async def get_models():
-    """Get information about available models"""
-    dental_class_info = [dental_predictor.get_class_info(c) for c in dental_predictor.class_names]
-    gingivitis_class_info = [gingivitis_predictor.get_class_info(c) for c in gingivitis_predictor.class_names]
-    
-    return JSONResponse({
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Stop background tasks"""
+    await janitor.stop()
+    await job_queue.stop()
+    scheduler.shutdown()
+    degradation.shutdown()
+    rendition_writer.shutdown()
+
+def model_metadata() -> dict:
+    """Static class metadata; results in compact mode reference it by version"""
+    return {
         "dental": {
-            "loaded": dental_predictor.is_loaded,
-            "classes": dental_class_info,
+            "classes": [dental_predictor.get_class_info(c) for c in dental_predictor.class_names],
+            "class_names": dental_predictor.class_names,
             "name": "Teeth Disease Detection",
             "description": "4-class detection for dental conditions"
         },
         "gingivitis": {
-            "loaded": gingivitis_predictor.is_loaded,
-            "classes": gingivitis_class_info,
+            "classes": [gingivitis_predictor.get_class_info(c) for c in gingivitis_predictor.class_names],
+            "class_names": gingivitis_predictor.class_names,
             "name": "Gum Disease Detection",
             "description": "Binary classification for gingivitis"
         }
-    })
+    }
+
+METADATA_VERSION = metadata_version(model_metadata())
+
+# API endpoint to get model info
+@app.get("/api/models")
+async def get_models(request: Request):
+    """Get information about available models"""
+    metadata = model_metadata()
+    metadata["dental"]["loaded"] = dental_predictor.is_loaded
+    metadata["gingivitis"]["loaded"] = gingivitis_predictor.is_loaded
+    metadata["dental"]["lite_loaded"] = dental_predictor.lite_model is not None
+    metadata["gingivitis"]["lite_loaded"] = gingivitis_predictor.lite_model is not None
+    metadata["metadata_version"] = METADATA_VERSION
+    
+    return encode_response(request, metadata)
+
+def get_predictor(model_type: str):
+    """Return the predictor for a model type, or None if unknown"""
+    if model_type == "dental":
+        return dental_predictor
+    elif model_type == "gingivitis":
+        return gingivitis_predictor
+    return None
+
+def shape_result(connection: HTTPConnection, result: dict) -> dict:
+    """Full result by default; model outputs only with ?compact=true"""
+    if not wants_compact(connection):
+        return result
+    predictor = get_predictor(result.get("model_type"))
+    class_names = predictor.class_names if predictor else None
+    return compact_result(result, class_names, METADATA_VERSION)
+
+async def save_upload(upload: IngestedFile) -> dict:
+    """
+    Store an upload by content hash, skipping the write for duplicates.
+    The caller holds a reference until it calls release_upload.
+    """
+    with timed("persist"):
+        return await run_in_threadpool(upload_store.put, upload)
+
+async def release_upload(blob: Optional[dict]):
+    """Hand a stored upload back to retention once the request is done with it"""
+    if blob is not None:
+        await run_in_threadpool(upload_store.release, blob["digest"])
+
+async def run_model(predictor, img, lane: str = INTERACTIVE, allow_degraded: bool = False,
+                    use_cascade: bool = False, tta: str = "off", tiles: int = 0,
+                    near_dup: bool = False, image_id: Optional[str] = None) -> dict:
+    """
+    Score a decoded image on the path the request asked for.
+    With ``allow_degraded`` an overloaded lane is bypassed using the lite model;
+    ``tiles`` > 0 scores overlapping tiles within that budget instead of one
+    squashed view; ``use_cascade`` escalates to the full model only when the
+    lite one is unsure; ``tta`` applies to full-model predictions.
+    Full-model results for a stored ``image_id`` (including cascade
+    escalations) are added to the similar-case index from the same forward
+    pass; lite and tiled results are not indexed. With ``near_dup`` a
+    near-duplicate of a recent image returns its stored result instead.
+    """
+    embed = image_id is not None and predictor.is_loaded
+    if degradation.use_lite(predictor, lane, allow_degraded):
+        return await degradation.run(predictor.predict_image, img, None, True)
+    if tiles:
+        return await scheduler.run(lane, predict_tiled, predictor, img, tiles)
+    if use_cascade and cascade.available(predictor):
+        result = await scheduler.run(lane, cascade.predict, predictor, img, None, tta, embed)
+        await index_similar(predictor, image_id, result)
+        return result
+    
+    variant = f"{predictor.model_type}/{tta}"
+    hashes = None
+    if near_dup and image_id is not None:
+        started = time.time()
+        hashes, duplicate = await run_in_threadpool(near_duplicates.lookup, variant, img)
+        if duplicate is not None:
+            duplicate["processing_time_ms"] = round((time.time() - started) * 1000, 2)
+            return duplicate
+    
+    result = await scheduler.run(lane, predictor.predict_image, img, None, False, tta, embed)
+    await index_similar(predictor, image_id, result)
+    if hashes is not None and not result.get("error"):
+        near_duplicates.add(variant, image_id, hashes, result)
+    return result
+
+async def index_similar(predictor, image_id: Optional[str], result: dict):
+    """Move a result's embedding into the similar-case index"""
+    embedding = result.pop("embedding", None)
+    if embedding is None:
+        return
+    try:
+        await run_in_threadpool(similar_cases.add, predictor.model_type, image_id, embedding, result)
+    except Exception as e:
+        print(f"⚠️ Could not index {image_id} for similar cases: {e}")
+
+def inference_options(connection: HTTPConnection) -> dict:
+    """
+    Per-request options from the query string: the quality gate mode for
+    predict_upload and the inference path options for run_model
+    """
+    return {
+        "quality": quality_mode(connection),
+        "allow_degraded": allows_degraded(connection),
+        "use_cascade": wants_cascade(connection),
+        "tta": tta_mode(connection),
+        "tiles": tile_budget(connection) if wants_tiled(connection) else 0,
+        "near_dup": wants_near_dup(connection)
+    }
+
+def decode_error(predictor, error: Exception) -> dict:
+    return {
+        "prediction": "Error",
+        "confidence": 0.0,
+        "error": f"Could not decode image: {str(error)}",
+        "model_type": predictor.model_type
+    }
+
+def quality_rejection(predictor, quality: dict) -> dict:
+    """Answer for an image that failed the quality gate; the model never ran"""
+    return {
+        "prediction": "Error",
+        "confidence": 0.0,
+        "error": "Image quality too low: " + " ".join(issue["message"] + "." for issue in quality["issues"]),
+        "model_type": predictor.model_type,
+        "quality": quality
+    }
+
+async def inspect_upload(blob: dict, quality: str) -> tuple:
+    """
+    Quality report (None when ``quality`` is off) and the decoded image.
+    The checks use a reduced decode, so an image rejected by the gate is
+    never decoded at full size.
+    """
+    report = img = None
+    if quality != "off":
+        with timed("quality"):
+            report, img = await run_in_threadpool(check_file, str(blob["path"]))
+        if not report["usable"] and quality == "reject":
+            return report, None
+    if img is None:
+        with timed("decode"):
+            img = await run_in_threadpool(load_image, str(blob["path"]))
+    return report, img
+
+async def predict_upload(predictor, blob: dict, lane: str = INTERACTIVE,
+                         quality: str = DEFAULT_QUALITY_MODE, **options) -> dict:
+    """
+    Decode a stored upload once; the same pixels feed inference and renditions.
+    ``quality`` is the quality gate mode (off, flag or reject) and
+    ``options`` select the inference path (see run_model).
+    """
+    check_deadline()
+    try:
+        report, img = await inspect_upload(blob, quality)
+    except Exception as e:
+        return decode_error(predictor, e)
+    if report is not None and not report["usable"] and quality == "reject":
+        return quality_rejection(predictor, report)
+    
+    result = await run_model(predictor, img, lane, image_id=blob["digest"], **options)
+    if report is not None:
+        result["quality"] = report
+    check_deadline()
+    if not result.get("error"):
+        result["renditions"] = rendition_writer.schedule(blob["digest"], img)
+    return result
+
+async def client_gone(request: Request, remaining: int) -> bool:
+    """True once the client has disconnected; remaining batch work is skipped"""
+    if await request.is_disconnected():
+        print(f"🔌 Client disconnected, skipping {remaining} remaining images")
+        return True
+    return False
+
+def absolute_url(path: str) -> str:
+    """URL the React frontend can load from the API origin"""
+    return f"http://localhost:8000{path}"
+
+async def predict_stored(predictor, blob: dict, filename: str, make_url=absolute_url,
+                         lane: str = INTERACTIVE, **options) -> dict:
+    """Predict a stored upload and attach its display URLs"""
+    result = await predict_upload(predictor, blob, lane, **options)
+    
+    # Add display info
+    result["image_url"] = make_url(blob["url"])
+    if "renditions" in result:
+        result["renditions"] = {k: make_url(v) for k, v in result["renditions"].items()}
+    result["image_id"] = blob["digest"]
+    result["filename"] = filename
+    result["upload_time"] = datetime.now().strftime("%H:%M:%S")
+    
+    return result
+
+async def predict_batch_item(predictor, file: IngestedFile, make_url=absolute_url, **options) -> dict:
+    """Store and predict one file of a batch; failures become error entries"""
+    if file.error:
+        return {
+            "filename": file.filename,
+            "error": file.error,
+            "prediction": "Error",
+            "confidence": 0.0
+        }
+    
+    blob = None
+    try:
+        # Save file
+        check_deadline()
+        blob = await save_upload(file)
+        
+        # Predict
+        return await predict_stored(predictor, blob, file.filename, make_url, lane=BATCH, **options)
+        
+    except DeadlineExceeded:
+        raise
+    except Exception as e:
+        return {
+            "filename": file.filename,
+            "error": str(e),
+            "prediction": "Error",
+            "confidence": 0.0
+        }
+    finally:
+        await release_upload(blob)
+
+def encode_event(event: str, data: dict, sse: bool) -> str:
+    """Frame one streamed event as Server-Sent Events or an NDJSON line"""
+    with timed("serialize"):
+        if sse:
+            return f"event: {event}\ndata: {dumps(data).decode()}\n\n"
+        return dumps({"event": event, **data}).decode() + "\n"
+
+def event_stream_response(events, sse: bool) -> StreamingResponse:
+    return StreamingResponse(
+        events,
+        media_type="text/event-stream" if sse else "application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 # API endpoint for single prediction
 @app.post("/api/predict")
-async def predict_api(
-    file: UploadFile = File(...),
-    model_type: str = Form(...)
-):
+async def predict_api(request: Request):
     """API endpoint for single image prediction"""
     try:
-        # Validate file type
-        allowed_types = ['image/jpeg', 'image/png', 'image/jpg']
-        if file.content_type not in allowed_types:
+        form = await ingest_upload(request, max_files=1)
+    except UploadRejected as e:
+        return JSONResponse(status_code=e.status_code, content={"error": e.message})
+    
+    blob = None
+    try:
+        model_type = form.get("model_type")
+        file = form.get_file("file")
+        if file is None:
             return JSONResponse(
                 status_code=400,
-                content={"error": f"Invalid file type. Use: {', '.join(allowed_types)}"}
+                content={"error": "No file uploaded"}
             )
         
-        # Save file
-        filename = f"{uuid.uuid4().hex[:8]}_{file.filename}"
-        file_path = UPLOAD_DIR / filename
-        
-        async with aiofiles.open(file_path, 'wb') as buffer:
-            content = await file.read()
-            if len(content) > 10 * 1024 * 1024:  # 10MB limit
-                return JSONResponse(
-                    status_code=400,
-                    content={"error": "File too large (max 10MB)"}
-                )
-            await buffer.write(content)
-        
-        # Select predictor based on model_type
-        if model_type == "dental":
-            result = dental_predictor.predict(str(file_path))
-        elif model_type == "gingivitis":
-            result = gingivitis_predictor.predict(str(file_path))
-        else:
+        # Size and type were validated while streaming
+        if file.error:
+            return JSONResponse(
+                status_code=file.error_status,
+                content={"error": file.error}
+            )
+        
+        predictor = get_predictor(model_type)
+        if predictor is None:
             return JSONResponse(
                 status_code=400,
                 content={"error": "Invalid model type selected"}
             )
+        label_request(model=model_type)
+        
+        # Save file
+        blob = await save_upload(file)
+        
+        result = await predict_upload(predictor, blob, **inference_options(request))
         
         # Add display info
-        result["image_url"] = f"http://localhost:8000/static/uploads/{filename}"
+        result["image_url"] = absolute_url(blob["url"])
+        if "renditions" in result:
+            result["renditions"] = {k: absolute_url(v) for k, v in result["renditions"].items()}
+        result["image_id"] = blob["digest"]
         result["filename"] = file.filename
         result["upload_time"] = datetime.now().strftime("%H:%M:%S")
         result["selected_model"] = model_type
         
-        return JSONResponse(result)
+        return encode_response(request, shape_result(request, result))
+        
+    except LaneFull as e:
+        return busy_response(e)
+    except DeadlineExceeded:
+        raise
+    except Exception as e:
+        return JSONResponse(
+            status_code=500,
+            content={"error": f"Error: {str(e)}"}
+        )
+    finally:
+        form.close()
+        await release_upload(blob)
+
+# Both models on one upload: stored once, decoded once, scored concurrently
+def summarize_findings(results: list) -> dict:
+    """Conditions flagged by any model, for a one-line overall verdict"""
+    findings = [
+        {"model_type": r["model_type"], "prediction": r["prediction"], "confidence": r["confidence"]}
+        for r in results
+        if not r.get("error") and r["prediction"] != get_predictor(r["model_type"]).healthy_class
+    ]
+    errors = sum(1 for r in results if r.get("error"))
+    return {"findings": findings, "all_clear": not findings and not errors, "errors": errors}
+
+@app.post("/api/analyze_all")
+async def analyze_all_api(request: Request):
+    """
+    Teeth and gum analysis of a single image. The upload is stored and
+    decoded once; each model prepares its own input from the shared pixels
+    and both run on the inference scheduler at the same time, or in a single
+    pass when the fused multi-head model is installed.
+    """
+    start_time = time.time()
+    try:
+        form = await ingest_upload(request, max_files=1)
+    except UploadRejected as e:
+        return JSONResponse(status_code=e.status_code, content={"error": e.message})
+    
+    blob = None
+    try:
+        file = form.get_file("file")
+        if file is None:
+            return JSONResponse(
+                status_code=400,
+                content={"error": "No file uploaded"}
+            )
+        if file.error:
+            return JSONResponse(
+                status_code=file.error_status,
+                content={"error": file.error}
+            )
+        
+        label_request(model="all")
+        blob = await save_upload(file)
+        check_deadline()
+        predictors = (dental_predictor, gingivitis_predictor)
+        options = inference_options(request)
+        quality = options.pop("quality")
+        try:
+            quality_report, img = await inspect_upload(blob, quality)
+        except Exception as e:
+            quality_report = img = None
+            results = [decode_error(p, e) for p in predictors]
+        if quality_report is not None and not quality_report["usable"] and quality == "reject":
+            img = None
+            results = [quality_rejection(p, quality_report) for p in predictors]
+        
+        if img is not None:
+            try:
+                if multihead.serves(**options):
+                    results = await scheduler.run(INTERACTIVE, multihead.predict, *predictors, img)
+                else:
+                    results = await asyncio.gather(*(
+                        run_model(p, img, image_id=blob["digest"], **options) for p in predictors
+                    ))
+            except LaneFull as e:
+                return busy_response(e)
+        
+        check_deadline()
+        report = {
+            "dental": shape_result(request, results[0]),
+            "gingivitis": shape_result(request, results[1]),
+            "summary": summarize_findings(results),
+            "image_url": absolute_url(blob["url"]),
+            "image_id": blob["digest"],
+            "filename": file.filename,
+            "upload_time": datetime.now().strftime("%H:%M:%S"),
+            "processing_time_ms": round((time.time() - start_time) * 1000, 2)
+        }
+        if quality_report is not None:
+            report["quality"] = quality_report
+        if img is not None:
+            renditions = rendition_writer.schedule(blob["digest"], img)
+            report["renditions"] = {k: absolute_url(v) for k, v in renditions.items()}
+        
+        return encode_response(request, report)
         
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         return JSONResponse(
             status_code=500,
             content={"error": f"Error: {str(e)}"}
         )
+    finally:
+        form.close()
+        await release_upload(blob)
+
+# Similar-case search over embeddings of analysed images
+def describe_similar(cases: list) -> list:
+    """Attach image URLs; images removed by retention keep their stored prediction"""
+    for case in cases:
+        blob = upload_store.get(case["image_id"])
+        case["image_url"] = absolute_url(blob["url"]) if blob else None
+    return cases
+
+@app.get("/api/similar/{image_id}")
+async def similar_cases_api(request: Request, image_id: str, model_type: str = "dental", k: int = 5):
+    """Previously analysed images closest to this one in the model's embedding space"""
+    if get_predictor(model_type) is None:
+        return JSONResponse(status_code=400, content={"error": "Invalid model type selected"})
+    
+    cases = await run_in_threadpool(similar_cases.search, model_type, image_id, k)
+    if cases is None:
+        return JSONResponse(status_code=404, content={"error": "Image has not been analysed with this model"})
+    
+    cases = await run_in_threadpool(describe_similar, cases)
+    return encode_response(request, {"image_id": image_id, "model_type": model_type, "cases": cases})
 
 # API endpoint for batch prediction
 @app.post("/api/predict_batch")
-async def predict_batch_api(
-    files: List[UploadFile] = File(...),
-    model_type: str = Form(...)
-):
+async def predict_batch_api(request: Request):
     """API endpoint for batch image prediction"""
-    if not files:
+    try:
+        form = await ingest_upload(request, max_files=MAX_BATCH_FILES)
+    except UploadRejected as e:
+        return JSONResponse(status_code=e.status_code, content={"error": e.message})
+    
+    try:
+        model_type = form.get("model_type")
+        files = form.get_files("files")
+        if not files:
+            return JSONResponse(
+                status_code=400,
+                content={"error": "No files uploaded"}
+            )
+        
+        predictor = get_predictor(model_type)
+        if predictor is None:
+            return JSONResponse(
+                status_code=400,
+                content={"error": "Invalid model type selected"}
+            )
+        label_request(model=model_type, batch_size=len(files))
+        
+        results = []
+        for index, file in enumerate(files):
+            if await client_gone(request, len(files) - index):
+                break
+            result = await predict_batch_item(predictor, file, **inference_options(request))
+            results.append(shape_result(request, result))
+        
+        return encode_response(request, {"results": results, "model_type": model_type})
+    finally:
+        form.close()
+
+# Streaming batch prediction: one NDJSON line (or SSE event) per image
+@app.post("/api/predict_batch/stream")
+async def predict_batch_stream_api(request: Request):
+    """
+    Batch prediction that emits each image's result as soon as it is ready,
+    followed by a summary. Sends Server-Sent Events when the client accepts
+    text/event-stream, NDJSON otherwise. Stops early if the client leaves.
+    """
+    try:
+        form = await ingest_upload(request, max_files=MAX_BATCH_FILES)
+    except UploadRejected as e:
+        return JSONResponse(status_code=e.status_code, content={"error": e.message})
+    
+    model_type = form.get("model_type")
+    files = form.get_files("files")
+    predictor = get_predictor(model_type)
+    if not files or predictor is None:
+        form.close()
         return JSONResponse(
             status_code=400,
-            content={"error": "No files uploaded"}
+            content={"error": "No files uploaded" if not files else "Invalid model type selected"}
         )
+    label_request(model=model_type, batch_size=len(files))
     
-    # Select predictor
-    if model_type == "dental":
-        predictor = dental_predictor
-    elif model_type == "gingivitis":
-        predictor = gingivitis_predictor
-    else:
+    use_sse = "text/event-stream" in request.headers.get("accept", "")
+    options = inference_options(request)
+    
+    async def events():
+        start_time = time.time()
+        completed = failed = 0
+        try:
+            yield encode_event("start", {"total": len(files), "model_type": model_type}, use_sse)
+            for index, file in enumerate(files):
+                try:
+                    result = await predict_batch_item(predictor, file, **options)
+                except DeadlineExceeded as e:
+                    yield encode_event("error", {"error": e.message, "completed": completed}, use_sse)
+                    return
+                completed += 1
+                if result.get("error"):
+                    failed += 1
+                yield encode_event("result", {"index": index, "result": shape_result(request, result)}, use_sse)
+            
+            yield encode_event("summary", attach_timing({
+                "total": len(files),
+                "completed": completed,
+                "failed": failed,
+                "model_type": model_type,
+                "elapsed_ms": round((time.time() - start_time) * 1000, 2)
+            }), use_sse)
+        except asyncio.CancelledError:
+            # Starlette cancels the generator when the client disconnects
+            print(f"⚠️ Batch stream cancelled after {completed}/{len(files)} images")
+            raise
+        finally:
+            form.close()
+    
+    return event_stream_response(events(), use_sse)
+
+# Durable background jobs for large batches
+async def process_job_item(item: dict) -> dict:
+    """Score one queued image of a background job"""
+    predictor = get_predictor(item["model_type"])
+    blob = await run_in_threadpool(upload_store.get, item["digest"])
+    if predictor is None or blob is None or not blob["path"].exists():
+        return {
+            "filename": item["filename"],
+            "error": "Image is no longer available" if predictor else "Invalid model type selected",
+            "prediction": "Error",
+            "confidence": 0.0
+        }
+    with request_labels("job", model=item["model_type"]):
+        return await predict_stored(
+            predictor, blob, item["filename"], lane=BATCH, use_cascade=CASCADE_ENABLED, tta=DEFAULT_TTA_MODE
+        )
+
+# A full batch lane or an expired deadline is retried later instead of failing the image
+job_queue = JobQueue(
+    DATA_DIR / "jobs.sqlite3", handler=process_job_item, transient=(LaneFull, DeadlineExceeded)
+)
+# Images of unfinished jobs are exempt from upload retention
+upload_store.add_pin_source(job_queue.pending_digests)
+janitor.add_store("jobs", job_queue)
+
+def describe_job(job: dict) -> dict:
+    """Job status with links for polling, results and progress events"""
+    base = f"/api/jobs/{job['job_id']}"
+    return {
+        **job,
+        "status_url": base,
+        "results_url": f"{base}/results",
+        "events_url": f"{base}/events"
+    }
+
+@app.post("/api/jobs")
+async def submit_job(request: Request):
+    """
+    Queue a large batch for background scoring and return a job ID at once.
+    Each file is stored as soon as it has been received, so the upload is
+    never held in memory or temp files as a whole.
+    """
+    items = []
+    
+    async def store_file(upload: IngestedFile):
+        if upload.field_name == "files":
+            item = {"filename": upload.filename, "digest": None, "error": upload.error}
+            if not upload.error:
+                try:
+                    item["digest"] = (await save_upload(upload))["digest"]
+                except Exception as e:
+                    item["error"] = str(e)
+            items.append(item)
+        upload.close()
+    
+    async def release_items():
+        for item in items:
+            if item["digest"]:
+                await run_in_threadpool(upload_store.release, item["digest"])
+    
+    try:
+        form = await ingest_upload(
+            request,
+            max_files=MAX_JOB_FILES,
+            max_request_bytes=MAX_JOB_REQUEST_BYTES,
+            on_file=store_file
+        )
+    except UploadRejected as e:
+        await release_items()
+        return JSONResponse(status_code=e.status_code, content={"error": e.message})
+    form.close()
+    
+    model_type = form.get("model_type")
+    if not items or get_predictor(model_type) is None:
+        await release_items()
         return JSONResponse(
             status_code=400,
-            content={"error": "Invalid model type selected"}
+            content={"error": "No files uploaded" if not items else "Invalid model type selected"}
+        )
+    
+    label_request(model=model_type, batch_size=len(items))
+    try:
+        job = await run_in_threadpool(job_queue.submit, model_type, items)
+    finally:
+        # The queued job pins its images from here on
+        await release_items()
+    print(f"📥 Queued job {job['job_id']} with {job['total']} images")
+    return JSONResponse(status_code=202, content=describe_job(job))
+
+@app.get("/api/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Job status and progress counters"""
+    job = await run_in_threadpool(job_queue.status, job_id)
+    if job is None:
+        return JSONResponse(status_code=404, content={"error": "Job not found"})
+    return JSONResponse(describe_job(job))
+
+@app.get("/api/jobs/{job_id}/results")
+async def get_job_results(request: Request, job_id: str, offset: int = 0, limit: int = RESULTS_PAGE_SIZE):
+    """One page of per-image results, in upload order"""
+    job = await run_in_threadpool(job_queue.status, job_id)
+    if job is None:
+        return JSONResponse(status_code=404, content={"error": "Job not found"})
+    
+    results = await run_in_threadpool(job_queue.results, job_id, offset, limit)
+    next_offset = results[-1]["index"] + 1 if results else None
+    results = [shape_result(request, entry) for entry in results]
+    return encode_response(request, {
+        "job_id": job_id,
+        "status": job["status"],
+        "total": job["total"],
+        "offset": offset,
+        "results": results,
+        "next_offset": next_offset if next_offset is not None and next_offset < job["total"] else None
+    })
+
+@app.get("/api/jobs/{job_id}/events")
+async def stream_job_events(request: Request, job_id: str):
+    """
+    Progress updates until the job finishes, as Server-Sent Events when
+    the client accepts text/event-stream and NDJSON otherwise.
+    """
+    job = await run_in_threadpool(job_queue.status, job_id)
+    if job is None:
+        return JSONResponse(status_code=404, content={"error": "Job not found"})
+    
+    use_sse = "text/event-stream" in request.headers.get("accept", "")
+    
+    async def events():
+        current = job
+        while True:
+            if current["status"] in FINISHED_STATUSES:
+                yield encode_event("done", current, use_sse)
+                return
+            yield encode_event("progress", current, use_sse)
+            # Also acts as a heartbeat while a slow image is being scored
+            await job_queue.wait_for_change(timeout=15.0)
+            current = await run_in_threadpool(job_queue.status, job_id)
+            if current is None:
+                return
+    
+    return event_stream_response(events(), use_sse)
+
+@app.delete("/api/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    """Cancel the remaining images of a job"""
+    job = await run_in_threadpool(job_queue.cancel, job_id)
+    if job is None:
+        return JSONResponse(status_code=404, content={"error": "Job not found"})
+    return JSONResponse(describe_job(job))
+
+# Clip analysis: only frames that changed are scored
+@app.post("/api/analyze_video")
+async def analyze_video_api(request: Request):
+    """
+    Score a short video clip (field ``file``, optional ``model_type``,
+    default dental). Returns a clip-level verdict and per-segment timeline.
+    """
+    try:
+        form = await ingest_upload(
+            request,
+            max_files=1,
+            max_file_bytes=MAX_VIDEO_BYTES,
+            max_request_bytes=MAX_VIDEO_BYTES + 1024 * 1024,
+            video=True
         )
+    except UploadRejected as e:
+        return JSONResponse(status_code=e.status_code, content={"error": e.message})
     
-    results = []
-    for file in files:
-        if file.content_type.startswith("image/"):
+    clip_path = None
+    try:
+        model_type = form.get("model_type", "dental")
+        file = form.get_file("file")
+        if file is None:
+            return JSONResponse(status_code=400, content={"error": "No file uploaded"})
+        if file.error:
+            return JSONResponse(status_code=file.error_status, content={"error": file.error})
+        
+        predictor = get_predictor(model_type)
+        if predictor is None:
+            return JSONResponse(status_code=400, content={"error": "Invalid model type selected"})
+        label_request(model=model_type)
+        
+        # OpenCV needs a real path; clips are analysed, not kept
+        def write_clip() -> str:
+            with tempfile.NamedTemporaryFile(suffix=file.extension, delete=False) as clip:
+                for chunk in file.chunks():
+                    clip.write(chunk)
+            return clip.name
+        clip_path = await run_in_threadpool(write_clip)
+        
+        loop = asyncio.get_running_loop()
+        deadline = DEADLINE.get()
+        
+        def predict_frame(img):
+            if deadline is not None and time.monotonic() >= deadline:
+                raise DeadlineExceeded()
+            # Decoding stays on this worker; scoring is queued in the batch lane
+            return asyncio.run_coroutine_threadsafe(
+                scheduler.run(BATCH, predictor.predict_image, img), loop
+            ).result()
+        
+        try:
+            result = await run_in_threadpool(analyze_video, clip_path, predict_frame)
+        except VideoDecodeError as e:
+            return JSONResponse(status_code=400, content={"error": str(e)})
+        except LaneFull as e:
+            return busy_response(e)
+        if result.get("error"):
+            return JSONResponse(status_code=500, content={"error": result["error"]})
+        
+        result["model_type"] = model_type
+        result["filename"] = file.filename
+        print(f"🎞️ {file.filename}: {result['inferences']} inferences for {result['frames_sampled']} sampled frames")
+        return JSONResponse(attach_timing(result))
+    finally:
+        form.close()
+        if clip_path:
+            os.unlink(clip_path)
+
+# Live camera inference: binary frames in, one JSON result per scored frame out
+@app.websocket("/ws/predict")
+async def predict_frames_ws(websocket: WebSocket, model_type: str = "dental"):
+    """
+    Score a continuous stream of JPEG/PNG frames on one connection.
+    Frames are never written to disk. When inference falls behind, only the
+    newest frame is scored and the skipped ones are reported as dropped.
+    A text message {"model_type": "..."} switches the model mid-stream.
+    """
+    await websocket.accept()
+    predictor = get_predictor(model_type)
+    if predictor is None:
+        await websocket.send_json({"type": "error", "error": "Invalid model type selected"})
+        await websocket.close(code=1008)
+        return
+    
+    state = {"predictor": predictor}
+    quality = quality_mode(websocket)
+    slot = LatestFrameSlot()
+    send_lock = asyncio.Lock()
+    
+    async def send(message: dict):
+        async with send_lock:
+            await websocket.send_text(dumps(message).decode())
+    
+    async def score_frame(seq: int, data: bytes, received_at: float) -> dict:
+        """The message answering one frame"""
+        start_time = time.time()
+        try:
+            img = await run_in_threadpool(decode_frame, data)
+        except Exception as e:
+            return {"type": "error", "seq": seq, "error": f"Could not decode frame: {str(e)}"}
+        report = None
+        if quality != "off":
+            report = await run_in_threadpool(check_image, img)
+            # Unusable frames are reported so the client can prompt the user
+            if not report["usable"] and quality == "reject":
+                return {"type": "quality", "seq": seq, "dropped": slot.dropped, "quality": report}
+        try:
+            result = await scheduler.run(INTERACTIVE, state["predictor"].predict_image, img, start_time)
+        except LaneFull as e:
+            return {"type": "error", "seq": seq, "error": e.message}
+        return {
+            "type": "result",
+            "seq": seq,
+            "dropped": slot.dropped,
+            "latency_ms": round((time.time() - received_at) * 1000, 2),
+            **shape_result(websocket, result),
+            **({"quality": report} if report is not None else {})
+        }
+    
+    async def score_frames():
+        while True:
+            seq, data, received_at = await slot.take()
             try:
-                # Save file
-                filename = f"{uuid.uuid4().hex[:8]}_{file.filename}"
-                file_path = UPLOAD_DIR / filename
-                
-                async with aiofiles.open(file_path, 'wb') as buffer:
-                    content = await file.read()
-                    await buffer.write(content)
-                
-                # Predict
-                result = predictor.predict(str(file_path))
-                
-                # Add display info
-                result["image_url"] = f"http://localhost:8000/static/uploads/{filename}"
-                result["filename"] = file.filename
-                result["upload_time"] = datetime.now().strftime("%H:%M:%S")
-                
-                results.append(result)
-                
+                message = await score_frame(seq, data, received_at)
             except Exception as e:
-                results.append({
-                    "filename": file.filename,
-                    "error": str(e),
-                    "prediction": "Error",
-                    "confidence": 0.0
-                })
+                # One bad frame must not stop scoring the ones after it
+                print(f"⚠️ Frame {seq} failed: {e}")
+                message = {"type": "error", "seq": seq, "error": f"Could not score frame: {str(e)}"}
+            # Failing to send means the socket is gone; that ends the scorer
+            await send(message)
+    
+    async def close_after_failure():
+        try:
+            await websocket.close(code=1011)
+        except Exception:
+            pass  # Already closed by the client
+    
+    def scorer_done(task: asyncio.Task):
+        if task.cancelled() or task.exception() is None:
+            return
+        # Without a scorer, frames would be accepted and never answered
+        print(f"⚠️ Frame scorer stopped: {task.exception()}")
+        asyncio.ensure_future(close_after_failure())
     
-    return JSONResponse({"results": results, "model_type": model_type})
+    scorer = asyncio.create_task(score_frames())
+    scorer.add_done_callback(scorer_done)
+    try:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+            
+            data = message.get("bytes")
+            if data is not None:
+                if len(data) > MAX_FRAME_BYTES:
+                    await send({"type": "error", "seq": slot.skip(), "error": "Frame too large"})
+                elif sniff_image_type(data[:SNIFF_BYTES]) is None:
+                    await send({"type": "error", "seq": slot.skip(), "error": "Frames must be JPEG or PNG"})
+                else:
+                    slot.put(data)
+                continue
+            
+            try:
+                control = json.loads(message.get("text") or "{}")
+            except ValueError:
+                control = {}
+            predictor = get_predictor(control.get("model_type"))
+            if predictor is None:
+                await send({"type": "error", "error": "Invalid model type selected"})
+            else:
+                state["predictor"] = predictor
+                await send({"type": "config", "model_type": control["model_type"]})
+    finally:
+        scorer.cancel()
+        print(f"📷 Frame stream closed: {slot.received} received, {slot.dropped} dropped")
 
-@app.get("/", response_class=HTMLResponse)
-async def home(request: Request):
-    """Home page with model selection"""
+def render_index(request: Request, **context):
+    """Render the web interface with model status and class information"""
     dental_class_info = [dental_predictor.get_class_info(c) for c in dental_predictor.class_names]
     gingivitis_class_info = [gingivitis_predictor.get_class_info(c) for c in gingivitis_predictor.class_names]
     
@@ -201,236 +1062,120 @@ async def home(request: Request):
         "index.html",
         {
             "request": request,
-            "title": "Dental & Gum Disease Classifier",
             "dental_model_loaded": dental_predictor.is_loaded,
             "gingivitis_model_loaded": gingivitis_predictor.is_loaded,
             "dental_class_info": dental_class_info,
-            "gingivitis_class_info": gingivitis_class_info
+            "gingivitis_class_info": gingivitis_class_info,
+            **context
         }
     )
 
+@app.get("/", response_class=HTMLResponse)
+async def home(request: Request):
+    """Home page with model selection"""
+    return render_index(request, title="Dental & Gum Disease Classifier")
+
 @app.post("/predict")
-async def predict_single_image(
-    request: Request,
-    file: UploadFile = File(...),
-    model_type: str = Form(...)
-):
+async def predict_single_image(request: Request):
     """Predict single dental image with selected model"""
     try:
-        # Validate file type
-        allowed_types = ['image/jpeg', 'image/png', 'image/jpg']
-        if file.content_type not in allowed_types:
-            dental_class_info = [dental_predictor.get_class_info(c) for c in dental_predictor.class_names]
-            gingivitis_class_info = [gingivitis_predictor.get_class_info(c) for c in gingivitis_predictor.class_names]
-            
-            return templates.TemplateResponse(
-                "index.html",
-                {
-                    "request": request,
-                    "error": f"Invalid file type. Use: {', '.join(allowed_types)}",
-                    "dental_model_loaded": dental_predictor.is_loaded,
-                    "gingivitis_model_loaded": gingivitis_predictor.is_loaded,
-                    "dental_class_info": dental_class_info,
-                    "gingivitis_class_info": gingivitis_class_info
-                }
-            )
+        form = await ingest_upload(request, max_files=1)
+    except UploadRejected as e:
+        return render_index(request, error=e.message)
+    
+    blob = None
+    try:
+        model_type = form.get("model_type")
+        file = form.get_file("file")
+        if file is None:
+            return render_index(request, error="No file uploaded")
+        
+        # Size and type were validated while streaming
+        if file.error:
+            return render_index(request, error=file.error)
+        
+        predictor = get_predictor(model_type)
+        if predictor is None:
+            return render_index(request, error="Invalid model type selected")
+        label_request(model=model_type)
         
         # Save file
-        filename = f"{uuid.uuid4().hex[:8]}_{file.filename}"
-        file_path = UPLOAD_DIR / filename
-        
-        async with aiofiles.open(file_path, 'wb') as buffer:
-            content = await file.read()
-            if len(content) > 10 * 1024 * 1024:  # 10MB limit
-                dental_class_info = [dental_predictor.get_class_info(c) for c in dental_predictor.class_names]
-                gingivitis_class_info = [gingivitis_predictor.get_class_info(c) for c in gingivitis_predictor.class_names]
-                
-                return templates.TemplateResponse(
-                    "index.html",
-                    {
-                        "request": request,
-                        "error": "File too large (max 10MB)",
-                        "dental_model_loaded": dental_predictor.is_loaded,
-                        "gingivitis_model_loaded": gingivitis_predictor.is_loaded,
-                        "dental_class_info": dental_class_info,
-                        "gingivitis_class_info": gingivitis_class_info
-                    }
-                )
-            await buffer.write(content)
-        
-        # Select predictor based on model_type
-        if model_type == "dental":
-            result = dental_predictor.predict(str(file_path))
-            class_info = [dental_predictor.get_class_info(c) for c in dental_predictor.class_names]
-        elif model_type == "gingivitis":
-            result = gingivitis_predictor.predict(str(file_path))
-            class_info = [gingivitis_predictor.get_class_info(c) for c in gingivitis_predictor.class_names]
-        else:
-            dental_class_info = [dental_predictor.get_class_info(c) for c in dental_predictor.class_names]
-            gingivitis_class_info = [gingivitis_predictor.get_class_info(c) for c in gingivitis_predictor.class_names]
-            
-            return templates.TemplateResponse(
-                "index.html",
-                {
-                    "request": request,
-                    "error": "Invalid model type selected",
-                    "dental_model_loaded": dental_predictor.is_loaded,
-                    "gingivitis_model_loaded": gingivitis_predictor.is_loaded,
-                    "dental_class_info": dental_class_info,
-                    "gingivitis_class_info": gingivitis_class_info
-                }
-            )
+        blob = await save_upload(file)
+        
+        result = await predict_upload(predictor, blob)
+        class_info = [predictor.get_class_info(c) for c in predictor.class_names]
         
         # Add display info
-        result["image_url"] = f"/static/uploads/{filename}"
+        result["image_url"] = blob["url"]
         result["filename"] = file.filename
         result["upload_time"] = datetime.now().strftime("%H:%M:%S")
         result["selected_model"] = model_type
         
-        dental_class_info = [dental_predictor.get_class_info(c) for c in dental_predictor.class_names]
-        gingivitis_class_info = [gingivitis_predictor.get_class_info(c) for c in gingivitis_predictor.class_names]
-        
-        return templates.TemplateResponse(
-            "index.html",
-            {
-                "request": request,
-                "result": result,
-                "image_url": result["image_url"],
-                "dental_model_loaded": dental_predictor.is_loaded,
-                "gingivitis_model_loaded": gingivitis_predictor.is_loaded,
-                "dental_class_info": dental_class_info,
-                "gingivitis_class_info": gingivitis_class_info,
-                "class_info": class_info
-            }
+        return render_index(
+            request,
+            result=result,
+            image_url=result["image_url"],
+            class_info=class_info
         )
         
     except Exception as e:
-        dental_class_info = [dental_predictor.get_class_info(c) for c in dental_predictor.class_names]
-        gingivitis_class_info = [gingivitis_predictor.get_class_info(c) for c in gingivitis_predictor.class_names]
-        
-        return templates.TemplateResponse(
-            "index.html",
-            {
-                "request": request,
-                "error": f"Error: {str(e)}",
-                "dental_model_loaded": dental_predictor.is_loaded,
-                "gingivitis_model_loaded": gingivitis_predictor.is_loaded,
-                "dental_class_info": dental_class_info,
-                "gingivitis_class_info": gingivitis_class_info
-            }
-        )
+        return render_index(request, error=f"Error: {str(e)}")
+    finally:
+        form.close()
+        await release_upload(blob)
 
 @app.post("/predict_batch")
-async def predict_batch_images(
-    request: Request,
-    files: List[UploadFile] = File(...),
-    model_type: str = Form(...)
-):
+async def predict_batch_images(request: Request):
     """Predict multiple dental images"""
-    if not files:
-        dental_class_info = [dental_predictor.get_class_info(c) for c in dental_predictor.class_names]
-        gingivitis_class_info = [gingivitis_predictor.get_class_info(c) for c in gingivitis_predictor.class_names]
-        
-        return templates.TemplateResponse(
-            "index.html",
-            {
-                "request": request,
-                "error": "No files uploaded",
-                "dental_model_loaded": dental_predictor.is_loaded,
-                "gingivitis_model_loaded": gingivitis_predictor.is_loaded,
-                "dental_class_info": dental_class_info,
-                "gingivitis_class_info": gingivitis_class_info
-            }
-        )
+    try:
+        form = await ingest_upload(request, max_files=MAX_BATCH_FILES)
+    except UploadRejected as e:
+        return render_index(request, error=e.message)
     
-    # Select predictor
-    if model_type == "dental":
-        predictor = dental_predictor
-        class_info = [dental_predictor.get_class_info(c) for c in dental_predictor.class_names]
-    elif model_type == "gingivitis":
-        predictor = gingivitis_predictor
-        class_info = [gingivitis_predictor.get_class_info(c) for c in gingivitis_predictor.class_names]
-    else:
-        dental_class_info = [dental_predictor.get_class_info(c) for c in dental_predictor.class_names]
-        gingivitis_class_info = [gingivitis_predictor.get_class_info(c) for c in gingivitis_predictor.class_names]
-        
-        return templates.TemplateResponse(
-            "index.html",
-            {
-                "request": request,
-                "error": "Invalid model type selected",
-                "dental_model_loaded": dental_predictor.is_loaded,
-                "gingivitis_model_loaded": gingivitis_predictor.is_loaded,
-                "dental_class_info": dental_class_info,
-                "gingivitis_class_info": gingivitis_class_info
-            }
+    try:
+        model_type = form.get("model_type")
+        files = form.get_files("files")
+        if not files:
+            return render_index(request, error="No files uploaded")
+        
+        # Select predictor
+        predictor = get_predictor(model_type)
+        if predictor is None:
+            return render_index(request, error="Invalid model type selected")
+        label_request(model=model_type, batch_size=len(files))
+        class_info = [predictor.get_class_info(c) for c in predictor.class_names]
+        
+        results = []
+        for index, file in enumerate(files):
+            if await client_gone(request, len(files) - index):
+                break
+            results.append(await predict_batch_item(predictor, file, make_url=lambda url: url))
+        
+        return render_index(
+            request,
+            batch_results=results,
+            batch_mode=True,
+            selected_model=model_type,
+            class_info=class_info
         )
-    
-    results = []
-    for file in files:
-        if file.content_type.startswith("image/"):
-            try:
-                # Save file
-                filename = f"{uuid.uuid4().hex[:8]}_{file.filename}"
-                file_path = UPLOAD_DIR / filename
-                
-                async with aiofiles.open(file_path, 'wb') as buffer:
-                    content = await file.read()
-                    await buffer.write(content)
-                
-                # Predict
-                result = predictor.predict(str(file_path))
-                
-                # Add display info
-                result["image_url"] = f"/static/uploads/{filename}"
-                result["filename"] = file.filename
-                result["upload_time"] = datetime.now().strftime("%H:%M:%S")
-                
-                results.append(result)
-                
-            except Exception as e:
-                results.append({
-                    "filename": file.filename,
-                    "error": str(e),
-                    "prediction": "Error",
-                    "confidence": 0.0
-                })
-    
-    dental_class_info = [dental_predictor.get_class_info(c) for c in dental_predictor.class_names]
-    gingivitis_class_info = [gingivitis_predictor.get_class_info(c) for c in gingivitis_predictor.class_names]
-    
-    return templates.TemplateResponse(
-        "index.html",
-        {
-            "request": request,
-            "batch_results": results,
-            "batch_mode": True,
-            "selected_model": model_type,
-            "dental_model_loaded": dental_predictor.is_loaded,
-            "gingivitis_model_loaded": gingivitis_predictor.is_loaded,
-            "dental_class_info": dental_class_info,
-            "gingivitis_class_info": gingivitis_class_info,
-            "class_info": class_info
-        }
-    )
+    finally:
+        form.close()
 
 @app.get("/clear")
 async def clear_files():
     """Clear uploaded files"""
-    deleted = 0
-    for file_path in UPLOAD_DIR.iterdir():
-        if file_path.is_file():
-            try:
-                file_path.unlink()
-                deleted += 1
-            except:
-                pass
+    deleted = await janitor.purge("uploads")
     
     return JSONResponse({
         "message": f"Cleared {deleted} files",
         "status": "success"
     })
 
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics: stage latency histograms, queue and model gauges"""
+    return metrics_response()
+
 @app.get("/health")
 async def health_check():
     """Health check"""
@@ -440,6 +1185,16 @@ async def health_check():
         "gingivitis_model_loaded": gingivitis_predictor.is_loaded,
         "dental_classes": dental_predictor.class_names,
         "gingivitis_classes": gingivitis_predictor.class_names,
+        "storage": janitor.metrics(),
+        "renditions": rendition_writer.stats(),
+        "admission": admission.stats(),
+        "scheduler": scheduler.stats(),
+        "degradation": degradation.stats({"dental": dental_predictor, "gingivitis": gingivitis_predictor}),
+        "cascade": cascade.stats(),
+        "multihead": multihead.stats(),
+        "similar_cases": similar_cases.stats(),
+        "near_duplicates": near_duplicates.stats(),
+        "quality_gate": {"default_mode": DEFAULT_QUALITY_MODE, "thresholds": QUALITY_THRESHOLDS},
         "timestamp": datetime.now().isoformat()
     })
 
@@ -1 +1,9 @@
 # Services package
+import sys
+from pathlib import Path
+
+# Modules shared with the standalone backends live in dental_common/ at the
+# repository root
+REPO_ROOT = str(Path(__file__).resolve().parents[4])
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
@@ -0,0 +1,260 @@
+"""
+Admission control in front of inference.
+
+Requests to inference routes are admitted before their body is read:
+a global bound on admitted requests, a cap on the upload bytes they may
+hold in flight, and a per-client token bucket. Anything over a limit is
+rejected at once with 429/503 and a Retry-After hint, so overload sheds
+load predictably instead of queueing unbounded work and memory.
+
+The per-client bucket is keyed by the peer address. Forwarding headers are
+only believed when the peer is one of ``DENTAL_TRUSTED_PROXIES``; a header
+sent by anyone else is ignored, so it can never lift the limit.
+"""
+
+import os
+import math
+import time
+import ipaddress
+from typing import Dict, Any, Optional, Set, Tuple
+
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Scope, Receive, Send
+
+MAX_QUEUE = int(os.getenv("DENTAL_MAX_QUEUE", "32"))
+MAX_INFLIGHT_BYTES = int(os.getenv("DENTAL_MAX_INFLIGHT_MB", "256")) * 1024 * 1024
+RATE_PER_MINUTE = float(os.getenv("DENTAL_RATE_LIMIT_PER_MIN", "120"))
+RATE_BURST = float(os.getenv("DENTAL_RATE_BURST", "30"))
+# Comma-separated addresses or networks of reverse proxies, e.g. "127.0.0.1,10.0.0.0/8"
+TRUSTED_PROXIES = tuple(
+    ipaddress.ip_network(entry.strip(), strict=False)
+    for entry in os.getenv("DENTAL_TRUSTED_PROXIES", "").split(",") if entry.strip()
+)
+MAX_TRACKED_CLIENTS = 10000
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request is shed; carries the HTTP status and retry hint"""
+
+    def __init__(self, message: str, status_code: int, retry_after: int, reason: str):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+class TokenBucket:
+    """Classic token bucket refilled continuously at ``rate`` tokens/second"""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, now: float, cost: float = 1.0) -> float:
+        """Consume tokens; returns 0 on success or seconds until enough refill"""
+        self.refill(now)
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return 0.0
+        return (cost - self.tokens) / self.rate if self.rate > 0 else 60.0
+
+
+class AdmissionController:
+    """Bounded admission with byte budget, per-client rate limits and counters"""
+
+    def __init__(self, max_queue: int = MAX_QUEUE, max_inflight_bytes: int = MAX_INFLIGHT_BYTES,
+                 rate_per_minute: float = RATE_PER_MINUTE, burst: float = RATE_BURST, workers: int = 1):
+        self.max_queue = max_queue
+        self.max_inflight_bytes = max_inflight_bytes
+        self.rate = rate_per_minute / 60.0
+        self.burst = burst
+        self.workers = max(1, workers)
+        self.depth = 0
+        self.inflight_bytes = 0
+        self.service_time_s = 1.0  # EWMA of admitted request duration
+        self.buckets: Dict[str, TokenBucket] = {}
+        self.counters = {
+            "admitted": 0,
+            "completed": 0,
+            "rejected_queue_full": 0,
+            "rejected_bytes": 0,
+            "rejected_rate_limited": 0
+        }
+
+    def check_rate(self, client: str):
+        """Charge one token to the client or raise a 429"""
+        if self.rate <= 0:
+            return
+        now = time.monotonic()
+        bucket = self.buckets.get(client)
+        if bucket is None:
+            if len(self.buckets) >= MAX_TRACKED_CLIENTS:
+                self._prune(now)
+            bucket = self.buckets[client] = TokenBucket(self.rate, self.burst)
+
+        wait = bucket.take(now)
+        if wait:
+            self.counters["rejected_rate_limited"] += 1
+            raise AdmissionRejected("Rate limit exceeded", 429, max(1, math.ceil(wait)), "rate_limited")
+
+    def admit(self, client: str, request_bytes: int) -> Tuple[int, float]:
+        """Admit an inference request or raise; returns a ticket for release()"""
+        if self.depth >= self.max_queue:
+            self.counters["rejected_queue_full"] += 1
+            raise AdmissionRejected("Server busy, try again shortly", 503, self._drain_estimate(), "queue_full")
+        # A single oversized request is still admitted when nothing else is in flight
+        if self.inflight_bytes and self.inflight_bytes + request_bytes > self.max_inflight_bytes:
+            self.counters["rejected_bytes"] += 1
+            raise AdmissionRejected("Server busy, try again shortly", 503, self._drain_estimate(), "bytes")
+
+        self.check_rate(client)
+
+        self.depth += 1
+        self.inflight_bytes += request_bytes
+        self.counters["admitted"] += 1
+        return request_bytes, time.monotonic()
+
+    def release(self, ticket: Tuple[int, float]):
+        request_bytes, admitted_at = ticket
+        self.depth -= 1
+        self.inflight_bytes -= request_bytes
+        self.counters["completed"] += 1
+        self.service_time_s = 0.8 * self.service_time_s + 0.2 * (time.monotonic() - admitted_at)
+
+    def _drain_estimate(self) -> int:
+        return max(1, math.ceil(self.service_time_s * self.depth / self.workers))
+
+    def _prune(self, now: float):
+        # Drop buckets that have refilled completely; they carry no state
+        for client in [c for c, b in self.buckets.items() if b.tokens + (now - b.updated) * b.rate >= b.burst]:
+            del self.buckets[client]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queue_depth": self.depth,
+            "max_queue": self.max_queue,
+            "inflight_bytes": self.inflight_bytes,
+            "max_inflight_bytes": self.max_inflight_bytes,
+            "rate_limit_per_min": round(self.rate * 60, 2),
+            "rate_burst": self.burst,
+            "tracked_clients": len(self.buckets),
+            "estimated_wait_s": self._drain_estimate() if self.depth else 0,
+            **self.counters
+        }
+
+
+def is_trusted_proxy(address: str, proxies=TRUSTED_PROXIES) -> bool:
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(ip in network for network in proxies)
+
+
+def client_id(scope: Scope, proxies=TRUSTED_PROXIES) -> str:
+    """
+    Peer address of the request. When the peer is a trusted proxy, the
+    X-Forwarded-For chain is walked from the right and the first hop that
+    is not itself a trusted proxy is the client.
+    """
+    client = scope.get("client")
+    peer = client[0] if client else "unknown"
+    if not proxies or not is_trusted_proxy(peer, proxies):
+        return peer
+
+    hops = []
+    for name, value in scope.get("headers", []):
+        if name == b"x-forwarded-for":
+            hops.extend(hop.strip() for hop in value.decode("latin-1").split(","))
+    for hop in reversed(hops):
+        if hop and not is_trusted_proxy(hop, proxies):
+            return hop
+    return peer
+
+
+def watch_admission(controller: AdmissionController, registry):
+    """Admission state and rejection counts in a metrics registry"""
+    registry.gauge("dental_admission_queued", "Inference requests admitted and not yet finished", (),
+                   lambda: controller.depth)
+    registry.gauge("dental_admission_inflight_bytes", "Upload bytes held by admitted requests", (),
+                   lambda: controller.inflight_bytes)
+    registry.gauge("dental_admission_tracked_clients", "Clients with a rate-limit bucket", (),
+                   lambda: len(controller.buckets))
+    registry.collected_counter("dental_admission_admitted_total", "Inference requests admitted", (),
+                               lambda: controller.counters["admitted"])
+    registry.collected_counter(
+        "dental_admission_rejected_total", "Requests shed by admission control", ("reason",),
+        lambda: {(reason,): controller.counters[f"rejected_{reason}"]
+                 for reason in ("queue_full", "bytes", "rate_limited")}
+    )
+
+
+class AdmissionMiddleware:
+    """
+    ASGI middleware applying an AdmissionController to selected routes.
+
+    ``guarded`` routes go through the full admission check and hold their
+    slot until the response body has been sent (streams included);
+    ``rate_limited`` routes are only charged against the client's bucket.
+    """
+
+    def __init__(self, app: ASGIApp, controller: AdmissionController,
+                 guarded: Set[Tuple[str, str]], rate_limited: Optional[Set[Tuple[str, str]]] = None,
+                 fallback_bytes: int = 0):
+        self.app = app
+        self.controller = controller
+        self.guarded = guarded
+        self.rate_limited = rate_limited or set()
+        self.fallback_bytes = fallback_bytes
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        route = (scope["method"], scope["path"])
+        if route in self.rate_limited:
+            try:
+                self.controller.check_rate(client_id(scope))
+            except AdmissionRejected as e:
+                await self.reject(e, scope, receive, send)
+                return
+            await self.app(scope, receive, send)
+            return
+
+        if route not in self.guarded:
+            await self.app(scope, receive, send)
+            return
+
+        try:
+            ticket = self.controller.admit(client_id(scope), self.request_bytes(scope))
+        except AdmissionRejected as e:
+            await self.reject(e, scope, receive, send)
+            return
+
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.controller.release(ticket)
+
+    def request_bytes(self, scope: Scope) -> int:
+        for name, value in scope.get("headers", []):
+            if name == b"content-length" and value.isdigit():
+                return int(value)
+        # Unknown length (chunked): budget as the largest allowed request
+        return self.fallback_bytes
+
+    async def reject(self, error: AdmissionRejected, scope: Scope, receive: Receive, send: Send):
+        response = JSONResponse(
+            status_code=error.status_code,
+            content={"error": error.message, "reason": error.reason, "retry_after": error.retry_after},
+            headers={"Retry-After": str(error.retry_after)}
+        )
+        await response(scope, receive, send)
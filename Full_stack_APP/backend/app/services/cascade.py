@@ -0,0 +1,105 @@
+"""
+Confidence-gated model cascade.
+
+The lite model scores every image first. Its answer is kept when the
+confidence for the predicted class reaches that class's threshold;
+anything less certain is escalated to the full model. Thresholds are
+per model and per class, calibrated on a labelled folder with
+``evaluate_cascade.py`` and read from ``models/cascade_thresholds.json``.
+"""
+
+import os
+import json
+import time
+from pathlib import Path
+from typing import Dict, Any, Optional
+
+from starlette.requests import HTTPConnection
+
+CASCADE_ENABLED = os.getenv("DENTAL_CASCADE", "0") == "1"
+DEFAULT_THRESHOLD = float(os.getenv("DENTAL_CASCADE_THRESHOLD", "0.9"))
+THRESHOLDS_PATH = Path(os.getenv(
+    "DENTAL_CASCADE_THRESHOLDS",
+    str(Path(__file__).parent.parent / "models" / "cascade_thresholds.json")
+))
+
+
+def load_thresholds(path: Path = THRESHOLDS_PATH) -> Dict[str, Dict[str, float]]:
+    """{model_type: {class_name: threshold}}; an empty dict if the file is missing"""
+    if not path.exists():
+        return {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            thresholds = json.load(f)
+        return {model: {name: float(value) for name, value in classes.items()} for model, classes in thresholds.items()}
+    except Exception as e:
+        print(f"⚠️ Could not read cascade thresholds {path}: {e}")
+        return {}
+
+
+def wants_cascade(connection: HTTPConnection) -> bool:
+    """Server default, overridable per request with ?cascade=true|false"""
+    value = connection.query_params.get("cascade", "").lower()
+    if value in ("1", "true", "yes"):
+        return True
+    if value in ("0", "false", "no"):
+        return False
+    return CASCADE_ENABLED
+
+
+class ModelCascade:
+    """Runs lite-then-full prediction and counts how often it escalates"""
+
+    def __init__(self, thresholds: Optional[Dict[str, Dict[str, float]]] = None,
+                 default_threshold: float = DEFAULT_THRESHOLD):
+        self.thresholds = load_thresholds() if thresholds is None else thresholds
+        self.default_threshold = default_threshold
+        self.counters = {"requests": 0, "escalated": 0}
+
+    def threshold(self, model_type: str, class_name: str) -> float:
+        return self.thresholds.get(model_type, {}).get(class_name, self.default_threshold)
+
+    def available(self, predictor) -> bool:
+        return predictor.lite_model is not None and predictor.model is not None
+
+    def predict(self, predictor, img, start_time: Optional[float] = None, tta: str = "off",
+                embed: bool = False) -> Dict[str, Any]:
+        """
+        Blocking; call through the scheduler like any other model call.
+        ``embed`` is passed to the full model, so escalated results carry
+        an ``embedding``.
+        """
+        start_time = start_time or time.time()
+        self.counters["requests"] += 1
+
+        lite = predictor.predict_image(img, start_time, lite=True)
+        if lite.get("error"):
+            return lite
+        # Confident lite answers are final, not an overload fallback
+        lite["degraded"] = False
+
+        threshold = self.threshold(predictor.model_type, lite["prediction"])
+        if lite["confidence"] / 100 >= threshold:
+            lite["cascade"] = {"stage": "lite", "escalated": False, "threshold": threshold}
+            return lite
+
+        self.counters["escalated"] += 1
+        result = predictor.predict_image(img, start_time, tta=tta, embed=embed)
+        result["cascade"] = {
+            "stage": "full",
+            "escalated": True,
+            "threshold": threshold,
+            "lite_prediction": lite["prediction"],
+            "lite_confidence": lite["confidence"]
+        }
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        requests = self.counters["requests"]
+        return {
+            "enabled_by_default": CASCADE_ENABLED,
+            "default_threshold": self.default_threshold,
+            "thresholds": self.thresholds,
+            "escalation_rate": round(self.counters["escalated"] / requests, 4) if requests else 0.0,
+            **self.counters
+        }
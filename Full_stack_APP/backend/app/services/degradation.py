@@ -0,0 +1,82 @@
+"""
+Overload degradation to lightweight models.
+
+When the expected queue wait for a lane exceeds the latency SLO, requests
+that opted in (``?allow_degraded=true``) skip the queue and are scored by
+the predictor's lite model on a small pool of its own. Their results carry
+``degraded: true``. The switch has hysteresis: full-fidelity scoring
+resumes once the expected wait falls below the recovery threshold.
+"""
+
+import os
+import time
+import asyncio
+import functools
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Optional
+
+from starlette.requests import HTTPConnection
+
+SLO_MS = float(os.getenv("DENTAL_DEGRADE_SLO_MS", "2000"))
+RECOVER_MS = float(os.getenv("DENTAL_DEGRADE_RECOVER_MS", str(SLO_MS / 2)))
+DEGRADED_WORKERS = int(os.getenv("DENTAL_DEGRADED_WORKERS", "1"))
+
+
+def allows_degraded(connection: HTTPConnection) -> bool:
+    return connection.query_params.get("allow_degraded", "").lower() in ("1", "true", "yes")
+
+
+class DegradationPolicy:
+    """Tracks overload per lane from scheduler queue delay and runs lite-model calls"""
+
+    def __init__(self, scheduler, slo_ms: float = SLO_MS, recover_ms: float = RECOVER_MS,
+                 workers: int = DEGRADED_WORKERS):
+        self.scheduler = scheduler
+        self.slo_ms = slo_ms
+        self.recover_ms = min(recover_ms, slo_ms)
+        self.workers = max(1, workers)
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="degraded")
+        self.overloaded: Dict[str, float] = {}  # lane -> overloaded since (wall clock)
+        self.counters = {"activations": 0, "degraded_results": 0}
+
+    def should_degrade(self, lane: str) -> bool:
+        """Re-evaluate the lane against the SLO; True while it is overloaded"""
+        if self.slo_ms <= 0:
+            return False
+        delay_ms = self.scheduler.queue_delay(lane) * 1000
+        if lane not in self.overloaded and delay_ms > self.slo_ms:
+            self.overloaded[lane] = time.time()
+            self.counters["activations"] += 1
+            print(f"🐢 {lane} queue wait {delay_ms:.0f} ms over SLO, serving lite models to opted-in requests")
+        elif lane in self.overloaded and delay_ms < self.recover_ms:
+            del self.overloaded[lane]
+            print(f"✅ {lane} queue recovered ({delay_ms:.0f} ms), back to full models")
+        return lane in self.overloaded
+
+    def use_lite(self, predictor, lane: str, allowed: bool) -> bool:
+        return allowed and getattr(predictor, "lite_model", None) is not None and self.should_degrade(lane)
+
+    async def run(self, func, *args, **kwargs):
+        """
+        Run a lite-model call outside the scheduler's queue, in a copy of
+        the caller's context so metric labels and the deadline carry over
+        """
+        self.counters["degraded_results"] += 1
+        loop = asyncio.get_running_loop()
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(self.executor, functools.partial(context.run, func, *args, **kwargs))
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
+
+    def stats(self, predictors: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        stats = {
+            "slo_ms": self.slo_ms,
+            "recover_ms": self.recover_ms,
+            "overloaded_lanes": {lane: round(time.time() - since, 1) for lane, since in self.overloaded.items()},
+            **self.counters
+        }
+        if predictors:
+            stats["lite_models"] = {name: p.lite_model is not None for name, p in predictors.items()}
+        return stats
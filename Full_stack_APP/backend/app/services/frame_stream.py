@@ -0,0 +1,59 @@
+"""
+Helpers for live camera frame inference over a WebSocket.
+
+Frames arrive faster than the model can score them, so only the newest
+unscored frame is kept: when inference falls behind, older frames are
+overwritten and counted as dropped instead of queueing up latency.
+"""
+
+import io
+import os
+import time
+import asyncio
+from typing import Optional, Tuple
+
+from PIL import Image
+
+MAX_FRAME_BYTES = int(os.getenv("DENTAL_MAX_FRAME_KB", "2048")) * 1024
+# JPEG frames are decoded at a reduced DCT scale, but never below this side
+FRAME_DECODE_SIZE = 448
+
+
+def decode_frame(data: bytes, min_side: int = FRAME_DECODE_SIZE) -> Image.Image:
+    """Decode a camera frame to RGB, letting libjpeg skip unneeded resolution"""
+    img = Image.open(io.BytesIO(data))
+    img.draft("RGB", (min_side, min_side))
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+    return img
+
+
+class LatestFrameSlot:
+    """Single-slot mailbox that keeps only the most recent frame"""
+
+    def __init__(self):
+        self.received = 0
+        self.dropped = 0
+        self._frame: Optional[Tuple[int, bytes, float]] = None
+        self._ready = asyncio.Event()
+
+    def put(self, data: bytes) -> int:
+        """Store a frame, replacing any unscored one; returns its sequence number"""
+        self.received += 1
+        if self._frame is not None:
+            self.dropped += 1
+        self._frame = (self.received, data, time.time())
+        self._ready.set()
+        return self.received
+
+    def skip(self) -> int:
+        """Count a frame that will not be scored; returns its sequence number"""
+        self.received += 1
+        return self.received
+
+    async def take(self) -> Tuple[int, bytes, float]:
+        """Wait for the newest frame; returns (sequence, data, received at)"""
+        await self._ready.wait()
+        self._ready.clear()
+        frame, self._frame = self._frame, None
+        return frame
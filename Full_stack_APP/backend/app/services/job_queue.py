@@ -0,0 +1,389 @@
+"""
+Durable job queue for large batch scoring.
+
+Jobs and their items live in a small SQLite (WAL) database, so submitted
+work survives restarts. Workers claim one image at a time; images left
+running by a crash or deploy are re-queued on startup, so a job resumes
+where it stopped instead of starting over. Images that hit a transient
+error (a full scheduler lane, say) go back to the queue with exponential
+backoff and only fail after ``DENTAL_JOB_MAX_ATTEMPTS`` attempts.
+"""
+
+import os
+import json
+import time
+import uuid
+import sqlite3
+import asyncio
+import threading
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Tuple, Set, Callable, Awaitable
+
+from fastapi.concurrency import run_in_threadpool
+
+JOB_WORKERS = int(os.getenv("DENTAL_JOB_WORKERS", "1"))
+MAX_JOB_FILES = int(os.getenv("DENTAL_MAX_JOB_FILES", "5000"))
+MAX_JOB_REQUEST_BYTES = int(os.getenv("DENTAL_MAX_JOB_REQUEST_MB", "2048")) * 1024 * 1024
+RESULTS_PAGE_SIZE = 100
+MAX_RESULTS_PAGE_SIZE = 1000
+IDLE_POLL_SECONDS = 1.0
+MAX_ATTEMPTS = int(os.getenv("DENTAL_JOB_MAX_ATTEMPTS", "8"))
+RETRY_BASE_SECONDS = float(os.getenv("DENTAL_JOB_RETRY_BASE_S", "2"))
+RETRY_MAX_SECONDS = 60.0
+
+FINISHED_STATUSES = ("completed", "cancelled")
+
+
+class JobQueue:
+    """SQLite-backed queue of batch jobs, processed item by item"""
+
+    def __init__(self, index_path: Path, handler: Callable[[Dict[str, Any]], Awaitable[Dict[str, Any]]],
+                 workers: int = JOB_WORKERS, transient: Tuple[type, ...] = (),
+                 max_attempts: int = MAX_ATTEMPTS):
+        self.handler = handler
+        self.workers = max(1, workers)
+        # Handler exceptions worth retrying; any other exception fails the image
+        self.transient = tuple(transient)
+        self.max_attempts = max(1, max_attempts)
+        Path(index_path).parent.mkdir(parents=True, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(index_path), check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                model_type TEXT NOT NULL,
+                status TEXT NOT NULL,
+                total INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                started_at REAL,
+                finished_at REAL
+            )
+        """)
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS job_items (
+                job_id TEXT NOT NULL,
+                idx INTEGER NOT NULL,
+                filename TEXT,
+                digest TEXT,
+                status TEXT NOT NULL,
+                result TEXT,
+                updated_at REAL NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                retry_at REAL NOT NULL DEFAULT 0,
+                PRIMARY KEY (job_id, idx)
+            )
+        """)
+        # Databases created before retries were added lack the retry columns
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(job_items)")}
+        if "attempts" not in columns:
+            self._db.execute("ALTER TABLE job_items ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0")
+            self._db.execute("ALTER TABLE job_items ADD COLUMN retry_at REAL NOT NULL DEFAULT 0")
+        # Queued items are claimed in insertion (rowid) order
+        self._db.execute("CREATE INDEX IF NOT EXISTS job_items_status ON job_items (status)")
+        self._db.commit()
+
+        self._tasks: List[asyncio.Task] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._changed: Optional[asyncio.Event] = None
+
+    def start(self):
+        if self._tasks:
+            return
+        # Events belong to the serving loop, so create them here
+        self._wakeup = asyncio.Event()
+        self._changed = asyncio.Event()
+        resumed = self._requeue_running()
+        if resumed:
+            print(f"🔁 Resuming {resumed} images from interrupted jobs")
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+        # Anything cut off mid-image is picked up again on the next start
+        self._requeue_running()
+
+    def submit(self, model_type: str, items: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Create a job from stored uploads.
+
+        Each item needs a ``filename`` and either a ``digest`` of the stored
+        upload or an ``error``; errored items are recorded as failed at once.
+        """
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        rows = []
+        for idx, item in enumerate(items):
+            if item.get("error"):
+                result = json.dumps({
+                    "filename": item["filename"],
+                    "error": item["error"],
+                    "prediction": "Error",
+                    "confidence": 0.0
+                })
+                rows.append((job_id, idx, item["filename"], None, "failed", result, now))
+            else:
+                rows.append((job_id, idx, item["filename"], item["digest"], "queued", None, now))
+
+        pending = any(row[4] == "queued" for row in rows)
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO jobs (id, model_type, status, total, created_at, finished_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (job_id, model_type, "queued" if pending else "completed", len(rows), now, None if pending else now)
+            )
+            self._db.executemany(
+                "INSERT INTO job_items (job_id, idx, filename, digest, status, result, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                rows
+            )
+            self._db.commit()
+
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return self.status(job_id)
+
+    def status(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            job = self._db.execute(
+                "SELECT model_type, status, total, created_at, started_at, finished_at FROM jobs WHERE id = ?",
+                (job_id,)
+            ).fetchone()
+            if job is None:
+                return None
+            counts = dict(self._db.execute(
+                "SELECT status, COUNT(*) FROM job_items WHERE job_id = ? GROUP BY status", (job_id,)
+            ).fetchall())
+            retrying = self._db.execute(
+                "SELECT COUNT(*) FROM job_items WHERE job_id = ? AND status = 'queued' AND attempts > 0", (job_id,)
+            ).fetchone()[0]
+
+        model_type, status, total, created_at, started_at, finished_at = job
+        processed = counts.get("done", 0) + counts.get("failed", 0)
+        return {
+            "job_id": job_id,
+            "model_type": model_type,
+            "status": status,
+            "total": total,
+            "queued": counts.get("queued", 0),
+            "retrying": retrying,
+            "running": counts.get("running", 0),
+            "succeeded": counts.get("done", 0),
+            "failed": counts.get("failed", 0),
+            "cancelled": counts.get("cancelled", 0),
+            "progress": round(processed / total, 4) if total else 1.0,
+            "created_at": created_at,
+            "started_at": started_at,
+            "finished_at": finished_at
+        }
+
+    def results(self, job_id: str, offset: int = 0, limit: int = RESULTS_PAGE_SIZE) -> List[Dict[str, Any]]:
+        """One page of per-image entries in submission order"""
+        limit = max(1, min(limit, MAX_RESULTS_PAGE_SIZE))
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT idx, filename, status, result FROM job_items WHERE job_id = ? AND idx >= ? ORDER BY idx LIMIT ?",
+                (job_id, max(0, offset), limit)
+            ).fetchall()
+
+        entries = []
+        for idx, filename, status, result in rows:
+            entry = json.loads(result) if result else {"filename": filename}
+            entry["index"] = idx
+            entry["status"] = status
+            entries.append(entry)
+        return entries
+
+    def cancel(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Stop a job; images already being scored still finish"""
+        now = time.time()
+        with self._lock:
+            updated = self._db.execute(
+                "UPDATE jobs SET status = 'cancelled', finished_at = ? WHERE id = ? AND status NOT IN (?, ?)",
+                (now, job_id) + FINISHED_STATUSES
+            ).rowcount
+            if updated:
+                self._db.execute(
+                    "UPDATE job_items SET status = 'cancelled', updated_at = ? WHERE job_id = ? AND status = 'queued'",
+                    (now, job_id)
+                )
+            self._db.commit()
+        self._notify()
+        return self.status(job_id)
+
+    def pending_digests(self) -> Set[str]:
+        """Uploads that queued or running items still need"""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT DISTINCT digest FROM job_items WHERE status IN ('queued', 'running') AND digest IS NOT NULL"
+            ).fetchall()
+        return {row[0] for row in rows}
+
+    def usage(self) -> List[Tuple[float, int, str]]:
+        """(finished at, result bytes, job id) for finished jobs, for retention sweeps"""
+        with self._lock:
+            return self._db.execute("""
+                SELECT j.finished_at, COALESCE(SUM(LENGTH(i.result)), 0), j.id
+                FROM jobs j LEFT JOIN job_items i ON i.job_id = j.id
+                WHERE j.finished_at IS NOT NULL
+                GROUP BY j.id
+            """).fetchall()
+
+    def evict(self, job_ids: List[str]) -> Tuple[int, int]:
+        """Delete finished jobs and their results; returns (count, bytes)"""
+        deleted, reclaimed = 0, 0
+        with self._lock:
+            for job_id in job_ids:
+                size = self._db.execute(
+                    "SELECT COALESCE(SUM(LENGTH(result)), 0) FROM job_items WHERE job_id = ?", (job_id,)
+                ).fetchone()[0]
+                self._db.execute("DELETE FROM job_items WHERE job_id = ?", (job_id,))
+                deleted += self._db.execute("DELETE FROM jobs WHERE id = ?", (job_id,)).rowcount
+                reclaimed += size
+            self._db.commit()
+        return deleted, reclaimed
+
+    async def wait_for_change(self, timeout: float):
+        """Wait until any item finishes or a job changes state"""
+        if self._changed is None:
+            await asyncio.sleep(timeout)
+            return
+        try:
+            await asyncio.wait_for(self._changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    def _notify(self):
+        if self._changed is None:
+            return
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    async def _worker(self):
+        while True:
+            self._wakeup.clear()
+            item = await run_in_threadpool(self._claim)
+            if item is None:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), IDLE_POLL_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            try:
+                result = await self.handler(item)
+                status = "failed" if result.get("error") else "done"
+            except asyncio.CancelledError:
+                # Left as running; re-queued by stop() or the next start()
+                raise
+            except self.transient as e:
+                if item["attempts"] + 1 < self.max_attempts:
+                    delay = self._backoff(item["attempts"], e)
+                    print(f"🔁 Job {item['job_id'][:8]} image {item['index']}: {e}; retrying in {delay:.1f}s")
+                    await run_in_threadpool(self._retry_item, item, delay)
+                    continue
+                result = {
+                    "filename": item["filename"],
+                    "error": f"{e} (gave up after {self.max_attempts} attempts)",
+                    "prediction": "Error",
+                    "confidence": 0.0
+                }
+                status = "failed"
+            except Exception as e:
+                result = {
+                    "filename": item["filename"],
+                    "error": str(e),
+                    "prediction": "Error",
+                    "confidence": 0.0
+                }
+                status = "failed"
+
+            await run_in_threadpool(self._finish_item, item, status, result)
+            self._notify()
+
+    @staticmethod
+    def _backoff(attempts: int, error: Exception) -> float:
+        """Exponential delay before the next attempt, at least what the error asks for"""
+        delay = min(RETRY_BASE_SECONDS * 2 ** attempts, RETRY_MAX_SECONDS)
+        return max(delay, float(getattr(error, "retry_after", 0)))
+
+    def _claim(self) -> Optional[Dict[str, Any]]:
+        now = time.time()
+        with self._lock:
+            row = self._db.execute("""
+                SELECT i.job_id, i.idx, i.filename, i.digest, i.attempts, j.model_type, j.status
+                FROM job_items i JOIN jobs j ON j.id = i.job_id
+                WHERE i.status = 'queued' AND i.retry_at <= ?
+                ORDER BY i.rowid
+                LIMIT 1
+            """, (now,)).fetchone()
+            if row is None:
+                return None
+            job_id, idx, filename, digest, attempts, model_type, job_status = row
+            self._db.execute(
+                "UPDATE job_items SET status = 'running', updated_at = ? WHERE job_id = ? AND idx = ?",
+                (now, job_id, idx)
+            )
+            if job_status == "queued":
+                self._db.execute(
+                    "UPDATE jobs SET status = 'running', started_at = ? WHERE id = ?", (now, job_id)
+                )
+            self._db.commit()
+
+        return {
+            "job_id": job_id,
+            "index": idx,
+            "filename": filename,
+            "digest": digest,
+            "model_type": model_type,
+            "attempts": attempts
+        }
+
+    def _retry_item(self, item: Dict[str, Any], delay: float):
+        now = time.time()
+        with self._lock:
+            # A job cancelled meanwhile keeps the image cancelled
+            self._db.execute("""
+                UPDATE job_items SET
+                    status = CASE WHEN (SELECT status FROM jobs WHERE id = ?) = 'cancelled' THEN 'cancelled' ELSE 'queued' END,
+                    attempts = attempts + 1, retry_at = ?, updated_at = ?
+                WHERE job_id = ? AND idx = ?
+            """, (item["job_id"], now + delay, now, item["job_id"], item["index"]))
+            self._db.commit()
+
+    def _finish_item(self, item: Dict[str, Any], status: str, result: Dict[str, Any]):
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "UPDATE job_items SET status = ?, result = ?, updated_at = ? WHERE job_id = ? AND idx = ?",
+                (status, json.dumps(result), now, item["job_id"], item["index"])
+            )
+            remaining = self._db.execute(
+                "SELECT COUNT(*) FROM job_items WHERE job_id = ? AND status IN ('queued', 'running')",
+                (item["job_id"],)
+            ).fetchone()[0]
+            if remaining == 0:
+                self._db.execute(
+                    "UPDATE jobs SET status = 'completed', finished_at = ? WHERE id = ? AND status = 'running'",
+                    (now, item["job_id"])
+                )
+            self._db.commit()
+
+    def _requeue_running(self) -> int:
+        with self._lock:
+            self._db.execute("""
+                UPDATE job_items SET status = 'cancelled'
+                WHERE status = 'running' AND job_id IN (SELECT id FROM jobs WHERE status = 'cancelled')
+            """)
+            count = self._db.execute(
+                "UPDATE job_items SET status = 'queued' WHERE status = 'running'"
+            ).rowcount
+            self._db.commit()
+        return count
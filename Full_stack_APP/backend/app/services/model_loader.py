@@ -5,20 +5,85 @@ from tensorflow import keras
 from PIL import Image, ImageEnhance
 import time
 from pathlib import Path
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional
+
+from .tta import run_tta
+from dental_common.metrics import TimedModel, timed_function
 
 # Disable TensorFlow warnings
 os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
 tf.get_logger().setLevel('ERROR')
 
 
+def load_image(image_path: str) -> Image.Image:
+    """Decode an image file to RGB once, for inference and renditions alike"""
+    img = Image.open(image_path)
+    # Decode now: the image is shared across threads (hashing, both models)
+    img.load()
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+    return img
+
+
+def load_lite_model(model_path: Path):
+    """
+    Optional fast model used while the server is overloaded. It takes the
+    same preprocessed input as the full model; missing files just disable it.
+    """
+    if not model_path.exists():
+        return None
+    try:
+        model = keras.models.load_model(str(model_path), compile=False)
+        dummy_input = np.ones((1, 224, 224, 3), dtype=np.float32) * 0.5
+        _ = model.predict(dummy_input, verbose=0, batch_size=1)
+        print(f"✅ Lite model loaded from: {model_path}")
+        return model
+    except Exception as e:
+        print(f"⚠️ Could not load lite model {model_path}: {e}")
+        return None
+
+
+def embedding_model(model):
+    """
+    The same network with the penultimate activations as a second output,
+    so an image's embedding comes out of its prediction's forward pass.
+    """
+    try:
+        features = model.layers[-1].input
+        if len(features.shape) == 4:
+            features = keras.layers.GlobalAveragePooling2D()(features)
+        return keras.Model(model.inputs, [model.output, features])
+    except Exception as e:
+        print(f"⚠️ Embeddings unavailable for {model.name}: {e}")
+        return None
+
+
+class EmbeddingCapture:
+    """Stands in for the model in run_tta and keeps the original view's embedding"""
+    
+    def __init__(self, feature_model):
+        self.feature_model = feature_model
+        self.embedding = None
+    
+    def predict(self, batch, **kwargs):
+        outputs, embeddings = self.feature_model.predict(batch, **kwargs)
+        if self.embedding is None:
+            # Row 0 of the first batch is always the unaugmented image
+            self.embedding = embeddings[0]
+        return outputs
+
+
 class DentalDiseasePredictor:
     """Predictor for 4-class dental disease classification with Test-Time Augmentation"""
     
     def __init__(self):
         self.model = None
+        self.lite_model = None
+        self.feature_model = None
         self.is_loaded = False
+        self.model_type = "dental"
         self.class_names = ['caries', 'calculus', 'healthy', 'discoloration']
+        self.healthy_class = 'healthy'
         self.class_colors = {
             'caries': '#ff6b6b',
             'calculus': '#ffa500',
@@ -61,6 +126,10 @@ class DentalDiseasePredictor:
             # Create a placeholder that strictly returns errors, not random predictions
             self.model = None
             self.is_loaded = False
+        
+        if self.model is not None:
+            self.feature_model = embedding_model(self.model)
+        self.lite_model = load_lite_model(model_path.parent / "DENTAL_MODEL_LITE.keras")
     
     def load_model(self, model_path: str):
         try:
@@ -109,11 +178,11 @@ class DentalDiseasePredictor:
         self.is_loaded = False
         print("✅ Lightweight dental model created")
     
-    def preprocess_image(self, image_path: str):
+    def preprocess_image(self, image):
         """
         Preprocess image for prediction.
         MATCHING COLAB PIPELINE EXACTLY:
-        1. Open image
+        1. Open image (or reuse an already decoded PIL image)
         2. Convert to array
         3. Convert to Tensor
         4. tf.image.resize (Critical difference from PIL resize)
@@ -121,7 +190,7 @@ class DentalDiseasePredictor:
         """
         try:
             # 1. Open image
-            img = Image.open(image_path)
+            img = image if isinstance(image, Image.Image) else load_image(image)
             if img.mode != 'RGB':
                 img = img.convert('RGB')
             
@@ -148,9 +217,13 @@ class DentalDiseasePredictor:
         except Exception as e:
             raise Exception(f"Error preprocessing image: {str(e)}")
     
-    def predict(self, image_path: str) -> Dict[str, Any]:
+    def predict(self, image_path: str, tta: str = "off") -> Dict[str, Any]:
         """
-        Make prediction matching Colab exactly (No TTA).
+        Make prediction from an image file, preprocessed exactly as in Colab.
+        ``tta`` is the test-time augmentation mode: "off" (the default)
+        scores the image alone, "auto" adds the augmented views only when
+        the confidence is below DENTAL_TTA_THRESHOLD, and "always" averages
+        the image and all views.
         """
         start_time = time.time()
         
@@ -162,72 +235,78 @@ class DentalDiseasePredictor:
             if file_size > 10:
                 return self._error_result("Image too large (max 10MB)")
             
-            # Get preprocessed tensor (includes batch dim)
-            processed_image = self.preprocess_image(image_path)
-            
-            # Predict
-            predictions = self.model.predict(processed_image, verbose=0)
-            
-            # Get final result (Colab logic)
-            # prediction = model.predict(image_tensor, verbose=0)
-            # class_idx = np.argmax(prediction[0])
-            # confidence = np.max(prediction[0])
-            
-            predicted_idx = np.argmax(predictions[0])
-            predicted_class = self.class_names[predicted_idx]
-            confidence = float(predictions[0][predicted_idx])
-            
-            all_probabilities = {
-                self.class_names[i]: float(prob) 
-                for i, prob in enumerate(predictions[0])
-            }
-            
-            sorted_probs = dict(sorted(all_probabilities.items(), key=lambda x: x[1], reverse=True))
-            processing_time = (time.time() - start_time) * 1000
-            
-            result = {
-                "prediction": predicted_class,
-                "confidence": round(confidence * 100, 2),
-                "all_probabilities": sorted_probs,
-                "top_probabilities": list(sorted_probs.items())[:3],
-                "icon": self.class_icons[predicted_class],
-                "color": self.class_colors[predicted_class],
-                "description": self.class_descriptions[predicted_class],
-                "processing_time_ms": round(processing_time, 2),
-                "model_loaded": self.is_loaded,
-                "model_type": "dental",
-                "error": None,
-                "interpretation": self._get_interpretation(confidence)
-            }
-            
-            return result
+            return self.predict_image(load_image(image_path), start_time, tta=tta)
             
         except Exception as e:
             return self._error_result(str(e))
-            
-            sorted_probs = dict(sorted(all_probabilities.items(), key=lambda x: x[1], reverse=True))
-            processing_time = (time.time() - start_time) * 1000
-            
-            result = {
-                "prediction": predicted_class,
-                "confidence": round(confidence * 100, 2),
-                "all_probabilities": sorted_probs,
-                "top_probabilities": list(sorted_probs.items())[:3],
-                "icon": self.class_icons[predicted_class],
-                "color": self.class_colors[predicted_class],
-                "description": self.class_descriptions[predicted_class],
-                "processing_time_ms": round(processing_time, 2),
-                "model_loaded": self.is_loaded,
-                "model_type": "dental",
-                "error": None,
-                "interpretation": self._get_interpretation(confidence)
-            }
+    
+    def predict_image(self, img: Image.Image, start_time: Optional[float] = None,
+                      lite: bool = False, tta: str = "off", embed: bool = False) -> Dict[str, Any]:
+        """
+        Predict on an already decoded RGB image, so callers that also need
+        the pixels (renditions, quality checks) decode only once.
+        ``lite`` uses the fast fallback model and flags the result degraded;
+        ``tta`` ("auto" / "always") averages batched augmented views;
+        ``embed`` adds the full model's penultimate-layer ``embedding``.
+        """
+        start_time = start_time or time.time()
+        
+        try:
+            # Preprocess (batch dim included) and predict, with optional TTA
+            model = self.lite_model if lite else self.model
+            capture = None
+            if embed and not lite and self.feature_model is not None:
+                model = capture = EmbeddingCapture(self.feature_model)
+            model = TimedModel(model, f"{self.model_type}-lite" if lite else self.model_type)
+            preprocess = timed_function("preprocess", self.preprocess_image, self.model_type)
+            probabilities, tta_info = run_tta(model, img, preprocess, tta)
+            
+            result = self.build_result(probabilities, start_time, lite)
+            if tta_info:
+                result["tta"] = tta_info
+            if capture is not None:
+                result["embedding"] = capture.embedding
             
             return result
             
         except Exception as e:
             return self._error_result(str(e))
     
+    def build_result(self, probabilities: np.ndarray, start_time: float, lite: bool = False) -> Dict[str, Any]:
+        """Result dict from one softmax output vector"""
+        # Get final result (Colab logic)
+        # prediction = model.predict(image_tensor, verbose=0)
+        # class_idx = np.argmax(prediction[0])
+        # confidence = np.max(prediction[0])
+        
+        predicted_idx = np.argmax(probabilities)
+        predicted_class = self.class_names[predicted_idx]
+        confidence = float(probabilities[predicted_idx])
+        
+        all_probabilities = {
+            self.class_names[i]: float(prob) 
+            for i, prob in enumerate(probabilities)
+        }
+        
+        sorted_probs = dict(sorted(all_probabilities.items(), key=lambda x: x[1], reverse=True))
+        processing_time = (time.time() - start_time) * 1000
+        
+        return {
+            "prediction": predicted_class,
+            "confidence": round(confidence * 100, 2),
+            "all_probabilities": sorted_probs,
+            "top_probabilities": list(sorted_probs.items())[:3],
+            "icon": self.class_icons[predicted_class],
+            "color": self.class_colors[predicted_class],
+            "description": self.class_descriptions[predicted_class],
+            "processing_time_ms": round(processing_time, 2),
+            "model_loaded": self.is_loaded,
+            "model_type": "dental",
+            "degraded": lite,
+            "error": None,
+            "interpretation": self._get_interpretation(confidence)
+        }
+    
     def _get_interpretation(self, confidence: float) -> str:
         if confidence > 0.90:
             return "Strong detection confidence."
@@ -263,8 +342,12 @@ class GingivitisPredictor:
     
     def __init__(self):
         self.model = None
+        self.lite_model = None
+        self.feature_model = None
         self.is_loaded = False
+        self.model_type = "gingivitis"
         self.class_names = ['Healthy', 'Gingivitis']
+        self.healthy_class = 'Healthy'
         self.class_colors = {
             'Healthy': '#51cf66',
             'Gingivitis': '#ff6b6b'
@@ -298,6 +381,9 @@ class GingivitisPredictor:
             print(f"⚠️ Gingivitis model not found at: {model_path}")
             print("⚠️ Creating lightweight model for testing...")
             self._create_lightweight_model()
+        
+        self.feature_model = embedding_model(self.model)
+        self.lite_model = load_lite_model(model_path.parent / "GINGIVITIS_MODEL_LITE.keras")
     
     def load_model(self, model_path: str):
         try:
@@ -345,9 +431,9 @@ class GingivitisPredictor:
         self.is_loaded = False
         print("✅ Lightweight gingivitis model created")
     
-    def preprocess_image(self, image_path: str) -> np.ndarray:
+    def preprocess_image(self, image) -> np.ndarray:
         try:
-            img = Image.open(image_path)
+            img = image if isinstance(image, Image.Image) else load_image(image)
             
             if img.mode != 'RGB':
                 img = img.convert('RGB')
@@ -361,7 +447,8 @@ class GingivitisPredictor:
         except Exception as e:
             raise Exception(f"Error loading image: {str(e)}")
     
-    def predict(self, image_path: str) -> Dict[str, Any]:
+    def predict(self, image_path: str, tta: str = "off") -> Dict[str, Any]:
+        """Prediction from an image file; ``tta`` as for the dental model (default "off")"""
         start_time = time.time()
         
         try:
@@ -372,47 +459,79 @@ class GingivitisPredictor:
             if file_size > 10:
                 return self._error_result("Image too large (max 10MB)")
             
-            processed_image = self.preprocess_image(image_path)
-            prediction = self.model.predict(processed_image, verbose=0, batch_size=1)
+            return self.predict_image(load_image(image_path), start_time, tta=tta)
             
-            probability = float(prediction[0][0])
-            
-            if probability > self.confidence_threshold:
-                predicted_class = self.class_names[1]  # Gingivitis
-                confidence = probability
-            else:
-                predicted_class = self.class_names[0]  # Healthy
-                confidence = 1 - probability
-            
-            processing_time = (time.time() - start_time) * 1000
-            
-            all_probabilities = {
-                'Healthy': round((1 - probability) * 100, 2),
-                'Gingivitis': round(probability * 100, 2)
-            }
+        except Exception as e:
+            return self._error_result(str(e))
+    
+    def predict_image(self, img: Image.Image, start_time: Optional[float] = None,
+                      lite: bool = False, tta: str = "off", embed: bool = False) -> Dict[str, Any]:
+        """
+        Predict on an already decoded RGB image; ``lite`` uses the fast
+        fallback model, ``tta`` ("auto" / "always") averages augmented views,
+        ``embed`` adds the full model's penultimate-layer ``embedding``
+        """
+        start_time = start_time or time.time()
+        
+        try:
+            model = self.lite_model if lite else self.model
+            capture = None
+            if embed and not lite and self.feature_model is not None:
+                model = capture = EmbeddingCapture(self.feature_model)
+            model = TimedModel(model, f"{self.model_type}-lite" if lite else self.model_type)
+            preprocess = timed_function("preprocess", self.preprocess_image, self.model_type)
+            prediction, tta_info = run_tta(
+                model, img, preprocess, tta,
+                confidence=lambda output: max(float(output[0]), 1 - float(output[0]))
+            )
             
-            result = {
-                "prediction": predicted_class,
-                "confidence": round(confidence * 100, 2),
-                "all_probabilities": all_probabilities,
-                "raw_probability": round(probability, 6),
-                "healthy_probability": round((1 - probability) * 100, 2),
-                "gingivitis_probability": round(probability * 100, 2),
-                "icon": self.class_icons[predicted_class],
-                "color": self.class_colors[predicted_class],
-                "description": self.class_descriptions[predicted_class],
-                "processing_time_ms": round(processing_time, 2),
-                "model_loaded": self.is_loaded,
-                "model_type": "gingivitis",
-                "error": None,
-                "interpretation": self._get_interpretation(confidence)
-            }
+            result = self.build_result(prediction, start_time, lite)
+            if tta_info:
+                result["tta"] = tta_info
+            if capture is not None:
+                result["embedding"] = capture.embedding
             
             return result
             
         except Exception as e:
             return self._error_result(str(e))
     
+    def build_result(self, prediction: np.ndarray, start_time: float, lite: bool = False) -> Dict[str, Any]:
+        """Result dict from one sigmoid output vector"""
+        probability = float(prediction[0])
+        
+        if probability > self.confidence_threshold:
+            predicted_class = self.class_names[1]  # Gingivitis
+            confidence = probability
+        else:
+            predicted_class = self.class_names[0]  # Healthy
+            confidence = 1 - probability
+        
+        processing_time = (time.time() - start_time) * 1000
+        
+        all_probabilities = {
+            'Healthy': round((1 - probability) * 100, 2),
+            'Gingivitis': round(probability * 100, 2)
+        }
+        
+        return {
+            "prediction": predicted_class,
+            "confidence": round(confidence * 100, 2),
+            "all_probabilities": all_probabilities,
+            "raw_probability": round(probability, 6),
+            "healthy_probability": round((1 - probability) * 100, 2),
+            "gingivitis_probability": round(probability * 100, 2),
+            "icon": self.class_icons[predicted_class],
+            "color": self.class_colors[predicted_class],
+            "description": self.class_descriptions[predicted_class],
+            "processing_time_ms": round(processing_time, 2),
+            "model_loaded": self.is_loaded,
+            "model_type": "gingivitis",
+            "degraded": lite,
+            "error": None,
+            "interpretation": self._get_interpretation(confidence)
+        }
+    
     def _get_interpretation(self, confidence: float) -> str:
         if confidence > 0.9:
             return "High confidence prediction"
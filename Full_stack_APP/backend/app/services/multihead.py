@@ -0,0 +1,76 @@
+"""
+Shared-backbone multi-head serving model.
+
+``build_multihead.py`` fuses the teeth and gum classifiers into one model
+with a single backbone and two heads (outputs ``dental`` and
+``gingivitis``). It takes the dental model's preprocessed input. When the
+file is installed, /api/analyze_all scores both conditions in one forward
+pass instead of running the backbone once per model.
+"""
+
+import os
+import time
+from pathlib import Path
+from typing import Dict, Any, Optional, Tuple
+
+import numpy as np
+from tensorflow import keras
+
+from dental_common.metrics import timed
+
+MULTIHEAD_PATH = Path(os.getenv(
+    "DENTAL_MULTIHEAD_MODEL",
+    str(Path(__file__).parent.parent / "models" / "MULTIHEAD_MODEL.keras")
+))
+OUTPUT_NAMES = ("dental", "gingivitis")
+
+
+class MultiHeadModel:
+    """Optional fused model; a missing or unreadable file just disables it"""
+
+    def __init__(self, path: Path = MULTIHEAD_PATH):
+        self.path = path
+        self.model = None
+        self.counters = {"requests": 0}
+        if not path.exists():
+            return
+        try:
+            model = keras.models.load_model(str(path), compile=False)
+            outputs = model(np.ones((1, 224, 224, 3), dtype=np.float32) * 0.5, training=False)
+            missing = [name for name in OUTPUT_NAMES if name not in outputs]
+            if missing:
+                raise ValueError(f"missing outputs {missing}")
+            self.model = model
+            print(f"✅ Multi-head model loaded from: {path}")
+        except Exception as e:
+            print(f"⚠️ Could not load multi-head model {path}: {e}")
+
+    @property
+    def available(self) -> bool:
+        return self.model is not None
+
+    def serves(self, allow_degraded: bool = False, use_cascade: bool = False,
+               tta: str = "off", tiles: int = 0, **_) -> bool:
+        """Only plain full-model requests; other paths need each model's own pass"""
+        return self.available and not (allow_degraded or use_cascade or tiles) and tta == "off"
+
+    def predict(self, dental_predictor, gingivitis_predictor, img,
+                start_time: Optional[float] = None) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        """Blocking; call through the scheduler like any other model call"""
+        start_time = start_time or time.time()
+        self.counters["requests"] += 1
+        try:
+            with timed("preprocess", "multihead"):
+                batch = dental_predictor.preprocess_image(img)
+            with timed("inference", "multihead", 1):
+                outputs = self.model.predict(batch, verbose=0, batch_size=1)
+        except Exception as e:
+            return dental_predictor._error_result(str(e)), gingivitis_predictor._error_result(str(e))
+
+        dental = dental_predictor.build_result(outputs["dental"][0], start_time)
+        gingivitis = gingivitis_predictor.build_result(outputs["gingivitis"][0], start_time)
+        dental["multihead"] = gingivitis["multihead"] = True
+        return dental, gingivitis
+
+    def stats(self) -> Dict[str, Any]:
+        return {"loaded": self.available, "path": str(self.path), **self.counters}
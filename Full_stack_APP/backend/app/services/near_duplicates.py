@@ -0,0 +1,212 @@
+"""
+Near-duplicate detection for recently analysed images.
+
+Clinics often forward the same photo through messaging apps, which
+re-encode and resize it, so its bytes (and sha256) change while the
+picture does not. Each analysed image gets a 64-bit perceptual hash (DCT
+pHash) and a difference hash (dHash). The pHashes are searched by
+multi-index hashing: each is filed under its four 16-bit substrings, and
+since two hashes within r bits must agree to within r // 4 bits on at
+least one substring, a lookup probes only those few buckets. (A BK-tree
+visits about half of its nodes at this radius; see
+``benchmark_near_duplicates.py``.) A new image whose pHash is within
+``DENTAL_NEAR_DUP_DISTANCE`` bits of a recent one, and whose dHash is
+within ``DENTAL_NEAR_DUP_DHASH_DISTANCE``, is served that image's stored
+prediction without running the model.
+
+Photos of the same view of different mouths can hash close together, so
+reuse is opt-in (``?near_dup=true`` or ``DENTAL_NEAR_DUP=1``). The default
+pHash radius sits between re-encoded copies (at most 4 bits apart in
+``test_near_duplicates.py``) and distinct images (8 bits or more).
+"""
+
+import os
+import copy
+import threading
+from itertools import combinations
+from collections import OrderedDict, defaultdict
+from typing import Dict, Any, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+from starlette.requests import HTTPConnection
+
+NEAR_DUP_ENABLED = os.getenv("DENTAL_NEAR_DUP", "0") == "1"
+PHASH_DISTANCE = int(os.getenv("DENTAL_NEAR_DUP_DISTANCE", "5"))
+DHASH_DISTANCE = int(os.getenv("DENTAL_NEAR_DUP_DHASH_DISTANCE", "10"))
+CAPACITY = int(os.getenv("DENTAL_NEAR_DUP_CAPACITY", "10000"))
+
+HASH_SIZE = 8
+PHASH_SOURCE = 32
+# Below this grey-level spread the hash bits are noise; such images are never matched
+MIN_CONTRAST = 4.0
+
+# DCT-II basis; only the lowest 8 frequencies are needed for pHash
+_DCT = np.cos(np.pi * np.outer(np.arange(HASH_SIZE), 2 * np.arange(PHASH_SOURCE) + 1) / (2 * PHASH_SOURCE))
+_BIT_WEIGHTS = 1 << np.arange(HASH_SIZE * HASH_SIZE, dtype=np.uint64)
+
+if hasattr(int, "bit_count"):
+    def hamming(a: int, b: int) -> int:
+        return (a ^ b).bit_count()
+else:
+    def hamming(a: int, b: int) -> int:
+        return bin(a ^ b).count("1")
+
+
+def wants_near_dup(connection: HTTPConnection) -> bool:
+    """Server default, overridable per request with ?near_dup=true|false"""
+    value = connection.query_params.get("near_dup", "").lower()
+    if value in ("1", "true", "yes"):
+        return True
+    if value in ("0", "false", "no"):
+        return False
+    return NEAR_DUP_ENABLED
+
+
+def _pack(bits: np.ndarray) -> int:
+    return int(np.sum(_BIT_WEIGHTS[bits.ravel()]))
+
+
+def perceptual_hashes(img: Image.Image) -> Optional[Tuple[int, int]]:
+    """(pHash, dHash) of an image, 64 bits each; None for near-uniform images"""
+    # Box-reduce large photos first, then shrink in colour: converting a
+    # full-size photo to grey costs more than the hash itself
+    factor = min(img.size) // (PHASH_SOURCE * 4)
+    if factor > 1:
+        img = img.reduce(factor)
+    small = img.resize((PHASH_SOURCE, PHASH_SOURCE), Image.BILINEAR).convert("L")
+    pixels = np.asarray(small, dtype=np.float32)
+    if pixels.std() < MIN_CONTRAST:
+        return None
+    low = _DCT @ pixels @ _DCT.T
+    phash = _pack(low > np.median(low))
+
+    tiny = np.asarray(small.resize((HASH_SIZE + 1, HASH_SIZE), Image.BILINEAR), dtype=np.float32)
+    dhash = _pack(tiny[:, 1:] > tiny[:, :-1])
+    return phash, dhash
+
+
+class MultiIndexHash:
+    """Hamming-radius search over 64-bit hashes, split into ``chunks`` substrings"""
+
+    def __init__(self, radius: int, chunks: int = 4):
+        self.radius = radius
+        self.chunks = chunks
+        self.width = HASH_SIZE * HASH_SIZE // chunks
+        self.mask = (1 << self.width) - 1
+        self.size = 0
+        # Every substring variant within radius // chunks bits of a probe
+        sub_radius = radius // chunks
+        self.flips = [sum(1 << bit for bit in bits)
+                      for distance in range(sub_radius + 1)
+                      for bits in combinations(range(self.width), distance)]
+        self.tables = [defaultdict(list) for _ in range(chunks)]
+
+    def _substrings(self, value: int):
+        return [(value >> (j * self.width)) & self.mask for j in range(self.chunks)]
+
+    def add(self, value: int, key: str):
+        for table, sub in zip(self.tables, self._substrings(value)):
+            table[sub].append((value, key))
+        self.size += 1
+
+    def remove(self, value: int, key: str):
+        for table, sub in zip(self.tables, self._substrings(value)):
+            bucket = table.get(sub)
+            if bucket and (value, key) in bucket:
+                bucket.remove((value, key))
+                if not bucket:
+                    del table[sub]
+        self.size -= 1
+
+    def search(self, value: int) -> Tuple[List[Tuple[int, str]], int]:
+        """(distance, key) within the radius, closest first, and the candidates checked"""
+        matches = []
+        seen = set()
+        for table, sub in zip(self.tables, self._substrings(value)):
+            for flip in self.flips:
+                for candidate, key in table.get(sub ^ flip, ()):
+                    if key in seen:
+                        continue
+                    seen.add(key)
+                    distance = hamming(value, candidate)
+                    if distance <= self.radius:
+                        matches.append((distance, key))
+        matches.sort()
+        return matches, len(seen)
+
+
+class NearDuplicateIndex:
+    """Recently analysed images by perceptual hash, with their stored predictions"""
+
+    def __init__(self, capacity: int = CAPACITY, phash_distance: int = PHASH_DISTANCE,
+                 dhash_distance: int = DHASH_DISTANCE):
+        self.capacity = max(1, capacity)
+        self.phash_distance = phash_distance
+        self.dhash_distance = dhash_distance
+        self._lock = threading.Lock()
+        self._table = MultiIndexHash(phash_distance)
+        # image_id -> {"phash", "dhash", "results": {variant: result}}, oldest first
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self.counters = {"lookups": 0, "hits": 0, "candidates_checked": 0}
+
+    def lookup(self, variant: str, img: Image.Image) -> Tuple[Optional[Tuple[int, int]], Optional[Dict[str, Any]]]:
+        """
+        Hashes of ``img`` and, for a near-duplicate analysed under the same
+        ``variant`` (model and options), a copy of its stored result flagged
+        with ``near_duplicate``.
+        """
+        hashes = perceptual_hashes(img)
+        if hashes is None:
+            return None, None
+        with self._lock:
+            self.counters["lookups"] += 1
+            matches, checked = self._table.search(hashes[0])
+            self.counters["candidates_checked"] += checked
+            for distance, image_id in matches:
+                entry = self._entries.get(image_id)
+                if entry is None or variant not in entry["results"]:
+                    continue
+                dhash_distance = hamming(hashes[1], entry["dhash"])
+                if dhash_distance > self.dhash_distance:
+                    continue
+                self.counters["hits"] += 1
+                self._entries.move_to_end(image_id)
+                result = copy.deepcopy(entry["results"][variant])
+                result["near_duplicate"] = {
+                    "of": image_id,
+                    "phash_distance": distance,
+                    "dhash_distance": dhash_distance
+                }
+                return hashes, result
+        return hashes, None
+
+    def add(self, variant: str, image_id: str, hashes: Optional[Tuple[int, int]], result: Dict[str, Any]):
+        """Remember a fresh model result for later near-duplicates"""
+        if hashes is None:
+            return
+        with self._lock:
+            entry = self._entries.get(image_id)
+            if entry is None:
+                entry = {"phash": hashes[0], "dhash": hashes[1], "results": {}}
+                self._entries[image_id] = entry
+                self._table.add(hashes[0], image_id)
+            entry["results"][variant] = copy.deepcopy(result)
+            self._entries.move_to_end(image_id)
+
+            while len(self._entries) > self.capacity:
+                evicted, old = self._entries.popitem(last=False)
+                self._table.remove(old["phash"], evicted)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.counters["lookups"]
+        return {
+            "enabled_by_default": NEAR_DUP_ENABLED,
+            "images": len(self._entries),
+            "capacity": self.capacity,
+            "phash_distance": self.phash_distance,
+            "dhash_distance": self.dhash_distance,
+            "hit_rate": round(self.counters["hits"] / lookups, 4) if lookups else 0.0,
+            "mean_candidates_checked": round(self.counters["candidates_checked"] / lookups, 1) if lookups else 0.0,
+            **self.counters
+        }
@@ -0,0 +1,161 @@
+"""
+Cheap image-quality checks that run before inference.
+
+Blurry, dark, blank or tiny uploads still cost a full decode and a model
+pass and only produce low-confidence noise. The checks here run on a
+reduced-resolution decode (JPEGs are decoded at a smaller DCT scale) and
+measure sharpness (variance of the Laplacian), exposure (brightness and
+clipped shares of the grey histogram), contrast, colourfulness and size.
+By default (``flag``) the model still runs and the result carries the
+report, so existing clients keep getting predictions. With
+``?quality=reject`` or ``DENTAL_QUALITY=reject`` unusable images are
+answered with the failed checks instead; ``off`` skips the checks.
+"""
+
+import os
+import time
+from typing import Dict, Any, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+from starlette.requests import HTTPConnection
+
+QUALITY_MODES = ("off", "flag", "reject")
+DEFAULT_MODE = os.getenv("DENTAL_QUALITY", "flag")
+
+# Metrics are computed with the long side reduced to this size, so the
+# sharpness threshold does not depend on the camera resolution
+ANALYSIS_SIZE = 512
+COLOR_SIZE = 128
+
+THRESHOLDS = {
+    "min_side": int(os.getenv("DENTAL_QUALITY_MIN_SIDE", "64")),
+    "max_aspect": float(os.getenv("DENTAL_QUALITY_MAX_ASPECT", "4.0")),
+    "min_sharpness": float(os.getenv("DENTAL_QUALITY_MIN_SHARPNESS", "15")),
+    "min_brightness": float(os.getenv("DENTAL_QUALITY_MIN_BRIGHTNESS", "30")),
+    "max_brightness": float(os.getenv("DENTAL_QUALITY_MAX_BRIGHTNESS", "230")),
+    "max_clipped": float(os.getenv("DENTAL_QUALITY_MAX_CLIPPED", "0.5")),
+    "min_contrast": float(os.getenv("DENTAL_QUALITY_MIN_CONTRAST", "8")),
+    "min_colorfulness": float(os.getenv("DENTAL_QUALITY_MIN_COLORFULNESS", "4")),
+}
+
+# Grey levels counted as crushed shadows / blown highlights
+DARK_LEVEL = 10
+BRIGHT_LEVEL = 245
+
+
+def quality_mode(connection: HTTPConnection) -> str:
+    """?quality=off|flag|reject, falling back to DENTAL_QUALITY"""
+    mode = connection.query_params.get("quality", DEFAULT_MODE).lower()
+    return mode if mode in QUALITY_MODES else DEFAULT_MODE
+
+
+def _reduce(img: Image.Image, size: int) -> Image.Image:
+    """Copy with the long side at most ``size``: box-reduce, then resize the rest of the way"""
+    factor = max(img.size) // size
+    if factor > 1:
+        img = img.reduce(factor)
+    if max(img.size) > size:
+        scale = size / max(img.size)
+        img = img.resize((max(1, round(img.width * scale)), max(1, round(img.height * scale))), Image.BILINEAR)
+    return img
+
+
+def measure(img: Image.Image, original_size: Optional[Tuple[int, int]] = None) -> Dict[str, float]:
+    """Quality metrics of an RGB image; ``original_size`` when ``img`` is a reduced decode"""
+    width, height = original_size or img.size
+    grey = np.asarray(_reduce(img.convert("L"), ANALYSIS_SIZE), dtype=np.float32)
+
+    # 4-neighbour Laplacian; its variance drops as edges soften
+    if min(grey.shape) >= 3:
+        laplacian = (grey[1:-1, :-2] + grey[1:-1, 2:] + grey[:-2, 1:-1] + grey[2:, 1:-1]
+                     - 4 * grey[1:-1, 1:-1])
+        sharpness = float(laplacian.var())
+    else:
+        sharpness = 0.0
+
+    histogram = np.bincount(grey.astype(np.uint8).ravel(), minlength=256)
+    pixels = histogram.sum()
+
+    # Hasler & Suesstrunk colourfulness: ~0 for greyscale, 15+ for ordinary
+    # photos. Colour statistics need far fewer pixels than sharpness.
+    rgb = np.asarray(_reduce(img, COLOR_SIZE), dtype=np.float32)
+    rg = rgb[..., 0] - rgb[..., 1]
+    yb = 0.5 * (rgb[..., 0] + rgb[..., 1]) - rgb[..., 2]
+    colorfulness = float(np.hypot(rg.std(), yb.std()) + 0.3 * np.hypot(rg.mean(), yb.mean()))
+
+    return {
+        "width": width,
+        "height": height,
+        "sharpness": round(sharpness, 2),
+        "brightness": round(float(grey.mean()), 2),
+        "contrast": round(float(grey.std()), 2),
+        "dark_clipped": round(float(histogram[:DARK_LEVEL + 1].sum() / pixels), 4),
+        "bright_clipped": round(float(histogram[BRIGHT_LEVEL:].sum() / pixels), 4),
+        "colorfulness": round(colorfulness, 2),
+    }
+
+
+def find_issues(metrics: Dict[str, float], thresholds: Dict[str, float] = THRESHOLDS) -> list:
+    """Failed checks, each with a message the user can act on"""
+    issues = []
+
+    def fail(check: str, message: str):
+        issues.append({"check": check, "message": message})
+
+    width, height = metrics["width"], metrics["height"]
+    if min(width, height) < thresholds["min_side"]:
+        fail("size", f"Image is too small ({width}x{height}); use a photo at least "
+                     f"{thresholds['min_side']}px on each side")
+    if max(width, height) > thresholds["max_aspect"] * max(1, min(width, height)):
+        fail("aspect", "Image is unusually narrow; crop it around the teeth and gums")
+
+    # Badly exposed or near-uniform images also fail the checks below;
+    # only the cause is reported
+    if metrics["brightness"] < thresholds["min_brightness"] or metrics["dark_clipped"] > thresholds["max_clipped"]:
+        fail("exposure", "Image is too dark; add light or use the flash")
+        return issues
+    if metrics["brightness"] > thresholds["max_brightness"] or metrics["bright_clipped"] > thresholds["max_clipped"]:
+        fail("exposure", "Image is overexposed; avoid glare and direct light on wet surfaces")
+        return issues
+    if metrics["contrast"] < thresholds["min_contrast"]:
+        fail("contrast", "Image is almost uniform; it does not look like a photo of teeth or gums")
+        return issues
+
+    if metrics["sharpness"] < thresholds["min_sharpness"]:
+        fail("sharpness", "Image is blurry; hold the camera steady and let it focus")
+    if metrics["colorfulness"] < thresholds["min_colorfulness"]:
+        fail("color", "Image has almost no colour; the models expect colour photos, not X-rays or scans")
+    return issues
+
+
+def check_image(img: Image.Image, original_size: Optional[Tuple[int, int]] = None) -> Dict[str, Any]:
+    """Quality report: ``usable``, failed ``issues`` and the raw ``metrics``"""
+    started = time.time()
+    metrics = measure(img, original_size)
+    issues = find_issues(metrics)
+    return {
+        "usable": not issues,
+        "issues": issues,
+        "metrics": metrics,
+        "check_ms": round((time.time() - started) * 1000, 2)
+    }
+
+
+def check_file(image_path: str) -> Tuple[Dict[str, Any], Optional[Image.Image]]:
+    """
+    Quality report from a reduced-resolution decode of an image file.
+    When the decode could not be reduced (PNGs, small JPEGs) the full RGB
+    image is returned as well, so the caller does not decode it again.
+    """
+    started = time.time()
+    img = Image.open(image_path)
+    original_size = img.size
+    img.draft("RGB", (ANALYSIS_SIZE, ANALYSIS_SIZE))
+    img.load()
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+
+    report = check_image(img, original_size)
+    report["check_ms"] = round((time.time() - started) * 1000, 2)
+    return report, img if img.size == original_size else None
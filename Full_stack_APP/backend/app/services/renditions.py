@@ -0,0 +1,156 @@
+"""
+Downscaled display renditions of uploaded images.
+
+Renditions are generated once per content digest from the image that was
+already decoded for inference, and stored next to the original blob so
+their URLs are as immutable as the original's. Encoding happens on a small
+pool of its own after the response: the URLs are returned at once, and a
+fetch that arrives before its file exists waits for it (or builds it from
+the original when the backlog was full).
+"""
+
+import os
+import re
+import uuid
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Dict, Optional
+
+from PIL import Image, features
+from starlette.exceptions import HTTPException
+from starlette.responses import Response
+from starlette.types import Scope
+
+from dental_common.static_cache import CachedStaticFiles
+
+RENDITION_WORKERS = int(os.getenv("DENTAL_RENDITION_WORKERS", "1"))
+# Decoded images waiting for encoding; past this they are built on first fetch
+MAX_PENDING = int(os.getenv("DENTAL_RENDITION_BACKLOG", "32"))
+
+# Largest first: each rendition is downscaled from the previous one
+RENDITION_SIZES = [
+    ("display", 1024),
+    ("thumb", 256),
+]
+
+if features.check("webp"):
+    RENDITION_FORMAT, RENDITION_EXT, RENDITION_OPTIONS = "WEBP", "webp", {"quality": 80, "method": 4}
+else:
+    RENDITION_FORMAT, RENDITION_EXT, RENDITION_OPTIONS = "JPEG", "jpg", {"quality": 82, "optimize": True}
+
+
+RENDITION_PATTERN = re.compile(
+    r"([0-9a-f]{64})\.(?:%s)\.%s$" % ("|".join(name for name, _ in RENDITION_SIZES), RENDITION_EXT)
+)
+
+
+def rendition_suffix(name: str) -> str:
+    return f".{name}.{RENDITION_EXT}"
+
+
+def rendition_urls(store, digest: str) -> Dict[str, str]:
+    return {name: store.variant_url(digest, rendition_suffix(name)) for name, _ in RENDITION_SIZES}
+
+
+def create_renditions(store, digest: str, img: Image.Image) -> Dict[str, str]:
+    """
+    Write any missing renditions for a stored blob and return their URLs.
+
+    Renditions that already exist (a deduplicated upload) are not rebuilt.
+    """
+    urls = {}
+    source = img
+
+    for name, max_side in RENDITION_SIZES:
+        suffix = rendition_suffix(name)
+        path = store.variant_path(digest, suffix)
+        urls[name] = store.variant_url(digest, suffix)
+
+        if path.exists():
+            continue
+
+        rendition = source.copy()
+        if max(rendition.size) > max_side:
+            rendition.thumbnail((max_side, max_side), Image.LANCZOS, reducing_gap=2.0)
+        source = rendition
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f".{path.name}.{uuid.uuid4().hex[:8]}.tmp")
+        rendition.save(tmp_path, RENDITION_FORMAT, **RENDITION_OPTIONS)
+        os.replace(tmp_path, path)
+
+    return urls
+
+
+class RenditionWriter:
+    """Writes renditions off the request path, holding a store reference meanwhile"""
+
+    def __init__(self, store, workers: int = RENDITION_WORKERS, max_pending: int = MAX_PENDING):
+        self.store = store
+        self.max_pending = max_pending
+        self.executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="renditions")
+        self.pending: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self.counters = {"scheduled": 0, "deferred": 0, "on_demand": 0, "failed": 0}
+
+    def schedule(self, digest: str, img: Image.Image) -> Dict[str, str]:
+        """Queue the renditions of a decoded upload; returns their URLs at once"""
+        with self._lock:
+            if digest not in self.pending:
+                if len(self.pending) >= self.max_pending or not self.store.acquire(digest):
+                    self.counters["deferred"] += 1
+                else:
+                    self.counters["scheduled"] += 1
+                    self.pending[digest] = self.executor.submit(self._write, digest, img)
+        return rendition_urls(self.store, digest)
+
+    def _write(self, digest: str, img: Optional[Image.Image] = None):
+        try:
+            if img is None:
+                blob = self.store.get(digest)
+                if blob is None or not blob["path"].exists():
+                    return False
+                with Image.open(blob["path"]) as original:
+                    img = original.convert("RGB")
+            create_renditions(self.store, digest, img)
+            return True
+        except Exception as e:
+            self.counters["failed"] += 1
+            print(f"⚠️ Could not write renditions for {digest[:12]}: {e}")
+            return False
+        finally:
+            with self._lock:
+                if self.pending.pop(digest, None) is not None:
+                    self.store.release(digest)
+
+    async def ensure(self, digest: str) -> bool:
+        """Wait for, or build, the renditions of a digest; False if its blob is gone"""
+        future = self.pending.get(digest)
+        if future is None:
+            self.counters["on_demand"] += 1
+            future = self.executor.submit(self._write, digest)
+        return await asyncio.wrap_future(future)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
+
+    def stats(self):
+        return {"pending": len(self.pending), **self.counters}
+
+
+class RenditionStaticFiles(CachedStaticFiles):
+    """Static files where a rendition that is not written yet is waited for"""
+
+    def __init__(self, *args, writer: RenditionWriter, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.writer = writer
+
+    async def get_response(self, path: str, scope: Scope) -> Response:
+        try:
+            return await super().get_response(path, scope)
+        except HTTPException as e:
+            match = RENDITION_PATTERN.search(path)
+            if e.status_code != 404 or match is None or not await self.writer.ensure(match.group(1)):
+                raise
+        return await super().get_response(path, scope)
@@ -0,0 +1,109 @@
+"""
+Content-negotiated response encoding for prediction results.
+
+JSON is produced with orjson and MessagePack is offered to clients that
+ask for it; both are in requirements.txt, and a server without them falls
+back to standard-library JSON (saying so once in the log). A compact mode strips the static
+class metadata (icons, colours, descriptions) that every result repeats;
+clients fetch it once from ``/api/models`` and match it by
+``metadata_version``.
+"""
+
+import json
+import hashlib
+from typing import Dict, Any, List, Optional
+
+from fastapi import Request
+from starlette.requests import HTTPConnection
+from fastapi.responses import Response
+
+from dental_common.metrics import timed, attach_timing
+
+try:
+    import orjson
+except ImportError:  # falls back to the standard library
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # MessagePack requests are answered with JSON
+    msgpack = None
+
+MSGPACK_TYPES = ("application/msgpack", "application/x-msgpack")
+
+# Fields dropped from results in compact mode: static class presentation,
+# plus per-image detail that compact results replace (all_probabilities
+# becomes the ``probabilities`` list) or leave to the full response
+STATIC_RESULT_KEYS = {
+    "icon", "color", "description", "interpretation", "top_probabilities",
+    "all_probabilities", "model_loaded", "raw_probability",
+    "healthy_probability", "gingivitis_probability", "upload_time"
+}
+
+
+def _default(obj):
+    # numpy scalars and arrays that slip into results
+    if hasattr(obj, "tolist"):
+        return obj.tolist()
+    raise TypeError(f"Object of type {type(obj).__name__} is not serializable")
+
+
+def dumps(content: Any) -> bytes:
+    """Serialize to JSON bytes with the fastest available encoder"""
+    if orjson is not None:
+        return orjson.dumps(content, default=_default)
+    return json.dumps(content, default=_default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def metadata_version(metadata: Any) -> str:
+    """Stable short hash of the static class metadata"""
+    encoded = json.dumps(metadata, sort_keys=True, ensure_ascii=False).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()[:12]
+
+
+def wants_compact(connection: HTTPConnection) -> bool:
+    return connection.query_params.get("compact", "").lower() in ("1", "true", "yes")
+
+
+_msgpack_missing_logged = False
+
+
+def wants_msgpack(request: Request) -> bool:
+    global _msgpack_missing_logged
+    accept = request.headers.get("accept", "")
+    if not any(media_type in accept for media_type in MSGPACK_TYPES):
+        return False
+    if msgpack is None:
+        if not _msgpack_missing_logged:
+            print("⚠️ A client asked for MessagePack but msgpack is not installed; answering with JSON")
+            _msgpack_missing_logged = True
+        return False
+    return True
+
+
+def compact_result(result: Dict[str, Any], class_names: Optional[List[str]], version: str) -> Dict[str, Any]:
+    """
+    Model outputs only: probabilities become a list of fractions in the
+    class order published by ``/api/models``.
+    """
+    compact = {
+        key: value for key, value in result.items()
+        if key not in STATIC_RESULT_KEYS and not (key == "error" and value is None)
+    }
+    probabilities = result.get("all_probabilities")
+    if class_names and probabilities:
+        total = sum(probabilities.values()) or 1.0
+        compact["probabilities"] = [round(probabilities.get(name, 0.0) / total, 4) for name in class_names]
+    compact["metadata_version"] = version
+    return compact
+
+
+def encode_response(request: Request, content: Any, status_code: int = 200) -> Response:
+    """MessagePack if the client accepts it, JSON otherwise"""
+    headers = {"Vary": "Accept"}
+    content = attach_timing(content)
+    with timed("serialize"):
+        if wants_msgpack(request):
+            body = msgpack.packb(content, use_bin_type=True, default=_default)
+            return Response(body, status_code=status_code, media_type=MSGPACK_TYPES[0], headers=headers)
+        return Response(dumps(content), status_code=status_code, media_type="application/json", headers=headers)
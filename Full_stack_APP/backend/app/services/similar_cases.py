@@ -0,0 +1,351 @@
+"""
+Similar-case search over the embeddings of previously analysed images.
+
+Each model type has its own vector index: L2-normalised penultimate-layer
+embeddings appended to a growable float16 memory-mapped file, so the
+vectors live in the page cache rather than the Python heap. Small indexes
+are searched exactly. Once an index reaches ``DENTAL_SIMILAR_TRAIN_MIN``
+vectors it is partitioned with spherical k-means (an inverted file): every
+vector is filed under its nearest centroid, a query only scans the
+``DENTAL_SIMILAR_NPROBE`` closest lists, and new vectors are filed as they
+arrive. The partition is retrained in a background thread when the index
+has grown fourfold; inserts and searches keep using the current partition
+until the new one is swapped in.
+The stored predictions live in a small SQLite table beside the vectors.
+"""
+
+import os
+import json
+import time
+import sqlite3
+import threading
+from array import array
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Tuple
+
+import numpy as np
+
+TRAIN_MIN = int(os.getenv("DENTAL_SIMILAR_TRAIN_MIN", "4096"))
+NPROBE = int(os.getenv("DENTAL_SIMILAR_NPROBE", "8"))
+MAX_RESULTS = 50
+TRAIN_SAMPLE = 50000
+KMEANS_ITERATIONS = 10
+SCAN_CHUNK = 65536
+INITIAL_CAPACITY = 1024
+
+
+def normalize(vector: np.ndarray) -> np.ndarray:
+    vector = np.asarray(vector, dtype=np.float32).ravel()
+    return vector / (np.linalg.norm(vector) or 1.0)
+
+
+def _top_k(similarities: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k largest values, best first"""
+    if len(similarities) > k:
+        candidates = np.argpartition(-similarities, k - 1)[:k]
+    else:
+        candidates = np.arange(len(similarities))
+    return candidates[np.argsort(-similarities[candidates])]
+
+
+class VectorIndex:
+    """Append-only memory-mapped vectors with an optional inverted-file partition"""
+
+    def __init__(self, directory: Path, count: int = 0, lock: Optional[threading.Lock] = None):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.count = count
+        self.dim = None
+        self.capacity = 0
+        self.trained_count = 0
+        self.centroids: Optional[np.ndarray] = None
+        self.lists: List[array] = []
+        self._vectors = None
+        self._assign = None
+        # Guards every read and write of the index; training takes it only to swap in
+        self._lock = lock or threading.Lock()
+        self._training: Optional[threading.Thread] = None
+        self._generation = 0
+
+        state_path = self.directory / "state.json"
+        if state_path.exists():
+            with open(state_path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+            self.dim, self.capacity, self.trained_count = state["dim"], state["capacity"], state["trained_count"]
+            self._open()
+            centroids_path = self.directory / "centroids.npy"
+            if self.trained_count and centroids_path.exists():
+                self.centroids = np.load(centroids_path)
+                self._rebuild_lists()
+
+    def _open(self):
+        self._vectors = np.memmap(self.directory / "vectors.f16", dtype=np.float16, mode="r+",
+                                  shape=(self.capacity, self.dim))
+        self._assign = np.memmap(self.directory / "assign.i32", dtype=np.int32, mode="r+",
+                                 shape=(self.capacity,))
+
+    def _save_state(self):
+        with open(self.directory / "state.json", "w", encoding="utf-8") as f:
+            json.dump({"dim": self.dim, "capacity": self.capacity, "trained_count": self.trained_count}, f)
+
+    def _grow(self, needed: int):
+        """Double the memory-mapped files until ``needed`` rows fit"""
+        capacity = max(INITIAL_CAPACITY, self.capacity)
+        while capacity < needed:
+            capacity *= 2
+        if self._vectors is not None:
+            self._vectors.flush()
+            self._assign.flush()
+            self._vectors = self._assign = None
+        for name, row_bytes in (("vectors.f16", self.dim * 2), ("assign.i32", 4)):
+            with open(self.directory / name, "ab") as f:
+                f.truncate(capacity * row_bytes)
+        self.capacity = capacity
+        self._open()
+        self._save_state()
+
+    def reset(self, dim: int):
+        """Drop every vector, e.g. when the model (and so its embedding size) changed"""
+        self._generation += 1  # a partition still being trained is discarded
+        self._vectors = self._assign = None
+        for name in ("vectors.f16", "assign.i32", "centroids.npy", "state.json"):
+            (self.directory / name).unlink(missing_ok=True)
+        self.count = self.capacity = self.trained_count = 0
+        self.centroids = None
+        self.lists = []
+        self.dim = dim
+        self._grow(INITIAL_CAPACITY)
+
+    def add(self, vector: np.ndarray) -> int:
+        """Append one normalised vector; returns its row. Call with the lock held."""
+        if self.dim is None:
+            self.reset(len(vector))
+        if self.count >= self.capacity:
+            self._grow(self.count + 1)
+
+        row = self.count
+        self._vectors[row] = vector
+        self._assign[row] = -1
+        if self.centroids is not None:
+            cluster = int(np.argmax(self.centroids @ vector))
+            self._assign[row] = cluster
+            self.lists[cluster].append(row)
+        self.count += 1
+
+        if self.count >= TRAIN_MIN and self.count >= 4 * self.trained_count and self._training is None:
+            self._training = threading.Thread(target=self.train, name=f"similar-train-{self.directory.name}",
+                                              daemon=True)
+            self._training.start()
+        return row
+
+    def train(self):
+        """
+        Partition the vectors present now, without holding the lock, then
+        swap the new partition in. Call without the lock held.
+        """
+        started = time.time()
+        with self._lock:
+            # The mapping stays valid if the files grow or are reset meanwhile
+            vectors, count, generation = self._vectors, self.count, self._generation
+        try:
+            centroids = self._fit(vectors, count)
+            assignments = self._assign_rows(vectors, centroids, 0, count)
+            lists = self._lists_from(assignments, len(centroids))
+
+            with self._lock:
+                if generation != self._generation:
+                    return
+                # Vectors added while training ran
+                late = self._assign_rows(self._vectors, centroids, count, self.count)
+                for offset, cluster in enumerate(late):
+                    lists[cluster].append(count + offset)
+                self._assign[:count] = assignments
+                self._assign[count:self.count] = late
+                self._assign.flush()
+                np.save(self.directory / "centroids.npy", centroids)
+                self.centroids, self.lists = centroids, lists
+                self.trained_count = count
+                self._save_state()
+            print(f"🗂️ Similar-case index partitioned: {count} vectors in {len(centroids)} lists "
+                  f"({(time.time() - started):.1f}s)")
+        except Exception as e:
+            print(f"⚠️ Could not partition the similar-case index {self.directory}: {e}")
+        finally:
+            with self._lock:
+                self._training = None
+
+    @staticmethod
+    def _fit(vectors: np.ndarray, count: int) -> np.ndarray:
+        """Spherical k-means centroids from a sample of the first ``count`` rows"""
+        rng = np.random.default_rng(count)
+        nlist = int(np.clip(np.sqrt(count), 16, 4096))
+        sample_rows = np.sort(rng.choice(count, min(count, TRAIN_SAMPLE), replace=False))
+        sample = np.asarray(vectors[sample_rows], dtype=np.float32)
+
+        centroids = sample[rng.choice(len(sample), nlist, replace=False)]
+        for _ in range(KMEANS_ITERATIONS):
+            labels = np.argmax(sample @ centroids.T, axis=1)
+            counts = np.bincount(labels, minlength=nlist)
+            starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+            sums = np.zeros_like(centroids)
+            filled = counts > 0
+            sums[filled] = np.add.reduceat(sample[np.argsort(labels, kind="stable")], starts[filled], axis=0)
+            # Re-seed empty clusters from random samples
+            sums[~filled] = sample[rng.choice(len(sample), int((~filled).sum()))]
+            centroids = sums / np.linalg.norm(sums, axis=1, keepdims=True)
+        return centroids.astype(np.float32)
+
+    @staticmethod
+    def _assign_rows(vectors: np.ndarray, centroids: np.ndarray, start: int, stop: int) -> np.ndarray:
+        """Nearest centroid of rows ``start:stop``"""
+        assignments = np.empty(max(0, stop - start), dtype=np.int32)
+        for offset in range(start, stop, SCAN_CHUNK):
+            chunk = np.asarray(vectors[offset:min(offset + SCAN_CHUNK, stop)], dtype=np.float32)
+            assignments[offset - start:offset - start + len(chunk)] = np.argmax(chunk @ centroids.T, axis=1)
+        return assignments
+
+    @staticmethod
+    def _lists_from(assignments: np.ndarray, nlist: int) -> List[array]:
+        order = np.argsort(assignments, kind="stable")
+        bounds = np.searchsorted(assignments[order], np.arange(nlist + 1))
+        return [array("i", order[bounds[i]:bounds[i + 1]].astype(np.int32).tobytes()) for i in range(nlist)]
+
+    def _rebuild_lists(self):
+        self.lists = self._lists_from(np.asarray(self._assign[:self.count]), len(self.centroids))
+
+    def search(self, query: np.ndarray, k: int, nprobe: int = NPROBE) -> Tuple[np.ndarray, np.ndarray]:
+        """(rows, cosine similarities) of the k nearest vectors, best first"""
+        if not self.count:
+            return np.array([], dtype=np.int64), np.array([], dtype=np.float32)
+
+        if self.centroids is None:
+            rows, scores = [], []
+            for start in range(0, self.count, SCAN_CHUNK):
+                chunk = np.asarray(self._vectors[start:min(start + SCAN_CHUNK, self.count)], dtype=np.float32)
+                similarities = chunk @ query
+                best = _top_k(similarities, k)
+                rows.append(best + start)
+                scores.append(similarities[best])
+            rows, scores = np.concatenate(rows), np.concatenate(scores)
+        else:
+            probes = _top_k(self.centroids @ query, min(nprobe, len(self.centroids)))
+            rows = np.concatenate([np.frombuffer(self.lists[i], dtype=np.int32) for i in probes]).astype(np.int64)
+            rows.sort()  # sequential page access on the memmap
+            scores = np.asarray(self._vectors[rows], dtype=np.float32) @ query
+
+        best = _top_k(scores, k)
+        return rows[best], scores[best]
+
+    def vector(self, row: int) -> np.ndarray:
+        return np.asarray(self._vectors[row], dtype=np.float32)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "vectors": self.count,
+            "dim": self.dim,
+            "partitioned": self.centroids is not None,
+            "training": self._training is not None,
+            "lists": len(self.lists),
+            "bytes": self.capacity * (self.dim or 0) * 2
+        }
+
+
+class SimilarCases:
+    """Per-model vector indexes plus the stored predictions of every indexed image"""
+
+    def __init__(self, root: Path, index_path: Path):
+        self.root = Path(root)
+        Path(index_path).parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(index_path), check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS cases (
+                model_type TEXT NOT NULL,
+                row INTEGER NOT NULL,
+                image_id TEXT NOT NULL,
+                prediction TEXT NOT NULL,
+                confidence REAL NOT NULL,
+                probabilities TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                PRIMARY KEY (model_type, row),
+                UNIQUE (model_type, image_id)
+            )
+        """)
+        self._db.commit()
+        self._indexes: Dict[str, VectorIndex] = {}
+
+    def _index(self, model_type: str) -> VectorIndex:
+        if model_type not in self._indexes:
+            # Rows past the last committed case were never recorded; they get overwritten
+            count = self._db.execute(
+                "SELECT COALESCE(MAX(row) + 1, 0) FROM cases WHERE model_type = ?", (model_type,)
+            ).fetchone()[0]
+            self._indexes[model_type] = VectorIndex(self.root / model_type, count, self._lock)
+        return self._indexes[model_type]
+
+    def add(self, model_type: str, image_id: str, embedding: np.ndarray, result: Dict[str, Any]) -> bool:
+        """Index an analysed image; repeat uploads of the same image are skipped"""
+        vector = normalize(embedding)
+        with self._lock:
+            known = self._db.execute(
+                "SELECT 1 FROM cases WHERE model_type = ? AND image_id = ?", (model_type, image_id)
+            ).fetchone()
+            if known:
+                return False
+            index = self._index(model_type)
+            if index.dim is not None and index.dim != len(vector):
+                print(f"⚠️ {model_type} embedding size changed ({index.dim} -> {len(vector)}), "
+                      f"clearing its similar-case index")
+                self._db.execute("DELETE FROM cases WHERE model_type = ?", (model_type,))
+                index.reset(len(vector))
+            row = index.add(vector)
+            self._db.execute(
+                """
+                INSERT INTO cases (model_type, row, image_id, prediction, confidence, probabilities, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                """,
+                (model_type, row, image_id, result["prediction"], result["confidence"],
+                 json.dumps(result.get("all_probabilities", {})), time.time())
+            )
+            self._db.commit()
+        return True
+
+    def search(self, model_type: str, image_id: str, k: int = 5) -> Optional[List[Dict[str, Any]]]:
+        """The k cases most similar to an indexed image, or None if it is not indexed"""
+        k = max(1, min(k, MAX_RESULTS))
+        with self._lock:
+            found = self._db.execute(
+                "SELECT row FROM cases WHERE model_type = ? AND image_id = ?", (model_type, image_id)
+            ).fetchone()
+            if found is None:
+                return None
+            index = self._index(model_type)
+            rows, scores = index.search(index.vector(found[0]), k + 1)
+            matches = [(int(row), float(score)) for row, score in zip(rows, scores) if row != found[0]][:k]
+            cases = []
+            for row, score in matches:
+                case = self._db.execute(
+                    """
+                    SELECT image_id, prediction, confidence, probabilities, created_at
+                    FROM cases WHERE model_type = ? AND row = ?
+                    """,
+                    (model_type, row)
+                ).fetchone()
+                if case is None:
+                    continue
+                cases.append({
+                    "image_id": case[0],
+                    "similarity": round(score, 4),
+                    "prediction": case[1],
+                    "confidence": case[2],
+                    "all_probabilities": json.loads(case[3]),
+                    "analyzed_at": case[4]
+                })
+        return cases
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            model_types = [row[0] for row in self._db.execute("SELECT DISTINCT model_type FROM cases")]
+            return {model_type: self._index(model_type).stats() for model_type in model_types}
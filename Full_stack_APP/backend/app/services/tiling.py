@@ -0,0 +1,155 @@
+"""
+Tiled inference for high-resolution photographs.
+
+Instead of squashing a full-arch photo to 224x224, the image is cut into
+overlapping 224 tiles that are scored in a few evenly sized batches. Tile
+probabilities are merged into an image-level result (each condition takes
+its strongest tile, so a small lesion is not averaged away) and a coarse
+per-tile map. When a photo would need more tiles than the request's
+budget, it is downscaled until the grid fits.
+"""
+
+import os
+import math
+import time
+from typing import Dict, Any, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+from starlette.requests import HTTPConnection
+
+from dental_common.metrics import timed
+
+TILE_SIZE = 224
+TILE_OVERLAP = float(os.getenv("DENTAL_TILE_OVERLAP", "0.25"))
+TILE_BATCH = int(os.getenv("DENTAL_TILE_BATCH", "8"))
+MAX_TILE_BUDGET = int(os.getenv("DENTAL_TILE_BUDGET", "48"))
+
+
+def wants_tiled(connection: HTTPConnection) -> bool:
+    return connection.query_params.get("tiled", "").lower() in ("1", "true", "yes")
+
+
+def tile_budget(connection: HTTPConnection) -> int:
+    """Per-request ?tile_budget=, capped by the server maximum"""
+    try:
+        requested = int(connection.query_params.get("tile_budget", MAX_TILE_BUDGET))
+    except ValueError:
+        requested = MAX_TILE_BUDGET
+    return max(1, min(requested, MAX_TILE_BUDGET))
+
+
+def _positions(length: int, tile: int, stride: int, max_count: Optional[int] = None) -> List[int]:
+    """Tile offsets covering ``length``; the last tile is aligned to the edge"""
+    count = 1 + math.ceil(max(0, length - tile) / stride)
+    if max_count:
+        count = min(count, max_count)
+    if count == 1:
+        return [0]
+    return [round(i * (length - tile) / (count - 1)) for i in range(count)]
+
+
+def plan_tiles(width: int, height: int, budget: int, tile: int = TILE_SIZE,
+               overlap: float = TILE_OVERLAP) -> Tuple[float, List[int], List[int]]:
+    """Scale factor and x/y tile offsets for a grid of at most ``budget`` tiles"""
+    stride = max(1, int(tile * (1 - overlap)))
+    min_scale = tile / min(width, height)  # the short side must hold one tile
+    scale = max(1.0, min_scale)
+    while True:
+        xs = _positions(round(width * scale), tile, stride)
+        ys = _positions(round(height * scale), tile, stride)
+        if len(xs) * len(ys) <= budget:
+            return scale, xs, ys
+        if scale <= min_scale:
+            # Very elongated image: spread the budget along the long side
+            xs = _positions(round(width * scale), tile, stride, max(1, budget // len(ys)))
+            ys = _positions(round(height * scale), tile, stride, max(1, budget // len(xs)))
+            return scale, xs, ys
+        # Shrink towards the budget
+        scale = max(min_scale, scale * max(0.5, min(0.95, math.sqrt(budget / (len(xs) * len(ys))))))
+
+
+def batch_sizes(count: int, target: int = TILE_BATCH) -> List[int]:
+    """Split ``count`` tiles into near-equal batches no larger than ``target``"""
+    batches = max(1, math.ceil(count / max(1, target)))
+    base, extra = divmod(count, batches)
+    return [base + (1 if i < extra else 0) for i in range(batches)]
+
+
+def _distribution(outputs: np.ndarray) -> np.ndarray:
+    """Model outputs as class distributions; sigmoid becomes [1 - p, p]"""
+    if outputs.shape[-1] == 1:
+        return np.concatenate([1 - outputs, outputs], axis=-1)
+    return outputs
+
+
+def merge_tiles(distributions: np.ndarray, class_names: List[str], healthy_class: str) -> np.ndarray:
+    """
+    Image-level distribution: every condition takes its strongest tile and
+    the healthy class its weakest, renormalised.
+    """
+    merged = distributions.max(axis=0)
+    if healthy_class in class_names:
+        index = class_names.index(healthy_class)
+        merged[index] = distributions[:, index].min()
+    return merged / (merged.sum() or 1.0)
+
+
+def predict_tiled(predictor, img: Image.Image, budget: int = MAX_TILE_BUDGET,
+                  batch_target: int = TILE_BATCH, start_time: Optional[float] = None) -> Dict[str, Any]:
+    """Blocking; call through the scheduler like any other model call"""
+    start_time = start_time or time.time()
+    try:
+        width, height = img.size
+        scale, xs, ys = plan_tiles(width, height, budget)
+        if scale != 1.0:
+            img = img.resize((round(width * scale), round(height * scale)), Image.BILINEAR)
+
+        with timed("preprocess", predictor.model_type):
+            tiles = [
+                np.asarray(predictor.preprocess_image(img.crop((x, y, x + TILE_SIZE, y + TILE_SIZE))))
+                for y in ys for x in xs
+            ]
+        batches = batch_sizes(len(tiles), batch_target)
+        outputs = []
+        offset = 0
+        for size in batches:
+            batch = np.concatenate(tiles[offset:offset + size])
+            with timed("inference", predictor.model_type, size):
+                outputs.append(predictor.model.predict(batch, verbose=0, batch_size=size))
+            offset += size
+        outputs = np.concatenate(outputs)
+
+        distributions = _distribution(outputs)
+        merged = merge_tiles(distributions, predictor.class_names, predictor.healthy_class)
+        output = merged[1:] if outputs.shape[-1] == 1 else merged
+
+        result = predictor.build_result(output, start_time)
+        result["tiles"] = tile_map(distributions, predictor.class_names, xs, ys, scale, batches)
+        return result
+    except Exception as e:
+        return predictor._error_result(str(e))
+
+
+def tile_map(distributions: np.ndarray, class_names: List[str], xs: List[int], ys: List[int],
+             scale: float, batches: List[int]) -> Dict[str, Any]:
+    """Coarse spatial map: top class per tile and per-class probability grids"""
+    rows, cols = len(ys), len(xs)
+    grid = distributions.reshape(rows, cols, -1)
+    return {
+        "rows": rows,
+        "cols": cols,
+        "count": rows * cols,
+        "tile_size": TILE_SIZE,
+        "scale": round(scale, 4),
+        # Tile origins in original-image pixels
+        "x": [round(x / scale) for x in xs],
+        "y": [round(y / scale) for y in ys],
+        "batches": batches,
+        "prediction": [[class_names[int(np.argmax(cell))] for cell in row] for row in grid],
+        # Python floats, so float32 noise does not survive rounding (as in build_result)
+        "probabilities": {
+            name: [[round(float(p) * 100, 2) for p in row] for row in grid[:, :, i]]
+            for i, name in enumerate(class_names)
+        }
+    }
@@ -0,0 +1,77 @@
+"""
+Batched test-time augmentation.
+
+The augmented views of an image (flip, small crops, brightness) are
+preprocessed into one batch and scored in a single forward pass; their
+probabilities are averaged with the original view. In ``auto`` mode the
+original is scored first and the views only run when its confidence is
+below ``DENTAL_TTA_THRESHOLD``, so confident images still cost one pass.
+"""
+
+import os
+from typing import Dict, Any, List, Optional, Tuple, Callable
+
+import numpy as np
+from PIL import Image, ImageEnhance
+from starlette.requests import HTTPConnection
+
+TTA_MODES = ("off", "auto", "always")
+DEFAULT_MODE = os.getenv("DENTAL_TTA", "off")
+UNCERTAIN_BELOW = float(os.getenv("DENTAL_TTA_THRESHOLD", "0.85"))
+CROP_FRACTION = 0.9
+
+
+def tta_mode(connection: HTTPConnection) -> str:
+    """?tta=off|auto|always, falling back to DENTAL_TTA"""
+    mode = connection.query_params.get("tta", DEFAULT_MODE).lower()
+    return mode if mode in TTA_MODES else DEFAULT_MODE
+
+
+def tta_views(img: Image.Image) -> List[Image.Image]:
+    """Augmented views of an RGB image, excluding the original"""
+    width, height = img.size
+    crop_w, crop_h = int(width * CROP_FRACTION), int(height * CROP_FRACTION)
+    left, top = (width - crop_w) // 2, (height - crop_h) // 2
+    return [
+        img.transpose(Image.FLIP_LEFT_RIGHT),
+        img.crop((left, top, left + crop_w, top + crop_h)),
+        img.crop((0, 0, crop_w, crop_h)),
+        img.crop((width - crop_w, height - crop_h, width, height)),
+        ImageEnhance.Brightness(img).enhance(0.9),
+        ImageEnhance.Brightness(img).enhance(1.1),
+    ]
+
+
+def is_uncertain(confidence: float) -> bool:
+    # No lower bound: the least certain predictions need the views most
+    return confidence < UNCERTAIN_BELOW
+
+
+def run_tta(model, img: Image.Image, preprocess: Callable, mode: str = "off",
+            confidence: Callable[[np.ndarray], float] = lambda output: float(np.max(output))
+            ) -> Tuple[np.ndarray, Optional[Dict[str, Any]]]:
+    """
+    Model output vector for ``img`` (averaged over views when TTA runs) and
+    a summary of what TTA did, or None when it is off. ``preprocess``
+    returns a batch of one; ``confidence`` maps an output vector to 0-1.
+    """
+    single = np.asarray(preprocess(img))
+
+    if mode == "always":
+        batch = np.concatenate([single] + [np.asarray(preprocess(view)) for view in tta_views(img)])
+        outputs = model.predict(batch, verbose=0, batch_size=len(batch))
+        return outputs.mean(axis=0), {"mode": mode, "views": len(batch), "triggered": True}
+
+    output = model.predict(single, verbose=0, batch_size=1)[0]
+    if mode != "auto":
+        return output, None
+
+    single_confidence = confidence(output)
+    info = {"mode": mode, "views": 1, "triggered": False, "single_view_confidence": round(single_confidence * 100, 2)}
+    if not is_uncertain(single_confidence):
+        return output, info
+
+    views = np.concatenate([np.asarray(preprocess(view)) for view in tta_views(img)])
+    outputs = model.predict(views, verbose=0, batch_size=len(views))
+    info.update({"views": len(views) + 1, "triggered": True})
+    return (output + outputs.sum(axis=0)) / (len(views) + 1), info
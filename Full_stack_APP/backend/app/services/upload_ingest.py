@@ -0,0 +1,315 @@
+"""
+Streaming multipart ingestion for image uploads.
+
+The request body is consumed chunk by chunk straight from the ASGI stream.
+Per-file and per-request byte limits are enforced while the bytes arrive,
+each file is hashed and sniffed incrementally, and file data is spooled to
+a temporary file once it grows past a small in-memory threshold.
+"""
+
+import os
+import hashlib
+import tempfile
+from typing import Dict, Any, List, Optional, Callable, Awaitable
+
+try:
+    from multipart.multipart import MultipartParser, parse_options_header
+except ImportError:  # python-multipart >= 0.0.13 renamed the module
+    from python_multipart.multipart import MultipartParser, parse_options_header
+
+from fastapi import Request
+
+CHUNK_SIZE = 64 * 1024
+MAX_FILE_BYTES = int(os.getenv("DENTAL_MAX_FILE_MB", "10")) * 1024 * 1024
+MAX_REQUEST_BYTES = int(os.getenv("DENTAL_MAX_REQUEST_MB", "100")) * 1024 * 1024
+MAX_BATCH_FILES = int(os.getenv("DENTAL_MAX_BATCH_FILES", "100"))
+MAX_FIELD_BYTES = 64 * 1024
+SPOOL_MAX_BYTES = 1024 * 1024
+
+# Magic bytes -> (image type, canonical media type)
+IMAGE_SIGNATURES = [
+    (b"\xff\xd8\xff", "jpeg", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "png", "image/png"),
+]
+SNIFF_BYTES = 16
+ALLOWED_TYPES = ['image/jpeg', 'image/png', 'image/jpg']
+
+# Container magic bytes -> (video type, canonical media type); checked at offset
+VIDEO_SIGNATURES = [
+    (4, b"ftyp", "mp4", "video/mp4"),
+    (0, b"\x1a\x45\xdf\xa3", "webm", "video/webm"),
+    (8, b"AVI ", "avi", "video/x-msvideo"),
+]
+ALLOWED_VIDEO_TYPES = ['video/mp4', 'video/quicktime', 'video/webm', 'video/x-msvideo']
+MAX_VIDEO_BYTES = int(os.getenv("DENTAL_MAX_VIDEO_MB", "200")) * 1024 * 1024
+
+EXTENSIONS = {"jpeg": ".jpg", "png": ".png", "mp4": ".mp4", "webm": ".webm", "avi": ".avi"}
+
+
+class UploadRejected(Exception):
+    """Raised when a request body cannot be accepted"""
+
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+
+def sniff_image_type(header: bytes) -> Optional[str]:
+    """Detect the image type from its leading magic bytes"""
+    for signature, image_type, _ in IMAGE_SIGNATURES:
+        if header.startswith(signature):
+            return image_type
+    return None
+
+
+def sniff_video_type(header: bytes) -> Optional[str]:
+    """Detect the video container from its leading magic bytes"""
+    for offset, signature, video_type, _ in VIDEO_SIGNATURES:
+        if header[offset:offset + len(signature)] == signature:
+            return video_type
+    return None
+
+
+class IngestedFile:
+    """A single uploaded file, spooled to memory or disk while it streams in"""
+
+    def __init__(self, field_name: str, filename: str, content_type: str, max_bytes: int, video: bool = False):
+        self.field_name = field_name
+        self.filename = filename
+        self.content_type = content_type
+        self.max_bytes = max_bytes
+        self.video = video
+        self.size = 0
+        self.sha256: Optional[str] = None
+        self.image_type: Optional[str] = None
+        self.error: Optional[str] = None
+        self.error_status = 400
+        self.file = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES)
+        self._hasher = hashlib.sha256()
+        self._head = b""
+
+    def write(self, data: bytes):
+        self.size += len(data)
+        if self.error:
+            return
+
+        if self.size > self.max_bytes:
+            self._reject(f"File too large (max {self.max_bytes // (1024 * 1024)}MB)", 413)
+            return
+
+        if self.image_type is None:
+            self._head += data[:SNIFF_BYTES]
+            if len(self._head) >= SNIFF_BYTES:
+                self._sniff()
+                if self.error:
+                    return
+
+        self._hasher.update(data)
+        self.file.write(data)
+
+    def finish(self):
+        if self.error:
+            return
+        if self.size == 0:
+            self._reject("Empty file", 400)
+            return
+        if self.image_type is None:
+            self._sniff()
+            if self.error:
+                return
+        self.sha256 = self._hasher.hexdigest()
+        self.file.seek(0)
+
+    def _sniff(self):
+        if self.video:
+            self.image_type = sniff_video_type(self._head)
+            allowed = ALLOWED_VIDEO_TYPES
+        else:
+            self.image_type = sniff_image_type(self._head)
+            allowed = ALLOWED_TYPES
+        if self.image_type is None:
+            self._reject(f"Invalid file type. Use: {', '.join(allowed)}", 400)
+
+    def _reject(self, message: str, status_code: int):
+        self.error = message
+        self.error_status = status_code
+        # Release whatever was buffered; the rest of the part is discarded
+        self.file.close()
+
+    @property
+    def media_type(self) -> Optional[str]:
+        for _, image_type, media_type in IMAGE_SIGNATURES:
+            if image_type == self.image_type:
+                return media_type
+        for _, _, video_type, media_type in VIDEO_SIGNATURES:
+            if video_type == self.image_type:
+                return media_type
+        return None
+
+    @property
+    def extension(self) -> str:
+        return EXTENSIONS.get(self.image_type, "")
+
+    def chunks(self):
+        """Iterate over the spooled content in fixed-size chunks"""
+        self.file.seek(0)
+        while True:
+            chunk = self.file.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+        self.file.seek(0)
+
+    def close(self):
+        self.file.close()
+
+
+class IngestedForm:
+    """Form fields and files parsed from a multipart request"""
+
+    def __init__(self):
+        self.fields: Dict[str, str] = {}
+        self.files: List[IngestedFile] = []
+
+    def get(self, name: str, default: Optional[str] = None) -> Optional[str]:
+        return self.fields.get(name, default)
+
+    def get_file(self, name: str) -> Optional[IngestedFile]:
+        for upload in self.files:
+            if upload.field_name == name:
+                return upload
+        return None
+
+    def get_files(self, name: str) -> List[IngestedFile]:
+        return [upload for upload in self.files if upload.field_name == name]
+
+    def close(self):
+        for upload in self.files:
+            upload.close()
+
+
+async def ingest_upload(
+    request: Request,
+    max_files: int = 1,
+    max_file_bytes: int = MAX_FILE_BYTES,
+    max_request_bytes: int = MAX_REQUEST_BYTES,
+    on_file: Optional[Callable[[IngestedFile], Awaitable[None]]] = None,
+    video: bool = False
+) -> IngestedForm:
+    """
+    Parse a multipart/form-data request body incrementally.
+
+    Raises UploadRejected as soon as the request exceeds its limits; a file
+    that exceeds the per-file limit or is not a supported image is marked
+    with an error and its remaining bytes are discarded.
+
+    ``on_file`` is awaited with each file as soon as its part ends, before
+    more of the body is read, so very large uploads can be stored and
+    closed one file at a time. With ``video`` set, files are sniffed as
+    video containers instead of images.
+    """
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or b"boundary" not in params:
+        raise UploadRejected("Expected multipart/form-data upload", 400)
+
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > max_request_bytes:
+        raise UploadRejected(f"Request too large (max {max_request_bytes // (1024 * 1024)}MB)", 413)
+
+    form = IngestedForm()
+    state: Dict[str, Any] = {
+        "header_field": b"",
+        "header_value": b"",
+        "headers": {},
+        "file": None,
+        "field_name": None,
+        "field_value": b"",
+        "error": None,
+        "finished": []
+    }
+
+    def on_part_begin():
+        state["headers"] = {}
+        state["file"] = None
+        state["field_name"] = None
+        state["field_value"] = b""
+
+    def on_header_field(data, start, end):
+        state["header_field"] += data[start:end]
+
+    def on_header_value(data, start, end):
+        state["header_value"] += data[start:end]
+
+    def on_header_end():
+        state["headers"][state["header_field"].lower()] = state["header_value"]
+        state["header_field"] = b""
+        state["header_value"] = b""
+
+    def on_headers_finished():
+        _, options = parse_options_header(state["headers"].get(b"content-disposition", b""))
+        name = options.get(b"name", b"").decode("utf-8", "replace")
+        if b"filename" in options:
+            if len(form.files) >= max_files:
+                state["error"] = UploadRejected(f"Too many files (max {max_files})", 413)
+                return
+            upload = IngestedFile(
+                field_name=name,
+                filename=os.path.basename(options[b"filename"].decode("utf-8", "replace")),
+                content_type=state["headers"].get(b"content-type", b"").decode("latin-1"),
+                max_bytes=max_file_bytes,
+                video=video
+            )
+            form.files.append(upload)
+            state["file"] = upload
+        else:
+            state["field_name"] = name
+
+    def on_part_data(data, start, end):
+        if state["file"] is not None:
+            state["file"].write(data[start:end])
+        elif state["field_name"] is not None:
+            state["field_value"] += data[start:end]
+            if len(state["field_value"]) > MAX_FIELD_BYTES:
+                state["error"] = UploadRejected("Form field too large", 413)
+
+    def on_part_end():
+        if state["file"] is not None:
+            state["file"].finish()
+            if on_file is not None:
+                state["finished"].append(state["file"])
+        elif state["field_name"] is not None:
+            form.fields[state["field_name"]] = state["field_value"].decode("utf-8", "replace")
+
+    parser = MultipartParser(params[b"boundary"], {
+        "on_part_begin": on_part_begin,
+        "on_part_data": on_part_data,
+        "on_part_end": on_part_end,
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end,
+        "on_headers_finished": on_headers_finished,
+    })
+
+    received = 0
+    try:
+        async for chunk in request.stream():
+            received += len(chunk)
+            if received > max_request_bytes:
+                raise UploadRejected(f"Request too large (max {max_request_bytes // (1024 * 1024)}MB)", 413)
+            parser.write(chunk)
+            if state["error"] is not None:
+                raise state["error"]
+            while state["finished"]:
+                await on_file(state["finished"].pop(0))
+        parser.finalize()
+        while state["finished"]:
+            await on_file(state["finished"].pop(0))
+    except UploadRejected:
+        form.close()
+        raise
+    except Exception as e:
+        form.close()
+        raise UploadRejected(f"Malformed upload: {str(e)}", 400)
+
+    return form
@@ -0,0 +1,247 @@
+"""
+Content-addressed storage for uploaded images.
+
+Blobs are named by their sha256 digest and sharded into two levels of
+nested directories (``ab/cd/abcd....jpg``) so no single directory grows
+without bound. Each unique image is written once; repeated uploads only
+update a small SQLite index.
+
+A request holds a reference to its blob from ``put`` until it calls
+``release``, so retention never deletes an image that is still being
+scored. Unreferenced blobs stay on disk (their URLs are still served)
+until the janitor ages them out.
+"""
+
+import os
+import time
+import uuid
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, Any, Optional, List, Tuple, Set, Callable
+
+from .upload_ingest import IngestedFile
+
+SHARD_DEPTH = 2
+SHARD_WIDTH = 2
+
+
+class UploadStore:
+    """Sharded, deduplicating blob store with reference counting"""
+
+    def __init__(self, root: Path, index_path: Path, url_prefix: str = "/static/uploads"):
+        self.root = Path(root)
+        self.url_prefix = url_prefix.rstrip("/")
+        self.root.mkdir(parents=True, exist_ok=True)
+        Path(index_path).parent.mkdir(parents=True, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._pin_sources: List[Callable[[], Set[str]]] = []
+        self._db = sqlite3.connect(str(index_path), check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS blobs (
+                digest TEXT PRIMARY KEY,
+                ext TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                refcount INTEGER NOT NULL DEFAULT 1,
+                created_at REAL NOT NULL,
+                last_used_at REAL NOT NULL
+            )
+        """)
+        self._db.execute("CREATE INDEX IF NOT EXISTS blobs_last_used ON blobs (last_used_at)")
+        # References belong to requests, which do not survive a restart
+        self._db.execute("UPDATE blobs SET refcount = 0 WHERE refcount != 0")
+        self._db.commit()
+
+    def relative_path(self, digest: str, ext: str) -> str:
+        """Shard path for a blob; ``ext`` may also be a variant suffix"""
+        shards = [digest[i * SHARD_WIDTH:(i + 1) * SHARD_WIDTH] for i in range(SHARD_DEPTH)]
+        return "/".join(shards + [f"{digest}{ext}"])
+
+    def path_for(self, digest: str, ext: str) -> Path:
+        return self.root / self.relative_path(digest, ext)
+
+    def url_for(self, digest: str, ext: str) -> str:
+        return f"{self.url_prefix}/{self.relative_path(digest, ext)}"
+
+    def variant_path(self, digest: str, suffix: str) -> Path:
+        """Path for a derived file (e.g. a rendition) stored beside the blob"""
+        return self.path_for(digest, suffix)
+
+    def variant_url(self, digest: str, suffix: str) -> str:
+        return self.url_for(digest, suffix)
+
+    def put(self, upload: IngestedFile) -> Dict[str, Any]:
+        """
+        Store an ingested upload and take a reference to it.
+
+        If the digest is already known only the reference count changes;
+        the blob itself is not rewritten.
+        """
+        digest = upload.sha256
+        ext = upload.extension
+        now = time.time()
+
+        with self._lock:
+            row = self._db.execute(
+                "SELECT ext FROM blobs WHERE digest = ?", (digest,)
+            ).fetchone()
+            if row is not None:
+                self._db.execute(
+                    "UPDATE blobs SET refcount = refcount + 1, last_used_at = ? WHERE digest = ?",
+                    (now, digest)
+                )
+                self._db.commit()
+                return self._describe(digest, row[0], upload.size, deduplicated=True)
+
+        # Write outside the lock; identical concurrent writes are harmless
+        path = self.path_for(digest, ext)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f".{path.name}.{uuid.uuid4().hex[:8]}.tmp")
+        with open(tmp_path, 'wb') as buffer:
+            for chunk in upload.chunks():
+                buffer.write(chunk)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            self._db.execute(
+                """
+                INSERT INTO blobs (digest, ext, size, refcount, created_at, last_used_at)
+                VALUES (?, ?, ?, 1, ?, ?)
+                ON CONFLICT(digest) DO UPDATE SET
+                    refcount = refcount + 1, last_used_at = excluded.last_used_at
+                """,
+                (digest, ext, upload.size, now, now)
+            )
+            self._db.commit()
+
+        return self._describe(digest, ext, upload.size, deduplicated=False)
+
+    def get(self, digest: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT ext, size, refcount FROM blobs WHERE digest = ?", (digest,)
+            ).fetchone()
+        if row is None:
+            return None
+        blob = self._describe(digest, row[0], row[1], deduplicated=False)
+        blob["refcount"] = row[2]
+        return blob
+
+    def acquire(self, digest: str) -> bool:
+        """Take another reference to a stored blob; False if it is gone"""
+        with self._lock:
+            updated = self._db.execute(
+                "UPDATE blobs SET refcount = refcount + 1 WHERE digest = ?", (digest,)
+            ).rowcount
+            self._db.commit()
+        return bool(updated)
+
+    def release(self, digest: str) -> bool:
+        """
+        Drop one reference taken by ``put``; returns True when none remain
+        and the blob is left to retention
+        """
+        with self._lock:
+            self._db.execute(
+                "UPDATE blobs SET refcount = refcount - 1 WHERE digest = ? AND refcount > 0", (digest,)
+            )
+            self._db.commit()
+            row = self._db.execute(
+                "SELECT refcount FROM blobs WHERE digest = ?", (digest,)
+            ).fetchone()
+        return row is not None and row[0] == 0
+
+    def add_pin_source(self, source: Callable[[], Set[str]]):
+        """Register a callable returning digests that retention must keep"""
+        self._pin_sources.append(source)
+
+    def usage(self) -> List[Tuple[float, int, str]]:
+        """
+        (last used, size, digest) for every unreferenced, unpinned blob, for
+        retention sweeps. The size is what is on disk for the digest: the blob plus
+        the renditions derived from it.
+        """
+        pinned = set()
+        for source in self._pin_sources:
+            pinned |= source()
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT last_used_at, size, digest, ext FROM blobs WHERE refcount = 0"
+            ).fetchall()
+
+        # One listing per shard directory instead of a glob per digest
+        listings: Dict[Path, Dict[str, int]] = {}
+        usage = []
+        for last_used, size, digest, ext in rows:
+            if digest in pinned:
+                continue
+            shard = self.path_for(digest, ext).parent
+            listing = listings.get(shard)
+            if listing is None:
+                listing = listings[shard] = self._list_shard(shard)
+            on_disk = sum(file_size for name, file_size in listing.items() if name.startswith(digest))
+            usage.append((last_used, on_disk or size, digest))
+        return usage
+
+    def evict(self, digests: List[str]) -> Tuple[int, int]:
+        """Delete unreferenced blobs; returns (count, bytes)"""
+        with self._lock:
+            rows = []
+            for digest in digests:
+                # Re-checked here: a request may have taken a reference since the scan
+                row = self._db.execute(
+                    "SELECT digest, ext, size FROM blobs WHERE digest = ? AND refcount = 0", (digest,)
+                ).fetchone()
+                if row is not None:
+                    rows.append(row)
+            self._db.executemany("DELETE FROM blobs WHERE digest = ?", [(r[0],) for r in rows])
+            self._db.commit()
+
+        reclaimed = 0
+        for digest, ext, _ in rows:
+            reclaimed += self._unlink(digest, ext)
+        return len(rows), reclaimed
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            count, total_bytes, references = self._db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(refcount), 0) FROM blobs"
+            ).fetchone()
+        return {
+            "blobs": count,
+            "bytes": total_bytes,
+            "references": references
+        }
+
+    @staticmethod
+    def _list_shard(shard: Path) -> Dict[str, int]:
+        try:
+            with os.scandir(shard) as it:
+                return {entry.name: entry.stat().st_size for entry in it if entry.is_file()}
+        except FileNotFoundError:
+            return {}
+
+    def _unlink(self, digest: str, ext: str) -> int:
+        # Removes the blob and any variants derived from it; returns the bytes freed
+        path = self.path_for(digest, ext)
+        freed = 0
+        for candidate in path.parent.glob(f"{digest}*"):
+            try:
+                size = candidate.stat().st_size
+                candidate.unlink()
+                freed += size
+            except FileNotFoundError:
+                pass
+        return freed
+
+    def _describe(self, digest: str, ext: str, size: int, deduplicated: bool) -> Dict[str, Any]:
+        return {
+            "digest": digest,
+            "path": self.path_for(digest, ext),
+            "url": self.url_for(digest, ext),
+            "size": size,
+            "deduplicated": deduplicated
+        }
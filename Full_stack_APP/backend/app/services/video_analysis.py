@@ -0,0 +1,188 @@
+"""
+Clip analysis with temporal frame deduplication.
+
+Consecutive camera frames are nearly identical, so each sampled frame is
+reduced to a tiny greyscale signature and compared with the last frame the
+model actually scored. Only frames that changed materially (or that are
+too old to trust) are sent to the model; the rest inherit the latest
+prediction. Results are merged into per-segment timelines and a
+duration-weighted verdict for the whole clip.
+"""
+
+import os
+import time
+from typing import Dict, Any, List, Callable, Optional
+
+import cv2
+import numpy as np
+from PIL import Image
+
+SAMPLE_FPS = float(os.getenv("DENTAL_VIDEO_SAMPLE_FPS", "10"))
+DIFF_THRESHOLD = float(os.getenv("DENTAL_VIDEO_DIFF_THRESHOLD", "6.0"))
+MAX_GAP_SECONDS = float(os.getenv("DENTAL_VIDEO_MAX_GAP_S", "5"))
+MAX_CLIP_SECONDS = float(os.getenv("DENTAL_VIDEO_MAX_SECONDS", "120"))
+SIGNATURE_SIZE = (32, 32)
+
+
+class VideoDecodeError(Exception):
+    """Raised when a clip cannot be opened or contains no frames"""
+
+
+def frame_signature(frame: np.ndarray) -> np.ndarray:
+    """Downscaled greyscale thumbnail used for cheap frame comparison"""
+    grey = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    return cv2.resize(grey, SIGNATURE_SIZE, interpolation=cv2.INTER_AREA).astype(np.float32)
+
+
+def signature_distance(a: np.ndarray, b: np.ndarray) -> float:
+    """Mean absolute difference on a 0-255 scale; brightness drift is ignored"""
+    return float(np.mean(np.abs((a - a.mean()) - (b - b.mean()))))
+
+
+def analyze_video(
+    path: str,
+    predict: Callable[[Image.Image], Dict[str, Any]],
+    sample_fps: float = SAMPLE_FPS,
+    diff_threshold: float = DIFF_THRESHOLD,
+    max_gap_seconds: float = MAX_GAP_SECONDS,
+    max_seconds: float = MAX_CLIP_SECONDS
+) -> Dict[str, Any]:
+    """
+    Score a clip, running ``predict`` only on frames that changed.
+
+    ``predict`` takes an RGB PIL image and returns a predictor result dict.
+    Raises VideoDecodeError if the clip cannot be read.
+    """
+    start_time = time.time()
+    capture = cv2.VideoCapture(path)
+    if not capture.isOpened():
+        raise VideoDecodeError("Could not open video")
+
+    try:
+        fps = capture.get(cv2.CAP_PROP_FPS)
+        if not fps or fps != fps or fps > 240:
+            fps = 30.0
+        step = max(1, int(round(fps / sample_fps)))
+
+        samples: List[Dict[str, Any]] = []
+        current: Optional[Dict[str, Any]] = None
+        last_signature = None
+        last_scored_at = 0.0
+        inferences = 0
+        index = 0
+
+        while True:
+            # grab() skips decoding frames between samples
+            if not capture.grab():
+                break
+            timestamp = index / fps
+            sample = index % step == 0
+            index += 1
+            if not sample:
+                continue
+            if timestamp > max_seconds:
+                break
+
+            ok, frame = capture.retrieve()
+            if not ok:
+                break
+
+            signature = frame_signature(frame)
+            changed = (
+                last_signature is None
+                or signature_distance(signature, last_signature) > diff_threshold
+                or timestamp - last_scored_at >= max_gap_seconds
+            )
+            if changed:
+                img = Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+                current = predict(img)
+                if current.get("error"):
+                    return {"error": current["error"]}
+                inferences += 1
+                last_signature = signature
+                last_scored_at = timestamp
+
+            samples.append({"time": timestamp, "scored": changed, "result": current})
+    finally:
+        capture.release()
+
+    if not samples:
+        raise VideoDecodeError("Video contains no decodable frames")
+
+    sample_duration = step / fps
+    segments = build_segments(samples, sample_duration)
+    return {
+        "duration_s": round(samples[-1]["time"] + sample_duration, 2),
+        "fps": round(fps, 2),
+        "frames_sampled": len(samples),
+        "inferences": inferences,
+        "inference_ratio": round(inferences / len(samples), 4),
+        "verdict": clip_verdict(segments),
+        "segments": segments,
+        "processing_time_ms": round((time.time() - start_time) * 1000, 2)
+    }
+
+
+def build_segments(samples: List[Dict[str, Any]], sample_duration: float) -> List[Dict[str, Any]]:
+    """Merge consecutive samples with the same prediction into segments"""
+    segments: List[Dict[str, Any]] = []
+    for sample in samples:
+        result = sample["result"]
+        segment = segments[-1] if segments else None
+        if segment is None or segment["prediction"] != result["prediction"]:
+            segment = {
+                "start_s": round(sample["time"], 2),
+                "end_s": round(sample["time"], 2),
+                "prediction": result["prediction"],
+                "frames": 0,
+                "inferences": 0,
+                "_confidences": [],
+                "_probabilities": []
+            }
+            segments.append(segment)
+
+        segment["end_s"] = round(sample["time"] + sample_duration, 2)
+        segment["frames"] += 1
+        segment["_probabilities"].append(result.get("all_probabilities", {}))
+        if sample["scored"]:
+            segment["inferences"] += 1
+            segment["_confidences"].append(result["confidence"])
+
+    for segment in segments:
+        confidences = segment.pop("_confidences")
+        segment["confidence"] = round(sum(confidences) / len(confidences), 2) if confidences else 0.0
+        segment["probabilities"] = mean_probabilities(segment.pop("_probabilities"))
+    return segments
+
+
+def mean_probabilities(distributions: List[Dict[str, float]]) -> Dict[str, float]:
+    """Average class distributions, normalised to percentages"""
+    totals: Dict[str, float] = {}
+    for distribution in distributions:
+        scale = sum(distribution.values()) or 1.0
+        for name, value in distribution.items():
+            totals[name] = totals.get(name, 0.0) + value / scale
+    count = len(distributions) or 1
+    return {name: round(total / count * 100, 2) for name, total in totals.items()}
+
+
+def clip_verdict(segments: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Duration-weighted class distribution across all segments"""
+    totals: Dict[str, float] = {}
+    duration = 0.0
+    for segment in segments:
+        length = segment["end_s"] - segment["start_s"]
+        duration += length
+        for name, value in segment["probabilities"].items():
+            totals[name] = totals.get(name, 0.0) + value * length
+
+    if not totals:
+        return {"prediction": segments[0]["prediction"], "confidence": 0.0, "probabilities": {}}
+
+    probabilities = {name: round(total / (duration or 1.0), 2) for name, total in totals.items()}
+    prediction = max(probabilities, key=probabilities.get)
+    return {
+        "prediction": prediction,
+        "confidence": probabilities[prediction],
+        "probabilities": probabilities
+    }
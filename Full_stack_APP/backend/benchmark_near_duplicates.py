@@ -0,0 +1,143 @@
+"""
+Benchmark near-duplicate lookups: cost vs index size.
+
+Builds multi-index hash tables of synthetic 64-bit perceptual hashes at
+several sizes and times radius lookups against them, next to a vectorised
+linear scan of the same hashes (which also checks that no match is
+missed). A share of the hashes are near-duplicates of earlier ones (a few
+flipped bits) so lookups find real matches. Also times the hashing of
+photos at common sizes, which every lookup pays first.
+
+Usage (from the backend directory):
+    python benchmark_near_duplicates.py
+    python benchmark_near_duplicates.py --sizes 1000 10000 100000 1000000 --radius 8 --json bench.json
+"""
+
+import sys
+import json
+import time
+import argparse
+from pathlib import Path
+
+import numpy as np
+
+# Add the app directory to path
+app_dir = Path(__file__).parent / "app"
+sys.path.insert(0, str(app_dir))
+
+from PIL import Image, ImageFilter
+
+from services.near_duplicates import MultiIndexHash, perceptual_hashes, PHASH_DISTANCE
+
+POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+PHOTO_SIZES = [(640, 480), (1600, 1200), (4000, 3000)]
+
+
+def synthetic_hashes(count: int, duplicate_share: float, rng) -> np.ndarray:
+    """Random 64-bit hashes where ``duplicate_share`` are 1-4 bit variants of earlier ones"""
+    hashes = rng.integers(0, 2 ** 63, size=count, dtype=np.int64).astype(np.uint64)
+    hashes ^= rng.integers(0, 2, size=count, dtype=np.int64).astype(np.uint64) << np.uint64(63)
+    duplicates = np.flatnonzero(rng.random(count) < duplicate_share)
+    duplicates = duplicates[duplicates > 0]
+    for index in duplicates:
+        source = hashes[rng.integers(0, index)]
+        flips = rng.choice(64, rng.integers(1, 5), replace=False)
+        hashes[index] = source ^ np.uint64(sum(1 << int(bit) for bit in flips))
+    return hashes
+
+
+def linear_scan(hashes: np.ndarray, query: int, radius: int) -> np.ndarray:
+    """Indices within ``radius`` by XOR + byte popcount over the whole array"""
+    distances = POPCOUNT[(hashes ^ np.uint64(query)).view(np.uint8).reshape(-1, 8)].sum(axis=1)
+    return np.flatnonzero(distances <= radius)
+
+
+def bench_size(size: int, radius: int, queries: int, duplicate_share: float, rng) -> dict:
+    hashes = synthetic_hashes(size, duplicate_share, rng)
+    values = [int(h) for h in hashes]
+
+    started = time.perf_counter()
+    table = MultiIndexHash(radius)
+    for index, value in enumerate(values):
+        table.add(value, str(index))
+    build_s = time.perf_counter() - started
+
+    # Half the queries are perturbed copies of indexed hashes, half are new
+    picks = rng.integers(0, size, queries)
+    probes = [values[i] ^ (1 << int(rng.integers(0, 64))) if n % 2 == 0 else int(rng.integers(0, 2 ** 63))
+              for n, i in enumerate(picks)]
+
+    index_us, scan_us = [], []
+    checked = found = missed = 0
+    for probe in probes:
+        started = time.perf_counter()
+        matches, candidates = table.search(probe)
+        index_us.append((time.perf_counter() - started) * 1e6)
+
+        started = time.perf_counter()
+        exact = linear_scan(hashes, probe, radius)
+        scan_us.append((time.perf_counter() - started) * 1e6)
+
+        checked += candidates
+        found += bool(matches)
+        missed += len(exact) - len(matches)
+
+    return {
+        "size": size,
+        "build_s": round(build_s, 3),
+        "index_mean_us": round(float(np.mean(index_us)), 1),
+        "index_p95_us": round(float(np.percentile(index_us, 95)), 1),
+        "candidates_checked_pct": round(checked / (queries * size) * 100, 3),
+        "scan_mean_us": round(float(np.mean(scan_us)), 1),
+        "queries_with_match_pct": round(found / queries * 100, 1),
+        "missed_matches": missed
+    }
+
+
+def bench_hashing(runs: int, rng) -> dict:
+    timings = {}
+    for width, height in PHOTO_SIZES:
+        noise = (rng.random((height // 20, width // 20, 3)) * 255).astype(np.uint8)
+        photo = Image.fromarray(noise).resize((width, height), Image.BICUBIC).filter(ImageFilter.GaussianBlur(4))
+        perceptual_hashes(photo)
+        started = time.perf_counter()
+        for _ in range(runs):
+            perceptual_hashes(photo)
+        timings[f"{width}x{height}"] = round((time.perf_counter() - started) / runs * 1000, 2)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark near-duplicate lookup cost vs index size")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--radius", type=int, default=PHASH_DISTANCE, help="Hamming radius (pHash bits)")
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--duplicate-share", type=float, default=0.2,
+                        help="Share of indexed hashes that are near-duplicates of earlier ones")
+    parser.add_argument("--json", type=Path, help="Also write the results as JSON")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(42)
+    print(f"\n⏱️ Hashing cost (pHash + dHash), ms per image")
+    hashing = bench_hashing(10, rng)
+    for size, ms in hashing.items():
+        print(f"   {size:<10} {ms:>7.2f} ms")
+
+    print(f"\n⏱️ Lookup cost, radius {args.radius}, {args.queries} queries per size")
+    print("   size        build    index mean      p95   checked   linear scan   matched  missed")
+    results = []
+    for size in args.sizes:
+        row = bench_size(size, args.radius, args.queries, args.duplicate_share, rng)
+        results.append(row)
+        print(f"   {row['size']:>9,}  {row['build_s']:>6.2f} s  {row['index_mean_us']:>9.1f} µs "
+              f"{row['index_p95_us']:>7.1f}  {row['candidates_checked_pct']:>7.3f}%  "
+              f"{row['scan_mean_us']:>9.1f} µs  {row['queries_with_match_pct']:>6.1f}%  {row['missed_matches']:>6}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"radius": args.radius, "hashing_ms": hashing, "lookups": results}, f, indent=2)
+        print(f"\n💾 Results saved to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,417 @@
+"""
+Fuse the teeth and gum models into one shared-backbone, two-head model.
+
+Both classifiers are split into a convolutional backbone (up to the last
+spatial feature map) and a head. The two backbones are compared weight by
+weight. The fused model keeps one backbone, the dental model's by default,
+and both heads, with outputs ``dental`` and ``gingivitis``. It always
+takes the dental model's preprocessed input.
+
+When the backbones share their weights and both models preprocess images
+the same way, the fused model is exact. Otherwise the grafted head (and,
+with --fine-tune-layers, the top of the backbone) is fine-tuned on an
+image folder to reproduce the original models' outputs; no labels are
+needed. The report gives agreement with the original models and latency
+of one fused pass vs two separate ones.
+
+Usage (from the backend directory):
+    python build_multihead.py                          # compare backbones only
+    python build_multihead.py path/to/images --epochs 5
+    python build_multihead.py path/to/images --backbone gingivitis --fine-tune-layers 10
+"""
+
+import sys
+import json
+import time
+import argparse
+from pathlib import Path
+
+import numpy as np
+
+# Add the app directory to path
+app_dir = Path(__file__).parent / "app"
+sys.path.insert(0, str(app_dir))
+
+import tensorflow as tf
+from tensorflow import keras
+from tensorflow.keras import layers
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png"}
+RESNET_BGR_MEAN = np.array([103.939, 116.779, 123.68], dtype=np.float32)
+SAME_WEIGHTS_TOLERANCE = 1e-6
+
+
+def collect_images(folder: Path):
+    return [str(path) for path in sorted(folder.rglob("*")) if path.suffix.lower() in IMAGE_EXTENSIONS]
+
+
+def split_index(model: keras.Model) -> int:
+    """Index of the last layer with a spatial (4-D) output: the end of the backbone"""
+    for index in range(len(model.layers) - 1, -1, -1):
+        shape = model.layers[index].output_shape
+        if isinstance(shape, tuple) and len(shape) == 4:
+            return index
+    raise ValueError(f"{model.name} has no convolutional feature map to split at")
+
+
+def leaf_layers(model: keras.Model):
+    """Layers in order, with nested models (e.g. a ResNet50 trunk) expanded"""
+    for layer in model.layers:
+        if isinstance(layer, keras.Model):
+            yield from leaf_layers(layer)
+        elif not isinstance(layer, layers.InputLayer):
+            yield layer
+
+
+def backbone_layers(model: keras.Model):
+    split = split_index(model)
+    return [leaf for layer in model.layers[:split + 1] if not isinstance(layer, layers.InputLayer)
+            for leaf in (leaf_layers(layer) if isinstance(layer, keras.Model) else [layer])]
+
+
+def compare_backbones(dental: keras.Model, gingivitis: keras.Model) -> dict:
+    """Weight-level comparison of the two backbones"""
+    a_layers, b_layers = backbone_layers(dental), backbone_layers(gingivitis)
+    a_weights = [w for layer in a_layers for w in layer.get_weights()]
+    b_weights = [w for layer in b_layers for w in layer.get_weights()]
+    report = {
+        "dental_backbone": {"layers": len(a_layers), "parameters": int(sum(w.size for w in a_weights))},
+        "gingivitis_backbone": {"layers": len(b_layers), "parameters": int(sum(w.size for w in b_weights))},
+        "same_architecture": len(a_layers) == len(b_layers) and
+            [w.shape for w in a_weights] == [w.shape for w in b_weights]
+    }
+    if not report["same_architecture"]:
+        report["shared"] = False
+        return report
+
+    shared_prefix = 0
+    first_divergent = None
+    differences = []
+    for a_layer, b_layer in zip(a_layers, b_layers):
+        pairs = list(zip(a_layer.get_weights(), b_layer.get_weights()))
+        same = all(np.allclose(a, b, atol=SAME_WEIGHTS_TOLERANCE) for a, b in pairs)
+        for a, b in pairs:
+            differences.append(float(np.linalg.norm(a - b) / (np.linalg.norm(a) or 1.0)))
+        if same and first_divergent is None:
+            shared_prefix += 1
+        elif not same and first_divergent is None:
+            first_divergent = a_layer.name
+
+    report.update({
+        "shared": first_divergent is None,
+        "shared_prefix_layers": shared_prefix,
+        "first_divergent_layer": first_divergent,
+        "mean_relative_weight_difference": round(float(np.mean(differences)) if differences else 0.0, 6)
+    })
+    return report
+
+
+def same_preprocessing(dental_predictor, gingivitis_predictor, images) -> bool:
+    from services.model_loader import load_image
+
+    probe = load_image(images[0]) if images else \
+        tf.keras.utils.array_to_img(np.random.default_rng(0).uniform(0, 255, (256, 256, 3)))
+    a = np.asarray(dental_predictor.preprocess_image(probe))
+    b = np.asarray(gingivitis_predictor.preprocess_image(probe))
+    return a.shape == b.shape and np.allclose(a, b, atol=1e-3)
+
+
+def resnet_to_unit_adapter() -> layers.Layer:
+    """Fixed 1x1 convolution from ResNet preprocessing (BGR, mean subtracted) to 0-1 RGB"""
+    kernel = np.zeros((1, 1, 3, 3), dtype=np.float32)
+    for out_channel in range(3):
+        kernel[0, 0, 2 - out_channel, out_channel] = 1 / 255
+    bias = RESNET_BGR_MEAN[::-1] / 255
+    return layers.Conv2D(3, 1, name="input_adapter", trainable=False,
+                         kernel_initializer=keras.initializers.Constant(kernel),
+                         bias_initializer=keras.initializers.Constant(bias))
+
+
+def clone_layer(layer: layers.Layer, prefix: str) -> layers.Layer:
+    """Independent copy, so fine-tuning never touches the original models"""
+    config = layer.get_config()
+    config["name"] = f"{prefix}_{layer.name}"
+    if isinstance(layer, keras.Model):
+        clone = keras.models.clone_model(layer)
+        clone._name = config["name"]
+        return clone
+    return layer.__class__.from_config(config)
+
+
+def apply_copies(x, source_layers, prefix: str):
+    """Re-apply ``source_layers`` as a chain on ``x`` with copied weights"""
+    for layer in source_layers:
+        clone = clone_layer(layer, prefix)
+        x = clone(x)
+        clone.set_weights(layer.get_weights())
+    return x
+
+
+def build_multihead(dental: keras.Model, gingivitis: keras.Model, backbone: str) -> tuple:
+    """
+    Fused model, the name of the grafted head (the one that sits on the
+    other model's backbone) and whether a head had to be replaced: a head
+    whose input shape does not match the shared features gets a freshly
+    initialised classifier.
+    """
+    models = {"dental": dental, "gingivitis": gingivitis}
+    grafted = "gingivitis" if backbone == "dental" else "dental"
+    source = models[backbone]
+    split = split_index(source)
+
+    inputs = layers.Input(shape=(224, 224, 3), name="image")
+    x = resnet_to_unit_adapter()(inputs) if backbone == "gingivitis" else inputs
+    features = apply_copies(x, [l for l in source.layers[:split + 1] if not isinstance(l, layers.InputLayer)], "shared")
+
+    outputs = {}
+    fresh_head = False
+    for name, model in models.items():
+        head_split = split_index(model)
+        head = model.layers[head_split + 1:]
+        if model.layers[head_split].output_shape[1:] == features.shape[1:]:
+            y = apply_copies(features, head, name)
+        else:
+            # Different trunk: a new pooled classifier, trained from scratch
+            fresh_head = True
+            units = model.output_shape[-1]
+            y = layers.GlobalAveragePooling2D(name=f"{name}_pool")(features)
+            y = layers.Dense(units, activation="sigmoid" if units == 1 else "softmax", name=f"{name}_predictions")(y)
+        outputs[name] = layers.Activation("linear", name=name)(y)
+    return keras.Model(inputs, outputs, name="dental_gingivitis_multihead"), grafted, fresh_head
+
+
+def set_trainable(fused: keras.Model, grafted: str, fine_tune_layers: int):
+    """Grafted head always; the other head and the top backbone layers only when unfreezing"""
+    for layer in fused.layers:
+        if layer.name.startswith("shared_") or layer.name == "input_adapter":
+            layer.trainable = False
+        else:
+            layer.trainable = layer.name.startswith(grafted) or fine_tune_layers > 0
+    if fine_tune_layers <= 0:
+        return
+
+    shared = [layer for layer in fused.layers if layer.name.startswith("shared_")]
+    for layer in shared:
+        if isinstance(layer, keras.Model):
+            layer.trainable = True
+            for leaf in leaf_layers(layer):
+                leaf.trainable = False
+    leaves = [leaf for layer in shared for leaf in (leaf_layers(layer) if isinstance(layer, keras.Model) else [layer])]
+    # Batch norm statistics stay frozen while fine-tuning
+    candidates = [layer for layer in leaves if layer.weights and not isinstance(layer, layers.BatchNormalization)]
+    for layer in candidates[-fine_tune_layers:]:
+        layer.trainable = True
+
+
+def score_originals(dental_predictor, gingivitis_predictor, images) -> dict:
+    """Outputs of the two original models, each on its own preprocessing"""
+    from services.model_loader import load_image
+
+    dental, gingivitis = [], []
+    for index, path in enumerate(images, start=1):
+        img = load_image(path)
+        dental.append(dental_predictor.model.predict(dental_predictor.preprocess_image(img), verbose=0)[0])
+        gingivitis.append(gingivitis_predictor.model.predict(gingivitis_predictor.preprocess_image(img), verbose=0)[0])
+        if index % 100 == 0:
+            print(f"   Scored {index}/{len(images)} images")
+    return {"dental": np.array(dental, dtype=np.float32), "gingivitis": np.array(gingivitis, dtype=np.float32)}
+
+
+def make_dataset(dental_predictor, images, targets, batch_size: int, shuffle: bool) -> tf.data.Dataset:
+    """Fused-model inputs (dental preprocessing) with both originals' outputs as targets"""
+    def load(path):
+        return np.asarray(dental_predictor.preprocess_image(path.decode("utf-8"))[0], dtype=np.float32)
+
+    dataset = tf.data.Dataset.from_tensor_slices((tf.constant(images), targets))
+    if shuffle:
+        dataset = dataset.shuffle(len(images), reshuffle_each_iteration=True)
+
+    def preprocess(path, target):
+        image = tf.numpy_function(load, [path], tf.float32)
+        image.set_shape((224, 224, 3))
+        return image, target
+
+    return dataset.map(preprocess, num_parallel_calls=tf.data.AUTOTUNE).batch(batch_size).prefetch(2)
+
+
+def as_labels(outputs: np.ndarray) -> np.ndarray:
+    return (outputs[:, 0] > 0.5).astype(int) if outputs.shape[-1] == 1 else np.argmax(outputs, -1)
+
+
+def measure_agreement(fused: keras.Model, dental_predictor, images, targets) -> dict:
+    """Top-1 agreement and mean absolute probability difference per head"""
+    predicted = {"dental": [], "gingivitis": []}
+    for batch, _ in make_dataset(dental_predictor, images, targets, 16, False):
+        outputs = fused(batch, training=False)
+        for name in predicted:
+            predicted[name].append(np.asarray(outputs[name]))
+    report = {"images": len(images)}
+    for name, chunks in predicted.items():
+        fused_out = np.concatenate(chunks) if chunks else np.zeros_like(targets[name])
+        report[name] = {
+            "agreement": round(float(np.mean(as_labels(fused_out) == as_labels(targets[name]))), 4),
+            "mean_abs_probability_diff": round(float(np.mean(np.abs(fused_out - targets[name]))), 6)
+        }
+    return report
+
+
+def latency_ms(model: keras.Model, runs: int = 20) -> float:
+    """Median single-image CPU latency"""
+    sample = np.zeros((1, 224, 224, 3), dtype=np.float32)
+    model(sample, training=False)
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        model(sample, training=False)
+        timings.append((time.perf_counter() - started) * 1000)
+    return float(np.median(timings))
+
+
+def print_comparison(comparison: dict, same_input: bool):
+    print("\n" + "=" * 60)
+    print("🔬 Backbone comparison")
+    print("=" * 60)
+    for name in ("dental_backbone", "gingivitis_backbone"):
+        info = comparison[name]
+        print(f"   {name:<20} {info['layers']:>4} layers  {info['parameters']:>12,} parameters")
+    print(f"   Same architecture:   {comparison['same_architecture']}")
+    if comparison["same_architecture"]:
+        print(f"   Shared weights:      {comparison['shared']} "
+              f"({comparison['shared_prefix_layers']} leading layers identical)")
+        if comparison["first_divergent_layer"]:
+            print(f"   First divergent:     {comparison['first_divergent_layer']} "
+                  f"(mean relative difference {comparison['mean_relative_weight_difference']})")
+    print(f"   Same preprocessing:  {same_input}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fuse the teeth and gum models into one multi-head model")
+    parser.add_argument("folder", type=Path, nargs="?", help="Images for fine-tuning and agreement (no labels needed)")
+    parser.add_argument("--backbone", choices=["dental", "gingivitis"], default="dental",
+                        help="Whose backbone the fused model keeps")
+    parser.add_argument("--fine-tune-layers", type=int, default=0,
+                        help="Also fine-tune this many top backbone layers (0: heads only)")
+    parser.add_argument("--epochs", type=int, default=5)
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--learning-rate", type=float, default=1e-4)
+    parser.add_argument("--val-split", type=float, default=0.2)
+    parser.add_argument("--min-agreement", type=float, default=0.98,
+                        help="Save the fused model only if both heads agree this often with the originals")
+    parser.add_argument("--force", action="store_true", help="Save even below --min-agreement")
+    parser.add_argument("--output", type=Path, help="Defaults to app/models/MULTIHEAD_MODEL.keras")
+    parser.add_argument("--json", type=Path, help="Also write the backbone comparison as JSON")
+    args = parser.parse_args()
+
+    from services.model_loader import DentalDiseasePredictor, GingivitisPredictor
+    from services.multihead import MULTIHEAD_PATH
+
+    dental_predictor = DentalDiseasePredictor()
+    gingivitis_predictor = GingivitisPredictor()
+    if not (dental_predictor.is_loaded and gingivitis_predictor.is_loaded):
+        print("❌ Both the dental and the gingivitis model must be installed in app/models/")
+        sys.exit(1)
+
+    images = collect_images(args.folder) if args.folder else []
+    comparison = compare_backbones(dental_predictor.model, gingivitis_predictor.model)
+    same_input = same_preprocessing(dental_predictor, gingivitis_predictor, images)
+    comparison["same_preprocessing"] = same_input
+    print_comparison(comparison, same_input)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(comparison, f, indent=2)
+        print(f"💾 Comparison saved to {args.json}")
+    if not args.folder:
+        return
+
+    fused, grafted, fresh_head = build_multihead(dental_predictor.model, gingivitis_predictor.model, args.backbone)
+    exact = comparison["shared"] and same_input and not fresh_head
+    print(f"\n🧩 Fused model: {args.backbone} backbone, {fused.count_params():,} parameters "
+          f"(separate models {dental_predictor.model.count_params() + gingivitis_predictor.model.count_params():,})")
+
+    if len(images) < (2 if exact else 10):
+        print(f"❌ Need at least {2 if exact else 10} images in {args.folder}, found {len(images)}")
+        sys.exit(1)
+    print(f"\n🔍 Scoring {len(images)} images with the original models...")
+    targets = score_originals(dental_predictor, gingivitis_predictor, images)
+
+    rng = np.random.default_rng(42)
+    order = rng.permutation(len(images))
+    val_count = max(1, int(len(images) * args.val_split))
+    val_idx, train_idx = order[:val_count], order[val_count:]
+
+    def split_targets(idx):
+        return {name: values[idx] for name, values in targets.items()}
+
+    fine_tuned = not exact or args.fine_tune_layers > 0
+    if fine_tuned:
+        print(f"\n🎓 Fine-tuning the {grafted} head" +
+              (f" and the top {args.fine_tune_layers} backbone layers" if args.fine_tune_layers else "") +
+              f" on {len(train_idx)} images")
+        set_trainable(fused, grafted, args.fine_tune_layers)
+        fused.compile(
+            optimizer=keras.optimizers.Adam(args.learning_rate),
+            # The original models' probabilities are soft targets
+            loss={
+                "dental": keras.losses.CategoricalCrossentropy(),
+                "gingivitis": keras.losses.BinaryCrossentropy()
+            }
+        )
+        train_data = make_dataset(dental_predictor, [images[i] for i in train_idx], split_targets(train_idx),
+                                  args.batch_size, shuffle=True)
+        val_data = make_dataset(dental_predictor, [images[i] for i in val_idx], split_targets(val_idx),
+                                args.batch_size, shuffle=False)
+        fused.fit(train_data, validation_data=val_data, epochs=args.epochs, callbacks=[
+            keras.callbacks.EarlyStopping(monitor="val_loss", patience=2, restore_best_weights=True)
+        ])
+        for layer in fused.layers:
+            layer.trainable = False
+    else:
+        print("\n✅ Shared backbone and input: heads grafted as-is, no fine-tuning needed")
+        val_idx = order
+
+    agreement = measure_agreement(fused, dental_predictor, [images[i] for i in val_idx], split_targets(val_idx))
+    separate_ms = latency_ms(dental_predictor.model) + latency_ms(gingivitis_predictor.model)
+    fused_ms = latency_ms(fused)
+    passed = all(agreement[name]["agreement"] >= args.min_agreement for name in ("dental", "gingivitis"))
+
+    output = args.output or MULTIHEAD_PATH
+    report = {
+        "backbone": args.backbone,
+        "comparison": comparison,
+        "exact": exact,
+        "fine_tuned": fine_tuned,
+        "fine_tune_layers": args.fine_tune_layers,
+        "validation": agreement,
+        "latency_ms": {"separate": round(separate_ms, 2), "fused": round(fused_ms, 2)},
+        "speedup": round(separate_ms / fused_ms, 2) if fused_ms else None,
+        "parameters": {
+            "separate": int(dental_predictor.model.count_params() + gingivitis_predictor.model.count_params()),
+            "fused": int(fused.count_params())
+        },
+        "min_agreement": args.min_agreement,
+        "saved": passed or args.force
+    }
+
+    print("\n" + "=" * 60)
+    print(f"📊 Multi-head report ({args.backbone} backbone, {agreement['images']} images)")
+    print("=" * 60)
+    for name in ("dental", "gingivitis"):
+        print(f"   {name:<11} agreement {agreement[name]['agreement'] * 100:6.2f}%  "
+              f"mean |Δp| {agreement[name]['mean_abs_probability_diff']:.4f}")
+    print(f"   Latency:   separate {separate_ms:.1f} ms  fused {fused_ms:.1f} ms  ({report['speedup']}x)")
+
+    output.parent.mkdir(parents=True, exist_ok=True)
+    if report["saved"]:
+        fused.save(str(output))
+        print(f"\n💾 Fused model saved to {output} (restart the server to apply)")
+    else:
+        print(f"\n⚠️ Agreement below {args.min_agreement * 100:.1f}%, fused model not saved "
+              f"(fine-tune more layers or use --force)")
+    report_path = output.with_suffix(".report.json")
+    with open(report_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"💾 Report saved to {report_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,317 @@
+"""
+Distil a small CPU-friendly student from the full teeth or gum model.
+
+The student is trained on the teacher's temperature-softened predictions
+(plus the folder labels, when images sit in <class_name>/ sub-folders) and
+takes exactly the same preprocessed input as the teacher, so the exported
+file drops into app/models/ as DENTAL_MODEL_LITE.keras or
+GINGIVITIS_MODEL_LITE.keras and is picked up by the existing predictors
+(overload degradation and the cascade). A report compares agreement with
+the teacher, latency and size.
+
+Usage (from the backend directory):
+    python distill_student.py path/to/images --model dental --arch mobilenetv3 --epochs 15
+    python distill_student.py path/to/images --model gingivitis --arch lightweight
+"""
+
+import sys
+import json
+import time
+import argparse
+from pathlib import Path
+
+import numpy as np
+
+# Add the app directory to path
+app_dir = Path(__file__).parent / "app"
+sys.path.insert(0, str(app_dir))
+
+import tensorflow as tf
+from tensorflow import keras
+from tensorflow.keras import layers
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png"}
+TEACHER_MODEL_NAMES = {"dental": "DENTAL_MODEL_BEST.keras", "gingivitis": "GINGIVITIS_MODEL_AUGMENTED.keras"}
+LITE_MODEL_NAMES = {"dental": "DENTAL_MODEL_LITE.keras", "gingivitis": "GINGIVITIS_MODEL_LITE.keras"}
+RESNET_BGR_MEAN = np.array([103.939, 116.779, 123.68], dtype=np.float32)
+
+
+def collect_images(folder: Path, class_names):
+    """(path, class index or -1) for every image, labels from sub-folder names"""
+    by_lower = {name.lower(): i for i, name in enumerate(class_names)}
+    images = []
+    for path in sorted(folder.rglob("*")):
+        if path.suffix.lower() in IMAGE_EXTENSIONS:
+            parent = path.parent.name.lower() if path.parent != folder else None
+            images.append((str(path), by_lower.get(parent, -1)))
+    return images
+
+
+def input_adapter(model_type: str) -> layers.Layer:
+    """
+    Fixed 1x1 convolution mapping the teacher's preprocessed input to the
+    [-1, 1] RGB range the student backbones expect. ResNet preprocessing
+    (BGR, mean subtracted) and 0-1 scaling are both per-pixel affine, so
+    this stays a plain serializable layer.
+    """
+    if model_type == "dental":
+        # rgb = flip(x + mean_bgr); y = rgb / 127.5 - 1
+        kernel = np.zeros((1, 1, 3, 3), dtype=np.float32)
+        for out_channel in range(3):
+            kernel[0, 0, 2 - out_channel, out_channel] = 1 / 127.5
+        bias = RESNET_BGR_MEAN[::-1] / 127.5 - 1
+    else:
+        # y = 2x - 1
+        kernel = np.eye(3, dtype=np.float32).reshape(1, 1, 3, 3) * 2
+        bias = -np.ones(3, dtype=np.float32)
+    return layers.Conv2D(3, 1, name="input_adapter", trainable=False,
+                         kernel_initializer=keras.initializers.Constant(kernel),
+                         bias_initializer=keras.initializers.Constant(bias))
+
+
+def build_student(model_type: str, arch: str, num_outputs: int, width: float) -> keras.Model:
+    inputs = layers.Input(shape=(224, 224, 3))
+    x = input_adapter(model_type)(inputs)
+
+    if arch == "mobilenetv3":
+        try:
+            backbone = keras.applications.MobileNetV3Small(
+                input_shape=(224, 224, 3), include_top=False, weights="imagenet",
+                alpha=width, minimalistic=True, include_preprocessing=False
+            )
+        except Exception as e:
+            print(f"⚠️ ImageNet weights unavailable ({e}), training MobileNetV3 from scratch")
+            backbone = keras.applications.MobileNetV3Small(
+                input_shape=(224, 224, 3), include_top=False, weights=None,
+                alpha=width, minimalistic=True, include_preprocessing=False
+            )
+        x = backbone(x)
+    else:
+        # The lightweight fallback topology, scaled up with batch norm
+        for filters in (32, 64, 128, 256):
+            x = layers.Conv2D(int(filters * width), 3, padding="same", use_bias=False)(x)
+            x = layers.BatchNormalization()(x)
+            x = layers.ReLU()(x)
+            x = layers.MaxPooling2D()(x)
+
+    x = layers.GlobalAveragePooling2D()(x)
+    x = layers.Dropout(0.2)(x)
+    activation = "sigmoid" if num_outputs == 1 else "softmax"
+    outputs = layers.Dense(num_outputs, activation=activation, name="predictions")(x)
+    return keras.Model(inputs, outputs, name=f"{model_type}_{arch}_student")
+
+
+def as_distribution(probabilities):
+    """Sigmoid outputs become two-class distributions; softmax passes through"""
+    if probabilities.shape[-1] == 1:
+        return tf.concat([1 - probabilities, probabilities], axis=-1)
+    return probabilities
+
+
+def soften(probabilities, temperature: float):
+    """Softmax of log-probabilities / T, i.e. the distribution at temperature T"""
+    logits = tf.math.log(tf.clip_by_value(as_distribution(probabilities), 1e-7, 1.0))
+    return tf.nn.softmax(logits / temperature, axis=-1)
+
+
+class Distiller(keras.Model):
+    """Trains the student against the teacher's softened outputs and optional hard labels"""
+
+    def __init__(self, student: keras.Model, teacher: keras.Model, temperature: float, alpha: float):
+        super().__init__()
+        self.student = student
+        self.teacher = teacher
+        self.temperature = temperature
+        self.alpha = alpha
+        self.loss_tracker = keras.metrics.Mean(name="loss")
+        self.agreement_tracker = keras.metrics.Mean(name="agreement")
+
+    @property
+    def metrics(self):
+        return [self.loss_tracker, self.agreement_tracker]
+
+    def compute_losses(self, images, labels, training: bool):
+        teacher_probs = as_distribution(self.teacher(images, training=False))
+        student_probs = self.student(images, training=training)
+        student_dist = as_distribution(student_probs)
+
+        soft_targets = soften(teacher_probs, self.temperature)
+        soft_student = soften(student_probs, self.temperature)
+        distill_loss = keras.losses.kl_divergence(soft_targets, soft_student) * self.temperature ** 2
+
+        # Hard-label term only for images that came with a label
+        labelled = tf.cast(labels >= 0, tf.float32)
+        hard = tf.one_hot(tf.maximum(labels, 0), tf.shape(student_dist)[-1])
+        hard_loss = keras.losses.categorical_crossentropy(hard, student_dist) * labelled
+
+        loss = tf.reduce_mean((1 - self.alpha * labelled) * distill_loss + self.alpha * hard_loss)
+        agreement = tf.cast(tf.equal(tf.argmax(teacher_probs, -1), tf.argmax(student_dist, -1)), tf.float32)
+        return loss, agreement
+
+    def train_step(self, data):
+        images, labels = data
+        with tf.GradientTape() as tape:
+            loss, agreement = self.compute_losses(images, labels, training=True)
+        gradients = tape.gradient(loss, self.student.trainable_variables)
+        self.optimizer.apply_gradients(zip(gradients, self.student.trainable_variables))
+        self.loss_tracker.update_state(loss)
+        self.agreement_tracker.update_state(agreement)
+        return {m.name: m.result() for m in self.metrics}
+
+    def test_step(self, data):
+        images, labels = data
+        loss, agreement = self.compute_losses(images, labels, training=False)
+        self.loss_tracker.update_state(loss)
+        self.agreement_tracker.update_state(agreement)
+        return {m.name: m.result() for m in self.metrics}
+
+
+def make_dataset(predictor, images, batch_size: int, augment: bool) -> tf.data.Dataset:
+    """Images preprocessed by the predictor itself, so student and server inputs match"""
+    def load(path):
+        return np.asarray(predictor.preprocess_image(path.decode("utf-8"))[0], dtype=np.float32)
+
+    paths = tf.constant([path for path, _ in images])
+    labels = tf.constant([label for _, label in images], dtype=tf.int32)
+    dataset = tf.data.Dataset.from_tensor_slices((paths, labels))
+    if augment:
+        dataset = dataset.shuffle(len(images), reshuffle_each_iteration=True)
+
+    def preprocess(path, label):
+        image = tf.numpy_function(load, [path], tf.float32)
+        image.set_shape((224, 224, 3))
+        if augment:
+            image = tf.image.random_flip_left_right(image)
+        return image, label
+
+    return dataset.map(preprocess, num_parallel_calls=tf.data.AUTOTUNE).batch(batch_size).prefetch(2)
+
+
+def latency_ms(model: keras.Model, runs: int = 20) -> float:
+    """Median single-image CPU latency"""
+    sample = np.zeros((1, 224, 224, 3), dtype=np.float32)
+    model(sample, training=False)
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        model(sample, training=False)
+        timings.append((time.perf_counter() - started) * 1000)
+    return float(np.median(timings))
+
+
+def evaluate(student, teacher, dataset) -> dict:
+    agree = correct_student = correct_teacher = labelled = total = 0
+    for images, labels in dataset:
+        teacher_pred = np.argmax(as_distribution(teacher(images, training=False)), -1)
+        student_pred = np.argmax(as_distribution(student(images, training=False)), -1)
+        labels = labels.numpy()
+        mask = labels >= 0
+        total += len(labels)
+        agree += int(np.sum(teacher_pred == student_pred))
+        labelled += int(np.sum(mask))
+        correct_teacher += int(np.sum(teacher_pred[mask] == labels[mask]))
+        correct_student += int(np.sum(student_pred[mask] == labels[mask]))
+
+    metrics = {"images": total, "agreement_with_teacher": round(agree / total, 4) if total else None}
+    if labelled:
+        metrics["accuracy"] = {
+            "teacher": round(correct_teacher / labelled, 4),
+            "student": round(correct_student / labelled, 4)
+        }
+    return metrics
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Distil a lite student model from the full teeth or gum model")
+    parser.add_argument("folder", type=Path, help="Training images, optionally in <class_name>/ sub-folders")
+    parser.add_argument("--model", choices=["dental", "gingivitis"], default="dental")
+    parser.add_argument("--arch", choices=["mobilenetv3", "lightweight"], default="mobilenetv3")
+    parser.add_argument("--width", type=float, default=0.75, help="Width multiplier of the student")
+    parser.add_argument("--epochs", type=int, default=15)
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--learning-rate", type=float, default=1e-3)
+    parser.add_argument("--temperature", type=float, default=4.0)
+    parser.add_argument("--alpha", type=float, default=0.3, help="Weight of the hard-label loss for labelled images")
+    parser.add_argument("--val-split", type=float, default=0.15)
+    parser.add_argument("--output", type=Path, help="Defaults to app/models/<MODEL>_LITE.keras")
+    args = parser.parse_args()
+
+    from services.model_loader import DentalDiseasePredictor, GingivitisPredictor
+
+    predictor = DentalDiseasePredictor() if args.model == "dental" else GingivitisPredictor()
+    if not predictor.is_loaded:
+        print("❌ The full (teacher) model must be installed in app/models/")
+        sys.exit(1)
+    teacher = predictor.model
+    teacher.trainable = False
+
+    images = collect_images(args.folder, predictor.class_names)
+    if len(images) < 10:
+        print(f"❌ Need at least 10 images in {args.folder}, found {len(images)}")
+        sys.exit(1)
+
+    rng = np.random.default_rng(42)
+    order = rng.permutation(len(images))
+    val_count = max(1, int(len(images) * args.val_split))
+    val_images = [images[i] for i in order[:val_count]]
+    train_images = [images[i] for i in order[val_count:]]
+    labelled = sum(1 for _, label in images if label >= 0)
+    print(f"\n📁 {len(train_images)} training / {len(val_images)} validation images ({labelled} labelled)")
+
+    num_outputs = 1 if args.model == "gingivitis" else len(predictor.class_names)
+    student = build_student(args.model, args.arch, num_outputs, args.width)
+    print(f"🎓 Student {student.name}: {student.count_params():,} parameters "
+          f"(teacher {teacher.count_params():,})")
+
+    distiller = Distiller(student, teacher, args.temperature, args.alpha)
+    distiller.compile(optimizer=keras.optimizers.Adam(args.learning_rate))
+    train_data = make_dataset(predictor, train_images, args.batch_size, augment=True)
+    val_data = make_dataset(predictor, val_images, args.batch_size, augment=False)
+    distiller.fit(train_data, validation_data=val_data, epochs=args.epochs, callbacks=[
+        keras.callbacks.EarlyStopping(monitor="val_loss", patience=3, restore_best_weights=True)
+    ])
+
+    output = args.output or app_dir / "models" / LITE_MODEL_NAMES[args.model]
+    output.parent.mkdir(parents=True, exist_ok=True)
+    student.compile(optimizer="adam", loss="binary_crossentropy" if num_outputs == 1 else "sparse_categorical_crossentropy")
+    student.save(str(output))
+
+    # Report: agreement vs latency vs size
+    metrics = evaluate(student, teacher, val_data)
+    teacher_ms = latency_ms(teacher)
+    student_ms = latency_ms(student)
+    teacher_path = app_dir / "models" / TEACHER_MODEL_NAMES[args.model]
+    report = {
+        "model": args.model,
+        "arch": args.arch,
+        "width": args.width,
+        "output": str(output),
+        "validation": metrics,
+        "latency_ms": {"teacher": round(teacher_ms, 2), "student": round(student_ms, 2)},
+        "speedup": round(teacher_ms / student_ms, 2) if student_ms else None,
+        "parameters": {"teacher": int(teacher.count_params()), "student": int(student.count_params())},
+        "size_mb": {
+            "teacher": round(teacher_path.stat().st_size / (1024 * 1024), 2),
+            "student": round(output.stat().st_size / (1024 * 1024), 2)
+        }
+    }
+    report_path = output.with_suffix(".report.json")
+    with open(report_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+
+    print("\n" + "=" * 60)
+    print(f"📊 Distillation report ({args.model}, {args.arch})")
+    print("=" * 60)
+    print(f"   Agreement with teacher: {metrics['agreement_with_teacher'] * 100:.2f}% on {metrics['images']} images")
+    if "accuracy" in metrics:
+        print(f"   Accuracy: teacher {metrics['accuracy']['teacher'] * 100:.1f}%  "
+              f"student {metrics['accuracy']['student'] * 100:.1f}%")
+    print(f"   Latency:  teacher {teacher_ms:.1f} ms  student {student_ms:.1f} ms  ({report['speedup']}x)")
+    print(f"   Params:   teacher {teacher.count_params():,}  student {student.count_params():,}")
+    print(f"   Size:     teacher {report['size_mb']['teacher']} MB  student {report['size_mb']['student']} MB")
+    print(f"\n💾 Student saved to {output}")
+    print(f"💾 Report saved to {report_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+"""
+Evaluate and calibrate the lite -> full model cascade on a labelled folder.
+
+Images are read from <folder>/<class_name>/*; images directly in <folder>
+are used for agreement and latency only. Every image is scored by both the
+lite and the full model, then the cascade is replayed for the thresholds
+to report escalation rate, agreement with the full model, accuracy and
+mean latency saved.
+
+Usage (from the backend directory):
+    python evaluate_cascade.py path/to/labelled --model dental
+    python evaluate_cascade.py path/to/labelled --model dental --calibrate 0.98 --write
+"""
+
+import sys
+import json
+import time
+import argparse
+from pathlib import Path
+
+# Add the app directory to path
+app_dir = Path(__file__).parent / "app"
+sys.path.insert(0, str(app_dir))
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png"}
+NEVER_ACCEPT = 1.01  # above any confidence: always escalate
+
+
+def collect_images(folder: Path, class_names):
+    """(path, label or None) for every image, labels from sub-folder names"""
+    by_lower = {name.lower(): name for name in class_names}
+    images = []
+    for path in sorted(folder.rglob("*")):
+        if path.suffix.lower() not in IMAGE_EXTENSIONS:
+            continue
+        parent = path.parent.name.lower() if path.parent != folder else None
+        images.append((path, by_lower.get(parent)))
+    return images
+
+
+def score_images(predictor, images):
+    """Run both models on every image, timing each"""
+    from services.model_loader import load_image
+
+    samples = []
+    for index, (path, label) in enumerate(images, start=1):
+        img = load_image(str(path))
+
+        started = time.perf_counter()
+        lite = predictor.predict_image(img, lite=True)
+        lite_ms = (time.perf_counter() - started) * 1000
+
+        started = time.perf_counter()
+        full = predictor.predict_image(img)
+        full_ms = (time.perf_counter() - started) * 1000
+
+        if lite.get("error") or full.get("error"):
+            print(f"   ⚠️ Skipping {path.name}: {lite.get('error') or full.get('error')}")
+            continue
+
+        samples.append({
+            "file": str(path),
+            "label": label,
+            "lite": lite["prediction"],
+            "lite_confidence": lite["confidence"] / 100,
+            "full": full["prediction"],
+            "lite_ms": lite_ms,
+            "full_ms": full_ms
+        })
+        if index % 50 == 0:
+            print(f"   Scored {index}/{len(images)} images")
+    return samples
+
+
+def calibrate(samples, class_names, target_agreement):
+    """
+    Lowest threshold per class whose accepted lite answers agree with the
+    full model at least ``target_agreement`` of the time.
+    """
+    thresholds = {}
+    for name in class_names:
+        predicted = sorted(
+            (s for s in samples if s["lite"] == name),
+            key=lambda s: s["lite_confidence"],
+            reverse=True
+        )
+        threshold = NEVER_ACCEPT
+        agree = 0
+        # Walk down from the most confident answer, keeping the lowest passing cut
+        for accepted, sample in enumerate(predicted, start=1):
+            agree += sample["lite"] == sample["full"]
+            # A cut accepts every tie, so only test after the last one
+            tied = accepted < len(predicted) and predicted[accepted]["lite_confidence"] == sample["lite_confidence"]
+            if not tied and agree / accepted >= target_agreement:
+                threshold = sample["lite_confidence"]
+        thresholds[name] = round(threshold, 4)
+    return thresholds
+
+
+def replay(samples, class_names, thresholds, default_threshold):
+    """Cascade outcome for every sample under the given thresholds"""
+    report = {"per_class": {}}
+    escalated = agree = 0
+    cascade_ms = full_ms = 0.0
+    correct = {"lite": 0, "full": 0, "cascade": 0}
+    labelled = 0
+
+    for sample in samples:
+        threshold = thresholds.get(sample["lite"], default_threshold)
+        escalate = sample["lite_confidence"] < threshold
+        final = sample["full"] if escalate else sample["lite"]
+
+        escalated += escalate
+        agree += final == sample["full"]
+        full_ms += sample["full_ms"]
+        cascade_ms += sample["lite_ms"] + (sample["full_ms"] if escalate else 0.0)
+        if sample["label"]:
+            labelled += 1
+            correct["lite"] += sample["lite"] == sample["label"]
+            correct["full"] += sample["full"] == sample["label"]
+            correct["cascade"] += final == sample["label"]
+
+        entry = report["per_class"].setdefault(sample["lite"], {
+            "threshold": threshold, "images": 0, "escalated": 0, "agreement": 0
+        })
+        entry["images"] += 1
+        entry["escalated"] += escalate
+        entry["agreement"] += final == sample["full"]
+
+    total = len(samples) or 1
+    for entry in report["per_class"].values():
+        entry["escalation_rate"] = round(entry["escalated"] / entry["images"], 4)
+        entry["agreement"] = round(entry["agreement"] / entry["images"], 4)
+
+    report.update({
+        "images": len(samples),
+        "escalation_rate": round(escalated / total, 4),
+        "agreement_with_full": round(agree / total, 4),
+        "mean_full_latency_ms": round(full_ms / total, 2),
+        "mean_cascade_latency_ms": round(cascade_ms / total, 2),
+        "mean_latency_saved_ms": round((full_ms - cascade_ms) / total, 2),
+        "latency_saved_pct": round((1 - cascade_ms / full_ms) * 100, 2) if full_ms else 0.0,
+        "labelled_images": labelled
+    })
+    if labelled:
+        report["accuracy"] = {k: round(v / labelled, 4) for k, v in correct.items()}
+    return report
+
+
+def print_report(model_type, report):
+    print("\n" + "=" * 60)
+    print(f"📊 Cascade report ({model_type}, {report['images']} images)")
+    print("=" * 60)
+    print(f"   Escalation rate:       {report['escalation_rate'] * 100:.1f}%")
+    print(f"   Agreement with full:   {report['agreement_with_full'] * 100:.2f}%")
+    print(f"   Mean latency full:     {report['mean_full_latency_ms']:.1f} ms")
+    print(f"   Mean latency cascade:  {report['mean_cascade_latency_ms']:.1f} ms")
+    print(f"   Mean latency saved:    {report['mean_latency_saved_ms']:.1f} ms ({report['latency_saved_pct']:.1f}%)")
+    if "accuracy" in report:
+        acc = report["accuracy"]
+        print(f"   Accuracy ({report['labelled_images']} labelled): lite {acc['lite'] * 100:.1f}%  "
+              f"full {acc['full'] * 100:.1f}%  cascade {acc['cascade'] * 100:.1f}%")
+    print("\n   Class            threshold  images  escalated  agreement")
+    for name, entry in sorted(report["per_class"].items()):
+        print(f"   {name:<16} {entry['threshold']:>9.4f}  {entry['images']:>6}  "
+              f"{entry['escalation_rate'] * 100:>8.1f}%  {entry['agreement'] * 100:>8.2f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate the lite -> full model cascade")
+    parser.add_argument("folder", type=Path, help="Folder of images, optionally in <class_name>/ sub-folders")
+    parser.add_argument("--model", choices=["dental", "gingivitis"], default="dental")
+    parser.add_argument("--calibrate", type=float, metavar="AGREEMENT",
+                        help="Pick per-class thresholds reaching this agreement with the full model (e.g. 0.98)")
+    parser.add_argument("--write", action="store_true", help="Save the calibrated thresholds for the server")
+    parser.add_argument("--json", type=Path, help="Also write the report as JSON")
+    args = parser.parse_args()
+
+    from services.model_loader import DentalDiseasePredictor, GingivitisPredictor
+    from services.cascade import load_thresholds, DEFAULT_THRESHOLD, THRESHOLDS_PATH
+
+    predictor = DentalDiseasePredictor() if args.model == "dental" else GingivitisPredictor()
+    if predictor.lite_model is None or not predictor.is_loaded:
+        print("❌ Both the full and the lite model must be installed in app/models/")
+        sys.exit(1)
+
+    images = collect_images(args.folder, predictor.class_names)
+    if not images:
+        print(f"❌ No images found in {args.folder}")
+        sys.exit(1)
+    print(f"\n🔍 Scoring {len(images)} images with both models...")
+    samples = score_images(predictor, images)
+
+    all_thresholds = load_thresholds()
+    thresholds = all_thresholds.get(args.model, {})
+    if args.calibrate:
+        thresholds = calibrate(samples, predictor.class_names, args.calibrate)
+        print(f"\n🎯 Calibrated thresholds for {args.calibrate * 100:.1f}% agreement: {thresholds}")
+
+    report = replay(samples, predictor.class_names, thresholds, DEFAULT_THRESHOLD)
+    print_report(args.model, report)
+
+    if args.write:
+        all_thresholds[args.model] = thresholds
+        THRESHOLDS_PATH.parent.mkdir(parents=True, exist_ok=True)
+        with open(THRESHOLDS_PATH, "w", encoding="utf-8") as f:
+            json.dump(all_thresholds, f, indent=2)
+        print(f"\n💾 Thresholds saved to {THRESHOLDS_PATH} (restart the server to apply)")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"model": args.model, "thresholds": thresholds, **report}, f, indent=2)
+        print(f"💾 Report saved to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""
+Near-duplicate matching: distinct photos must not collide, copies must.
+
+Renders synthetic frontal views of different mouths (gums, two rows of
+teeth, the dark oral cavity, a few stains) with the same framing, the
+case where a perceptual hash is most likely to confuse two patients. At
+the default thresholds no two of them may match, while JPEG/WebP
+re-encodes and downscales of each one must.
+
+Usage (from the backend directory):
+    python test_near_duplicates.py
+    python -m pytest test_near_duplicates.py
+"""
+
+import io
+import sys
+from pathlib import Path
+from functools import lru_cache
+from itertools import combinations
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFilter
+
+# Add the app directory to path
+app_dir = Path(__file__).parent / "app"
+sys.path.insert(0, str(app_dir))
+
+from services.near_duplicates import (
+    NearDuplicateIndex, perceptual_hashes, hamming, PHASH_DISTANCE, DHASH_DISTANCE, NEAR_DUP_ENABLED
+)
+
+MOUTHS = 60
+RECODES = [(1.0, 40, "JPEG"), (0.5, 40, "JPEG"), (0.3, 50, "JPEG"), (0.6, 60, "WEBP"), (0.25, 30, "JPEG")]
+
+
+@lru_cache(maxsize=None)
+def mouth(seed: int, size=(800, 600)) -> Image.Image:
+    """Synthetic frontal view; every seed is a different mouth in the same framing"""
+    rng = np.random.default_rng(seed)
+    width, height = size
+    gum = tuple(int(c) for c in rng.integers([170, 60, 70], [225, 110, 120]))
+    img = Image.new("RGB", size, gum)
+    draw = ImageDraw.Draw(img)
+    draw.ellipse([width * 0.08, height * 0.42, width * 0.92, height * 0.62], fill=(40, 10, 15))
+
+    for top, bottom in [(0.22, 0.5), (0.54, 0.8)]:
+        x = width * rng.uniform(0.06, 0.12)
+        while x < width * 0.9:
+            tooth = width * rng.uniform(0.07, 0.12)
+            shade = int(rng.integers(200, 250))
+            tint = (shade, shade - int(rng.integers(5, 30)), shade - int(rng.integers(20, 60)))
+            draw.rounded_rectangle(
+                [x, height * (top + rng.uniform(-0.03, 0.03)), x + tooth, height * (bottom + rng.uniform(-0.03, 0.03))],
+                radius=int(tooth * 0.3), fill=tint
+            )
+            x += tooth + width * rng.uniform(0.005, 0.02)
+
+    for _ in range(int(rng.integers(2, 6))):
+        cx, cy, r = rng.uniform(0.1, 0.9) * width, rng.uniform(0.25, 0.75) * height, rng.uniform(8, 25)
+        draw.ellipse([cx - r, cy - r, cx + r, cy + r], fill=(120, 90, 40))
+
+    pixels = np.asarray(img.filter(ImageFilter.GaussianBlur(2)), dtype=np.float32)
+    pixels += rng.normal(0, 6, pixels.shape)
+    return Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8))
+
+
+def recode(img: Image.Image, scale: float, quality: int, fmt: str) -> Image.Image:
+    """What a messaging app does to a forwarded photo"""
+    buffer = io.BytesIO()
+    resized = img.resize((int(img.width * scale), int(img.height * scale)), Image.BILINEAR)
+    resized.save(buffer, fmt, quality=quality)
+    buffer.seek(0)
+    return Image.open(buffer).convert("RGB")
+
+
+def matches(a, b) -> bool:
+    return hamming(a[0], b[0]) <= PHASH_DISTANCE and hamming(a[1], b[1]) <= DHASH_DISTANCE
+
+
+def test_reuse_is_opt_in():
+    assert not NEAR_DUP_ENABLED
+
+
+def test_distinct_mouths_do_not_collide():
+    hashes = [perceptual_hashes(mouth(seed)) for seed in range(MOUTHS)]
+    collisions = [(i, j) for (i, a), (j, b) in combinations(enumerate(hashes), 2) if matches(a, b)]
+    assert not collisions, f"distinct images matched: {collisions}"
+
+
+def test_recoded_copies_match():
+    for seed in range(0, MOUTHS, 4):
+        original = mouth(seed)
+        hashes = perceptual_hashes(original)
+        for scale, quality, fmt in RECODES:
+            copy = perceptual_hashes(recode(original, scale, quality, fmt))
+            assert matches(hashes, copy), f"mouth {seed} re-encoded as {fmt} q{quality} x{scale} missed"
+
+
+def test_phash_radius_sits_between_copies_and_distinct_images():
+    # The pHash check alone must separate them; dHash is only a second guard
+    hashes = [perceptual_hashes(mouth(seed)) for seed in range(MOUTHS)]
+    closest = min(hamming(a[0], b[0]) for a, b in combinations(hashes, 2))
+    farthest_copy = max(
+        hamming(hashes[seed][0], perceptual_hashes(recode(mouth(seed), scale, quality, fmt))[0])
+        for seed in range(0, MOUTHS, 4) for scale, quality, fmt in RECODES
+    )
+    assert farthest_copy <= PHASH_DISTANCE < closest, (farthest_copy, PHASH_DISTANCE, closest)
+
+
+def test_index_serves_copies_only():
+    index = NearDuplicateIndex()
+    for seed in range(MOUTHS // 2):
+        img = mouth(seed)
+        hashes, _ = index.lookup("dental", img)
+        index.add("dental", f"mouth-{seed}", hashes, {"prediction": f"result-{seed}"})
+
+    for seed in range(MOUTHS // 2, MOUTHS):
+        _, result = index.lookup("dental", mouth(seed))
+        assert result is None, f"mouth {seed} was served {result['near_duplicate']}"
+
+    _, result = index.lookup("dental", recode(mouth(3), 0.5, 40, "JPEG"))
+    assert result is not None and result["near_duplicate"]["of"] == "mouth-3"
+    assert result["prediction"] == "result-3"
+
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith("test_") and callable(test):
+            test()
+            print(f"✅ {name}")
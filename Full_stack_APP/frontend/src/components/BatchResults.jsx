@@ -11,6 +11,15 @@ export default function BatchResults({ batchResults, clearResults }) {
         </span>
       </h2>
 
+      {/* The stream ended early (deadline or server error) */}
+      {batchResults.error && (
+        <div className="mb-6 text-sm text-red-700 bg-red-50 border border-red-200 p-3 rounded-lg">
+          <i className="fas fa-exclamation-triangle mr-2"></i>
+          Batch stopped after {batchResults.completed} of {batchResults.total}{" "}
+          images: {batchResults.error}
+        </div>
+      )}
+
       {/* Results Grid - Adjusted gap and cols for better fit with charts */}
       <div className="grid grid-cols-1 md:grid-cols-2 xl:grid-cols-3 gap-6">
         {batchResults.results.map((item, idx) => (
@@ -24,8 +33,12 @@ export default function BatchResults({ batchResults, clearResults }) {
               {item.image_url && (
                 <div className="w-24 h-24 flex-shrink-0">
                   <img
-                    src={item.image_url}
+                    src={item.renditions?.thumb || item.image_url}
                     alt={item.filename}
+                    loading="lazy"
+                    decoding="async"
+                    width={96}
+                    height={96}
                     className="w-full h-full object-cover rounded-lg shadow-sm"
                   />
                 </div>
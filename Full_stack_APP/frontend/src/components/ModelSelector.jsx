@@ -65,6 +65,22 @@ export default function ModelSelector({ models, currentModel, onSelect }) {
           </div>
         </div>
       </div>
+
+      {/* Both models on one image */}
+      <div
+        className={`model-selector bg-white rounded-2xl shadow-lg p-4 mt-6 ${currentModel === "both" ? "selected" : ""}`}
+        onClick={() => onSelect("both")}
+      >
+        <div className="flex justify-between items-center">
+          <div>
+            <h3 className="text-lg font-bold text-gray-800">Full Check</h3>
+            <p className="text-xs text-gray-600">
+              Teeth and gum analysis of the same photo in one upload
+            </p>
+          </div>
+          <div className="text-3xl">🦷🩺</div>
+        </div>
+      </div>
     </div>
   );
 }
@@ -20,11 +20,14 @@ export default function ResultsDisplay({ result, clearResults }) {
           <div className="bg-gradient-to-br from-gray-50 to-gray-100 rounded-xl p-4">
             <h3 className="font-bold text-gray-700 mb-3">Uploaded Image</h3>
             <div className="relative">
-              <img
-                src={result.image_url}
-                alt="Dental scan"
-                className="w-full rounded-lg shadow-lg"
-              />
+              <a href={result.image_url} target="_blank" rel="noreferrer">
+                <img
+                  src={result.renditions?.display || result.image_url}
+                  alt="Dental scan"
+                  decoding="async"
+                  className="w-full rounded-lg shadow-lg"
+                />
+              </a>
               <div className="absolute top-2 right-2 bg-black/70 text-white text-xs px-2 py-1 rounded">
                 {result.upload_time}
               </div>
@@ -80,7 +80,9 @@ export default function UploadSection({
             <span className="font-bold">
               {currentModel === "dental"
                 ? "Teeth Disease (4 classes)"
-                : "Gum Disease (2 classes)"}
+                : currentModel === "both"
+                  ? "Full Check (teeth + gums, single image)"
+                  : "Gum Disease (2 classes)"}
             </span>
           </span>
         </div>
@@ -13,6 +13,7 @@ export default function AnalysisPage({ setModels }) {
   const [currentModel, setCurrentModel] = useState("dental");
   const [activeTab, setActiveTab] = useState("single");
   const [result, setResult] = useState(null);
+  const [combined, setCombined] = useState(null);
   const [batchResults, setBatchResults] = useState(null);
   const [loading, setLoading] = useState(false);
   const [error, setError] = useState(null);
@@ -36,6 +37,7 @@ export default function AnalysisPage({ setModels }) {
   const handleModelSelect = (model) => {
     setCurrentModel(model);
     setResult(null);
+    setCombined(null);
     setBatchResults(null);
     setError(null);
   };
@@ -44,6 +46,7 @@ export default function AnalysisPage({ setModels }) {
   const handleTabSwitch = (tab) => {
     setActiveTab(tab);
     setResult(null);
+    setCombined(null);
     setBatchResults(null);
     setError(null);
   };
@@ -58,10 +61,26 @@ export default function AnalysisPage({ setModels }) {
     setLoading(true);
     setError(null);
     setResult(null);
+    setCombined(null);
 
     try {
-      const data = await dentalAPI.predictSingle(selectedFile, currentModel);
-      setResult(data);
+      if (currentModel === "both") {
+        // One upload; each model's result shares the image info
+        const data = await dentalAPI.analyzeAll(selectedFile);
+        const shared = {
+          image_url: data.image_url,
+          renditions: data.renditions,
+          filename: data.filename,
+          upload_time: data.upload_time,
+        };
+        setCombined([
+          { ...data.dental, ...shared, selected_model: "dental" },
+          { ...data.gingivitis, ...shared, selected_model: "gingivitis" },
+        ]);
+      } else {
+        const data = await dentalAPI.predictSingle(selectedFile, currentModel);
+        setResult(data);
+      }
     } catch (err) {
       setError(err.message);
     } finally {
@@ -75,16 +94,42 @@ export default function AnalysisPage({ setModels }) {
       setError("Please select at least one image");
       return;
     }
+    if (currentModel === "both") {
+      setError("Full Check analyzes one image at a time. Pick a single model for batches.");
+      return;
+    }
 
     setLoading(true);
     setError(null);
     setBatchResults(null);
 
+    // Show each result as soon as the server finishes it
+    const results = [];
     try {
-      const data = await dentalAPI.predictBatch(selectedFiles, currentModel);
-      setBatchResults(data);
+      await dentalAPI.predictBatchStream(
+        selectedFiles,
+        currentModel,
+        (item, index) => {
+          results[index] = item;
+          setBatchResults({
+            results: results.filter(Boolean),
+            model_type: currentModel,
+          });
+        }
+      );
     } catch (err) {
-      setError(err.message);
+      if (results.length) {
+        // Keep what arrived; the batch view says where the stream stopped
+        setBatchResults({
+          results: results.filter(Boolean),
+          model_type: currentModel,
+          error: err.message,
+          completed: err.completed ?? results.filter(Boolean).length,
+          total: selectedFiles.length,
+        });
+      } else {
+        setError(err.message);
+      }
     } finally {
       setLoading(false);
     }
@@ -93,6 +138,7 @@ export default function AnalysisPage({ setModels }) {
   // Clear results
   const clearResults = () => {
     setResult(null);
+    setCombined(null);
     setBatchResults(null);
     setError(null);
   };
@@ -142,6 +188,15 @@ export default function AnalysisPage({ setModels }) {
 
       {result && <ResultsDisplay result={result} clearResults={clearResults} />}
 
+      {combined &&
+        combined.map((item) => (
+          <ResultsDisplay
+            key={item.selected_model}
+            result={item}
+            clearResults={clearResults}
+          />
+        ))}
+
       {batchResults && (
         <BatchResults batchResults={batchResults} clearResults={clearResults} />
       )}
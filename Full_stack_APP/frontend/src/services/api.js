@@ -39,6 +39,29 @@ export const dentalAPI = {
     }
   },
 
+  // Run both models on one image (uploaded and decoded once)
+  async analyzeAll(file) {
+    try {
+      const formData = new FormData();
+      formData.append("file", file);
+
+      const response = await fetch(`${API_BASE_URL}/api/analyze_all`, {
+        method: "POST",
+        body: formData,
+      });
+
+      if (!response.ok) {
+        const error = await response.json();
+        throw new Error(error.error || "Analysis failed");
+      }
+
+      return await response.json();
+    } catch (error) {
+      console.error("Error in combined analysis:", error);
+      throw error;
+    }
+  },
+
   // Predict batch images
   async predictBatch(files, modelType) {
     try {
@@ -65,6 +88,74 @@ export const dentalAPI = {
     }
   },
 
+  // Predict batch images, calling onResult as each image finishes.
+  // Throws if the server ends the stream early (error event or no summary);
+  // the error carries how many images were completed.
+  async predictBatchStream(files, modelType, onResult) {
+    try {
+      const formData = new FormData();
+      files.forEach((file) => {
+        formData.append("files", file);
+      });
+      formData.append("model_type", modelType);
+
+      const response = await fetch(`${API_BASE_URL}/api/predict_batch/stream`, {
+        method: "POST",
+        body: formData,
+      });
+
+      if (!response.ok) {
+        const error = await response.json();
+        throw new Error(error.error || "Batch prediction failed");
+      }
+
+      // NDJSON: one event per line
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = "";
+      let summary = null;
+      let streamError = null;
+      let completed = 0;
+
+      const handleLine = (line) => {
+        if (!line.trim()) return;
+        const message = JSON.parse(line);
+        if (message.event === "result") {
+          completed += 1;
+          onResult(message.result, message.index);
+        } else if (message.event === "summary") {
+          summary = message;
+        } else if (message.event === "error") {
+          streamError = message;
+        }
+      };
+
+      while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        const lines = buffer.split("\n");
+        buffer = lines.pop();
+        lines.forEach(handleLine);
+      }
+      handleLine(buffer + decoder.decode());
+
+      if (streamError || !summary) {
+        const error = new Error(
+          streamError?.error || "Connection closed before the batch finished"
+        );
+        error.completed = streamError?.completed ?? completed;
+        error.total = files.length;
+        throw error;
+      }
+
+      return summary;
+    } catch (error) {
+      console.error("Error in streaming batch prediction:", error);
+      throw error;
+    }
+  },
+
   // Clear uploaded files
   async clearFiles() {
     try {
@@ -0,0 +1,6 @@
+"""
+Modules shared by every backend in this repository.
+
+Each backend puts the repository root on ``sys.path`` before importing
+them, the same way the backend scripts add ``app/`` to reach ``services``.
+"""
@@ -0,0 +1,200 @@
+"""
+Background retention and quota enforcement for generated files.
+
+Each registered target (a plain directory or the content-addressed upload
+store) gets a TTL and a total-bytes quota. A periodic sweep plans what to
+delete off the event loop, then removes files in small batches so a large
+cleanup never stalls request handling.
+"""
+
+import os
+import time
+import asyncio
+from pathlib import Path
+from typing import Dict, Any, List, Tuple, Optional
+
+from fastapi.concurrency import run_in_threadpool
+
+# Defaults, overridable per target
+DEFAULT_TTL_SECONDS = float(os.getenv("DENTAL_RETENTION_HOURS", "24")) * 3600
+DEFAULT_MAX_BYTES = int(os.getenv("DENTAL_RETENTION_QUOTA_MB", "1024")) * 1024 * 1024
+SWEEP_INTERVAL_SECONDS = float(os.getenv("DENTAL_JANITOR_INTERVAL_S", "300"))
+DELETE_BATCH_SIZE = 100
+
+
+class DirectoryTarget:
+    """Files under a directory tree, aged by modification time"""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+
+    def scan(self) -> List[Tuple[float, int, str]]:
+        entries = []
+        stack = [str(self.path)]
+        while stack:
+            try:
+                with os.scandir(stack.pop()) as it:
+                    for entry in it:
+                        if entry.name.startswith("."):
+                            continue
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                        elif entry.is_file(follow_symlinks=False):
+                            stat = entry.stat(follow_symlinks=False)
+                            entries.append((stat.st_mtime, stat.st_size, entry.path))
+            except FileNotFoundError:
+                continue
+        return entries
+
+    def delete(self, keys: List[str]) -> Tuple[int, int]:
+        deleted, reclaimed = 0, 0
+        for key in keys:
+            try:
+                size = os.path.getsize(key)
+                os.unlink(key)
+                deleted += 1
+                reclaimed += size
+            except OSError:
+                pass
+        return deleted, reclaimed
+
+
+class StoreTarget:
+    """Blobs in an UploadStore, aged by last use"""
+
+    def __init__(self, store):
+        self.store = store
+
+    def scan(self) -> List[Tuple[float, int, str]]:
+        return self.store.usage()
+
+    def delete(self, keys: List[str]) -> Tuple[int, int]:
+        return self.store.evict(keys)
+
+
+class Janitor:
+    """Periodic, incremental cleanup of registered targets"""
+
+    def __init__(self, interval_seconds: float = SWEEP_INTERVAL_SECONDS, batch_size: int = DELETE_BATCH_SIZE):
+        self.interval_seconds = interval_seconds
+        self.batch_size = batch_size
+        self.targets: Dict[str, Dict[str, Any]] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._sweep_lock = asyncio.Lock()
+
+    def add_directory(self, name: str, path: Path, ttl_seconds: float = DEFAULT_TTL_SECONDS,
+                      max_bytes: int = DEFAULT_MAX_BYTES):
+        self._add(name, DirectoryTarget(path), ttl_seconds, max_bytes)
+
+    def add_store(self, name: str, store, ttl_seconds: float = DEFAULT_TTL_SECONDS,
+                  max_bytes: int = DEFAULT_MAX_BYTES):
+        self._add(name, StoreTarget(store), ttl_seconds, max_bytes)
+
+    def _add(self, name: str, target, ttl_seconds: float, max_bytes: int):
+        self.targets[name] = {
+            "target": target,
+            "ttl_seconds": ttl_seconds,
+            "max_bytes": max_bytes,
+            "metrics": {
+                "sweeps": 0,
+                "files_deleted": 0,
+                "bytes_reclaimed": 0,
+                "bytes_in_use": 0,
+                "files_in_use": 0,
+                "last_sweep": None,
+                "last_sweep_ms": 0.0
+            }
+        }
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self.sweep()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"⚠️ Janitor sweep failed: {e}")
+            await asyncio.sleep(self.interval_seconds)
+
+    async def sweep(self) -> Dict[str, int]:
+        """Apply TTL and quota to every target; returns files deleted per target"""
+        deleted = {}
+        for name in list(self.targets):
+            deleted[name] = await self._sweep_target(name)
+        return deleted
+
+    async def purge(self, name: str) -> int:
+        """Delete everything in a target, still in small batches"""
+        return await self._sweep_target(name, purge=True)
+
+    async def _sweep_target(self, name: str, purge: bool = False) -> int:
+        config = self.targets[name]
+        target = config["target"]
+        metrics = config["metrics"]
+
+        async with self._sweep_lock:
+            start_time = time.time()
+            entries = await run_in_threadpool(target.scan)
+            if purge:
+                doomed = [key for _, _, key in entries]
+                remaining_bytes = 0
+            else:
+                doomed, remaining_bytes = self._plan(entries, config["ttl_seconds"], config["max_bytes"])
+
+            files_deleted = 0
+            for i in range(0, len(doomed), self.batch_size):
+                count, reclaimed = await run_in_threadpool(target.delete, doomed[i:i + self.batch_size])
+                files_deleted += count
+                metrics["files_deleted"] += count
+                metrics["bytes_reclaimed"] += reclaimed
+                # Yield between batches so requests keep flowing
+                await asyncio.sleep(0)
+
+            metrics["sweeps"] += 1
+            metrics["bytes_in_use"] = remaining_bytes
+            metrics["files_in_use"] = len(entries) - files_deleted
+            metrics["last_sweep"] = time.time()
+            metrics["last_sweep_ms"] = round((time.time() - start_time) * 1000, 2)
+
+        if files_deleted:
+            print(f"🧹 Janitor removed {files_deleted} files from {name}")
+        return files_deleted
+
+    def _plan(self, entries: List[Tuple[float, int, str]], ttl_seconds: float, max_bytes: int):
+        """Pick expired entries, then the oldest ones until under quota"""
+        cutoff = time.time() - ttl_seconds
+        entries = sorted(entries)
+        doomed = []
+        total_bytes = sum(size for _, size, _ in entries)
+
+        for age, size, key in entries:
+            if age < cutoff or total_bytes > max_bytes:
+                doomed.append(key)
+                total_bytes -= size
+            else:
+                break
+
+        return doomed, total_bytes
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            name: {
+                "ttl_seconds": config["ttl_seconds"],
+                "max_bytes": config["max_bytes"],
+                **config["metrics"]
+            }
+            for name, config in self.targets.items()
+        }
@@ -0,0 +1,431 @@
+"""
+Prometheus metrics for the prediction pipeline, without dependencies.
+
+Each pipeline stage (receive, decode, quality, preprocess, queue_wait,
+inference, explanation, persist, serialize) is timed into one histogram,
+``dental_stage_seconds``, labelled by stage, model, route and batch size.
+Route and batch size come from the request being served: the middleware
+starts a label set per request, handlers add the model and number of
+images, and the scheduler runs model calls in the submitting request's
+context so observations made in worker threads carry the same labels.
+For the inference stage the batch size is the size of the model call
+itself (TTA views, tile batches).
+
+Observing is a lock, a bisect and two additions; ``DENTAL_METRICS=0`` turns
+it off. Gauges (queue depth, in-flight requests, loaded models) are read
+from callbacks when ``/metrics`` is scraped.
+
+The same observations give a per-request timing breakdown. Requests sent
+with ``?timing=true`` (or every request with ``DENTAL_TIMING=1``) also keep
+their own list of stage durations. It becomes a ``Server-Timing`` header,
+which browser devtools show, and one JSON log line per request. With
+``?timing=true`` the response body gets a ``timing`` object as well.
+Requests without timing skip the list entirely.
+"""
+
+import os
+import sys
+import json
+import time
+import bisect
+import threading
+import contextvars
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Dict, Any, Callable, Iterable, Optional, Tuple
+
+from starlette.datastructures import QueryParams
+from starlette.responses import Response
+from starlette.types import ASGIApp, Scope, Receive, Send
+
+ENABLED = os.getenv("DENTAL_METRICS", "1") == "1"
+TIMING_DEFAULT = os.getenv("DENTAL_TIMING", "0") == "1"
+# Only requests at least this slow are logged with their timing breakdown
+TIMING_LOG_MS = float(os.getenv("DENTAL_TIMING_LOG_MS", "0"))
+# Starlette appends the charset
+CONTENT_TYPE = "text/plain; version=0.0.4"
+
+STAGES = ("receive", "decode", "quality", "preprocess", "queue_wait",
+          "inference", "explanation", "persist", "serialize")
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+BATCH_BUCKETS = ((1, "1"), (4, "2-4"), (16, "5-16"), (64, "17-64"))
+
+# Labels of the request being served: route, model, batch_size, and for
+# timed requests "started" and a "stages" list of (stage, seconds). A
+# mutable dict, so labels added by the handler are seen by the middleware too.
+REQUEST_LABELS: contextvars.ContextVar = contextvars.ContextVar("metric_labels", default=None)
+_NO_LABELS: Dict[str, str] = {}
+
+
+def batch_bucket(size: int) -> str:
+    """Batch sizes are bucketed to keep the number of series small"""
+    for limit, name in BATCH_BUCKETS:
+        if size <= limit:
+            return name
+    return "65+"
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...]) -> str:
+    if not names:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n") for v in values)
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(names, escaped)) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, label_names: Tuple[str, ...], buckets: Tuple[float, ...] = BUCKETS):
+        self.name = name
+        self.help = help
+        self.label_names = label_names
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        # label values -> [per-bucket counts (last is +Inf), sum]
+        self._series: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, labels: Tuple[str, ...]):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        with self._lock:
+            series = [(labels, list(counts), total) for labels, (counts, total) in sorted(self._series.items())]
+        names = self.label_names + ("le",)
+        for labels, counts, total in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                yield f"{self.name}_bucket{_format_labels(names, labels + (_format_value(bound),))} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.label_names, labels)} {total!r}"
+            yield f"{self.name}_count{_format_labels(self.label_names, labels)} {cumulative}"
+
+
+class Counter:
+    def __init__(self, name: str, help: str, label_names: Tuple[str, ...]):
+        self.name = name
+        self.help = help
+        self.label_names = label_names
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[str, ...], float] = defaultdict(float)
+
+    def inc(self, labels: Tuple[str, ...], amount: float = 1):
+        with self._lock:
+            self._values[labels] += amount
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        with self._lock:
+            values = sorted(self._values.items())
+        for labels, value in values:
+            yield f"{self.name}{_format_labels(self.label_names, labels)} {_format_value(value)}"
+
+
+class Gauge:
+    """Read when scraped: ``collect`` returns a number, or {label values: number}"""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, label_names: Tuple[str, ...], collect: Callable[[], Any]):
+        self.name = name
+        self.help = help
+        self.label_names = label_names
+        self.collect = collect
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} {self.kind}"
+        try:
+            values = self.collect()
+        except Exception as e:
+            print(f"⚠️ Metric {self.name} unavailable: {e}")
+            return
+        if not isinstance(values, dict):
+            values = {(): values}
+        for labels, value in sorted(values.items()):
+            yield f"{self.name}{_format_labels(self.label_names, labels)} {_format_value(float(value))}"
+
+
+class CollectedCounter(Gauge):
+    """A counter kept by another component (in its stats), read when scraped"""
+
+    kind = "counter"
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: Dict[str, Any] = {}
+
+    def _add(self, metric):
+        # Re-registering a name (e.g. a reloaded module) replaces the old metric
+        self._metrics[metric.name] = metric
+        return metric
+
+    def histogram(self, name: str, help: str, label_names: Tuple[str, ...] = (), buckets=BUCKETS) -> Histogram:
+        return self._add(Histogram(name, help, tuple(label_names), tuple(buckets)))
+
+    def counter(self, name: str, help: str, label_names: Tuple[str, ...] = ()) -> Counter:
+        return self._add(Counter(name, help, tuple(label_names)))
+
+    def gauge(self, name: str, help: str, label_names: Tuple[str, ...], collect: Callable[[], Any]) -> Gauge:
+        return self._add(Gauge(name, help, tuple(label_names), collect))
+
+    def collected_counter(self, name: str, help: str, label_names: Tuple[str, ...],
+                          collect: Callable[[], Any]) -> CollectedCounter:
+        return self._add(CollectedCounter(name, help, tuple(label_names), collect))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+STAGE_SECONDS = registry.histogram(
+    "dental_stage_seconds", "Time spent in each prediction pipeline stage",
+    ("stage", "model", "route", "batch_size")
+)
+REQUESTS = registry.counter("dental_requests_total", "Instrumented requests by final status", ("route", "status"))
+IN_FLIGHT: Dict[str, int] = defaultdict(int)
+registry.gauge("dental_requests_in_flight", "Instrumented requests being served", ("route",),
+               lambda: {(route,): count for route, count in IN_FLIGHT.items()})
+
+
+def _record(stage: str, seconds: float, model: Optional[str], batch_size: Optional[int], labels: Dict[str, Any]):
+    STAGE_SECONDS.observe(seconds, (
+        stage,
+        model if model is not None else labels.get("model", ""),
+        labels.get("route", ""),
+        batch_bucket(batch_size) if batch_size is not None else labels.get("batch_size", "1")
+    ))
+
+
+def observe(stage: str, seconds: float, model: Optional[str] = None, batch_size: Optional[int] = None):
+    """Record one stage duration; labels not given come from the current request"""
+    if not ENABLED:
+        return
+    labels = REQUEST_LABELS.get() or _NO_LABELS
+    _record(stage, seconds, model, batch_size, labels)
+    stages = labels.get("stages")
+    if stages is not None:
+        # list.append is atomic, so worker threads of one request can share it
+        stages.append((stage, seconds))
+
+
+class timed:
+    """``with timed("decode"):`` observes the block's duration as a stage"""
+
+    __slots__ = ("stage", "model", "batch_size", "started")
+
+    def __init__(self, stage: str, model: Optional[str] = None, batch_size: Optional[int] = None):
+        self.stage = stage
+        self.model = model
+        self.batch_size = batch_size
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        observe(self.stage, time.perf_counter() - self.started, self.model, self.batch_size)
+        return False
+
+
+class TimedModel:
+    """Stands in for a model; each predict() is observed as inference with its batch size"""
+
+    def __init__(self, model, label: str):
+        self.model = model
+        self.label = label
+
+    def predict(self, batch, **kwargs):
+        with timed("inference", self.label, len(batch)):
+            return self.model.predict(batch, **kwargs)
+
+
+def timed_function(stage: str, func: Callable, model: Optional[str] = None) -> Callable:
+    """``func`` with each call observed as ``stage``"""
+    def wrapper(*args, **kwargs):
+        with timed(stage, model):
+            return func(*args, **kwargs)
+    return wrapper
+
+
+def label_request(model: Optional[str] = None, batch_size: Optional[int] = None):
+    """Add the model and number of images to the current request's labels"""
+    labels = REQUEST_LABELS.get()
+    if labels is None:
+        return
+    if model is not None:
+        labels["model"] = model
+    if batch_size is not None:
+        labels["batch_size"] = batch_bucket(batch_size)
+
+
+@contextmanager
+def request_labels(route: str, model: str = "", batch_size: int = 1):
+    """Label set for work that does not arrive through the middleware (background jobs)"""
+    token = REQUEST_LABELS.set({"route": route, "model": model, "batch_size": batch_bucket(batch_size)})
+    try:
+        yield
+    finally:
+        REQUEST_LABELS.reset(token)
+
+
+def wants_timing(query_string: bytes) -> Tuple[bool, bool]:
+    """(collect a breakdown, include it in the body) for a raw query string"""
+    if b"timing=" not in query_string:
+        return TIMING_DEFAULT, False
+    value = QueryParams(query_string).get("timing", "").lower()
+    if value in ("1", "true", "yes"):
+        return True, True
+    if value in ("0", "false", "no"):
+        return False, False
+    return TIMING_DEFAULT, False
+
+
+def timing_breakdown(labels: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+    """
+    Milliseconds per stage of a timed request (summed over repeats, with
+    the number of calls), plus the time since the request arrived. Stages of
+    concurrent batch items overlap, so their sum can exceed the total.
+    """
+    labels = labels if labels is not None else REQUEST_LABELS.get()
+    if labels is None or labels.get("stages") is None:
+        return None
+    totals: Dict[str, list] = {}
+    for stage, seconds in list(labels["stages"]):
+        entry = totals.setdefault(stage, [0.0, 0])
+        entry[0] += seconds
+        entry[1] += 1
+    order = {stage: index for index, stage in enumerate(STAGES)}
+    return {
+        "total_ms": round((time.perf_counter() - labels["started"]) * 1000, 2),
+        "stages": {
+            stage: {"ms": round(seconds * 1000, 2), "count": count}
+            for stage, (seconds, count) in sorted(totals.items(), key=lambda item: order.get(item[0], len(order)))
+        }
+    }
+
+
+def attach_timing(content: Any) -> Any:
+    """``content`` with a ``timing`` breakdown when the request asked for one"""
+    labels = REQUEST_LABELS.get()
+    if labels is None or not labels.get("show_timing") or not isinstance(content, dict):
+        return content
+    return {**content, "timing": timing_breakdown(labels)}
+
+
+def server_timing(breakdown: Dict[str, Any]) -> str:
+    """``Server-Timing`` header value of a breakdown"""
+    entries = []
+    for stage, entry in breakdown["stages"].items():
+        description = f';desc="{entry["count"]} calls"' if entry["count"] > 1 else ""
+        entries.append(f"{stage};dur={entry['ms']}{description}")
+    entries.append(f"total;dur={breakdown['total_ms']}")
+    return ", ".join(entries)
+
+
+def log_timing(labels: Dict[str, Any], status: int):
+    """One JSON line per timed request, on stdout with the other server logs"""
+    breakdown = timing_breakdown(labels)
+    if breakdown is None or breakdown["total_ms"] < TIMING_LOG_MS:
+        return
+    record = {
+        "event": "request_timing",
+        "route": labels["route"],
+        "model": labels.get("model", ""),
+        "batch_size": labels.get("batch_size", "1"),
+        "status": status,
+        **breakdown
+    }
+    sys.stdout.write(json.dumps(record, separators=(",", ":")) + "\n")
+    sys.stdout.flush()
+
+
+def watch_scheduler(scheduler, registry: MetricsRegistry = registry):
+    """Queue depth and running-call gauges per lane, and queue wait per call"""
+    registry.gauge("dental_queue_depth", "Model calls waiting per scheduler lane", ("lane",),
+                   lambda: {(name,): len(lane.pending) for name, lane in scheduler.lanes.items()})
+    registry.gauge("dental_inference_running", "Model calls running per scheduler lane", ("lane",),
+                   lambda: {(name,): lane.running for name, lane in scheduler.lanes.items()})
+    scheduler.on_wait = lambda lane, seconds: observe("queue_wait", seconds)
+
+
+def metrics_response() -> Response:
+    return Response(registry.render(), media_type=CONTENT_TYPE)
+
+
+class MetricsMiddleware:
+    """
+    For the given paths: time the request body (receive stage), count
+    requests by status and track how many are in flight. Timed requests
+    also get a ``Server-Timing`` header and a log line.
+    """
+
+    def __init__(self, app: ASGIApp, routes: Iterable[str]):
+        self.app = app
+        self.routes = set(routes)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if not ENABLED or scope["type"] != "http" or scope["path"] not in self.routes:
+            await self.app(scope, receive, send)
+            return
+
+        route = scope["path"]
+        started = time.perf_counter()
+        received = None
+        status = 500
+        labels = {"route": route, "model": "", "batch_size": "1"}
+        collect, show = wants_timing(scope.get("query_string", b""))
+        if collect:
+            labels.update(started=started, stages=[], show_timing=show)
+
+        async def timed_receive():
+            nonlocal received
+            message = await receive()
+            if received is None and message["type"] == "http.request" and not message.get("more_body"):
+                received = time.perf_counter() - started
+                if collect:
+                    # Listed now so the breakdown in the body includes it
+                    labels["stages"].append(("receive", received))
+            return message
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if collect:
+                    # Streamed responses start before their work is done;
+                    # their full breakdown is in the log line
+                    value = server_timing(timing_breakdown(labels)).encode("latin-1")
+                    message = {**message, "headers": list(message.get("headers", [])) + [(b"server-timing", value)]}
+            await send(message)
+
+        token = REQUEST_LABELS.set(labels)
+        IN_FLIGHT[route] += 1
+        try:
+            await self.app(scope, timed_receive, send_wrapper)
+        finally:
+            IN_FLIGHT[route] -= 1
+            # Observed last so the labels include what the handler added
+            if received is not None:
+                _record("receive", received, None, None, labels)
+            REQUESTS.inc((route, str(status)))
+            if collect:
+                log_timing(labels, status)
+            REQUEST_LABELS.reset(token)
@@ -0,0 +1,290 @@
+"""
+Priority scheduling of model calls.
+
+Every model call is submitted to a lane (interactive, batch or
+explanation). Lanes have a weight, their own concurrency limit and a queue
+budget. When a worker frees up, the waiting lane with the highest
+weight * (1 + wait / aging) goes next, so a single photo overtakes a large
+import while long-waiting work still ages its way to the front. Batches
+submit one image at a time, so interactive requests never wait for a
+whole batch.
+
+Requests may carry a deadline (``X-Request-Timeout`` in seconds or
+``X-Request-Deadline`` as a Unix timestamp). It follows the request through
+a context variable, and queued calls whose deadline has passed are dropped
+before they reach the model.
+
+Calls run in a copy of the submitting request's context, so context
+variables (deadline, metric labels) are visible in the worker thread.
+``on_wait``, when set, is called there with the lane and the queue wait in
+seconds before the call starts.
+"""
+
+import os
+import time
+import asyncio
+import functools
+import contextvars
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Optional, Callable
+
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Scope, Receive, Send
+
+INTERACTIVE = "interactive"
+BATCH = "batch"
+EXPLANATION = "explanation"
+
+AGING_SECONDS = float(os.getenv("DENTAL_LANE_AGING_S", "5"))
+DEFAULT_TIMEOUT_SECONDS = float(os.getenv("DENTAL_DEFAULT_TIMEOUT_S", "0"))
+
+# Monotonic deadline of the current request, if any
+DEADLINE: contextvars.ContextVar = contextvars.ContextVar("deadline", default=None)
+
+# name -> (weight, max concurrency (0 = all workers), queue budget)
+DEFAULT_LANES = {
+    INTERACTIVE: (8.0, 0, 64),
+    BATCH: (2.0, 0, 256),
+    EXPLANATION: (1.0, 1, 16),
+}
+
+
+def lane_config(name: str) -> tuple:
+    """Defaults, overridable as DENTAL_LANE_<NAME>="weight,concurrency,queue" """
+    override = os.getenv(f"DENTAL_LANE_{name.upper()}")
+    if not override:
+        return DEFAULT_LANES[name]
+    weight, concurrency, queue = override.split(",")
+    return float(weight), int(concurrency), int(queue)
+
+
+class DeadlineExceeded(Exception):
+    """Raised when the current request's deadline has passed"""
+
+    def __init__(self):
+        super().__init__("Deadline exceeded")
+        self.message = str(self)
+
+
+def deadline_expired() -> bool:
+    deadline = DEADLINE.get()
+    return deadline is not None and time.monotonic() >= deadline
+
+
+def check_deadline():
+    """Stop before an expensive stage if nobody will read the answer"""
+    if deadline_expired():
+        raise DeadlineExceeded()
+
+
+def deadline_from_headers(headers: Dict[str, str]) -> Optional[float]:
+    """Monotonic deadline from X-Request-Timeout / X-Request-Deadline"""
+    try:
+        timeout = headers.get("x-request-timeout")
+        if timeout:
+            return time.monotonic() + float(timeout)
+        deadline = headers.get("x-request-deadline")
+        if deadline:
+            deadline = float(deadline)
+            if deadline > 1e12:  # milliseconds
+                deadline /= 1000
+            return time.monotonic() + (deadline - time.time())
+    except ValueError:
+        return None
+    if DEFAULT_TIMEOUT_SECONDS > 0:
+        return time.monotonic() + DEFAULT_TIMEOUT_SECONDS
+    return None
+
+
+class DeadlineMiddleware:
+    """Attach the request deadline to the context; answer 504 once it passes"""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = {k.decode("latin-1").lower(): v.decode("latin-1") for k, v in scope.get("headers", [])}
+        deadline = deadline_from_headers(headers)
+        if deadline is None:
+            await self.app(scope, receive, send)
+            return
+
+        started = False
+
+        async def send_wrapper(message):
+            nonlocal started
+            if message["type"] == "http.response.start":
+                started = True
+            await send(message)
+
+        token = DEADLINE.set(deadline)
+        try:
+            # Already late on arrival: do not even read the body
+            check_deadline()
+            await self.app(scope, receive, send_wrapper)
+        except DeadlineExceeded as e:
+            if started:
+                raise
+            response = JSONResponse(status_code=504, content={"error": e.message})
+            await response(scope, receive, send)
+        finally:
+            DEADLINE.reset(token)
+
+
+class LaneFull(Exception):
+    """Raised when a lane's queue budget is exhausted"""
+
+    def __init__(self, lane: str, retry_after: int = 1):
+        super().__init__(f"Server busy ({lane} queue full), try again shortly")
+        self.lane = lane
+        self.message = str(self)
+        self.retry_after = retry_after
+
+
+class Lane:
+    def __init__(self, name: str, weight: float, max_concurrency: int, max_queue: int):
+        self.name = name
+        self.weight = weight
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.pending = deque()
+        self.running = 0
+        self.submitted = 0
+        self.completed = 0
+        self.rejected = 0
+        self.expired = 0
+        self.wait_seconds = 0.0
+        self.recent_wait = 0.0  # EWMA of queue wait, seconds
+
+    def stats(self) -> Dict[str, Any]:
+        started = self.completed + self.running
+        return {
+            "weight": self.weight,
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "queued": len(self.pending),
+            "running": self.running,
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "expired": self.expired,
+            "avg_wait_ms": round(self.wait_seconds / started * 1000, 2) if started else 0.0,
+            "recent_wait_ms": round(self.recent_wait * 1000, 2)
+        }
+
+
+class InferenceScheduler:
+    """Weighted, aging priority lanes in front of a small inference thread pool"""
+
+    def __init__(self, workers: int = 1, aging_seconds: float = AGING_SECONDS):
+        self.workers = max(1, workers)
+        self.aging_seconds = aging_seconds
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="inference")
+        self.running = 0
+        self.on_wait: Optional[Callable[[str, float], None]] = None
+        self.lanes: Dict[str, Lane] = {}
+        for name in DEFAULT_LANES:
+            weight, concurrency, queue = lane_config(name)
+            self.lanes[name] = Lane(name, weight, min(concurrency or self.workers, self.workers), queue)
+
+    async def run(self, lane_name: str, func, *args, **kwargs):
+        """Queue a blocking call in a lane and wait for its result"""
+        lane = self.lanes[lane_name]
+        check_deadline()
+        if len(lane.pending) >= lane.max_queue:
+            lane.rejected += 1
+            raise LaneFull(lane_name, self._retry_after(lane))
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        enqueued_at = time.monotonic()
+        context = contextvars.copy_context()
+
+        def call():
+            if self.on_wait is not None:
+                self.on_wait(lane_name, time.monotonic() - enqueued_at)
+            return func(*args, **kwargs)
+
+        entry = (future, functools.partial(context.run, call), enqueued_at, DEADLINE.get())
+        lane.pending.append(entry)
+        lane.submitted += 1
+        self._dispatch()
+        # A cancelled waiter leaves a cancelled future behind; dispatch skips it
+        return await future
+
+    def _dispatch(self):
+        while self.running < self.workers:
+            lane = self._pick()
+            if lane is None:
+                return
+            future, call, enqueued_at, _ = lane.pending.popleft()
+            lane.running += 1
+            waited = time.monotonic() - enqueued_at
+            lane.wait_seconds += waited
+            lane.recent_wait = 0.8 * lane.recent_wait + 0.2 * waited
+            self.running += 1
+            task = asyncio.get_running_loop().run_in_executor(self.executor, call)
+            task.add_done_callback(functools.partial(self._finished, lane, future))
+
+    def _pick(self) -> Optional[Lane]:
+        now = time.monotonic()
+        best, best_score = None, 0.0
+        for lane in self.lanes.values():
+            while lane.pending:
+                future, _, _, deadline = lane.pending[0]
+                if future.cancelled():
+                    lane.pending.popleft()
+                elif deadline is not None and now >= deadline:
+                    # Nobody is waiting for this answer any more
+                    lane.pending.popleft()
+                    lane.expired += 1
+                    future.set_exception(DeadlineExceeded())
+                else:
+                    break
+            if not lane.pending or lane.running >= lane.max_concurrency:
+                continue
+            waited = now - lane.pending[0][2]
+            score = lane.weight * (1 + waited / self.aging_seconds)
+            if score > best_score:
+                best, best_score = lane, score
+        return best
+
+    def _finished(self, lane: Lane, future: asyncio.Future, task: asyncio.Future):
+        lane.running -= 1
+        lane.completed += 1
+        self.running -= 1
+        if not future.cancelled():
+            if task.cancelled():
+                future.cancel()
+            elif task.exception() is not None:
+                future.set_exception(task.exception())
+            else:
+                future.set_result(task.result())
+        self._dispatch()
+
+    def queue_delay(self, lane_name: str) -> float:
+        """Expected queue wait in seconds for a call submitted to a lane now"""
+        lane = self.lanes[lane_name]
+        if not lane.pending and lane.running < lane.max_concurrency and self.running < self.workers:
+            return 0.0
+        head_age = time.monotonic() - lane.pending[0][2] if lane.pending else 0.0
+        return max(head_age, lane.recent_wait)
+
+    def _retry_after(self, lane: Lane) -> int:
+        return max(1, int(len(lane.pending) / max(1, lane.max_concurrency)))
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "workers": self.workers,
+            "running": self.running,
+            "aging_seconds": self.aging_seconds,
+            "lanes": {name: lane.stats() for name, lane in self.lanes.items()}
+        }
@@ -0,0 +1,183 @@
+"""
+Cache-friendly static file serving.
+
+Content-addressed and other write-once artifacts are served with strong
+ETags and ``Cache-Control: immutable`` so browsers stop revalidating them.
+Precompressed ``.br`` / ``.gz`` siblings are used when the client accepts
+them, and single byte ranges are answered with 206 Partial Content.
+"""
+
+import os
+import re
+import mimetypes
+from email.utils import formatdate
+from typing import Optional, Tuple
+
+import anyio
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import StaticFiles, NotModifiedResponse
+from starlette.types import Scope, Receive, Send
+
+# sha256-named blobs and their renditions
+CONTENT_ADDRESSED_PATTERN = r"^[0-9a-f]{64}(\.|$)"
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE_CONTROL = "public, no-cache"
+PRECOMPRESSED_ENCODINGS = [("br", ".br"), ("gzip", ".gz")]
+RANGE_CHUNK_SIZE = 64 * 1024
+
+
+class FileRangeResponse(Response):
+    """206 response streaming one byte range of a file"""
+
+    def __init__(self, path: str, start: int, end: int, headers: dict, media_type: str, method: str):
+        super().__init__(status_code=206, headers=headers, media_type=media_type)
+        self.path = path
+        self.start = start
+        self.end = end
+        self.send_body = method != "HEAD"
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await send({
+            "type": "http.response.start",
+            "status": self.status_code,
+            "headers": self.raw_headers,
+        })
+        if not self.send_body:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+
+        remaining = self.end - self.start + 1
+        async with await anyio.open_file(self.path, mode="rb") as file:
+            await file.seek(self.start)
+            while remaining > 0:
+                chunk = await file.read(min(RANGE_CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+        if remaining > 0:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+
+def parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """
+    Parse a single ``bytes=`` range into an inclusive (start, end).
+
+    Returns None when the header should be ignored (malformed or multiple
+    ranges) and raises ValueError when the range is unsatisfiable.
+    """
+    units, _, spec = header.partition("=")
+    if units.strip().lower() != "bytes" or "," in spec:
+        # Multipart ranges are optional; answer with the full file instead
+        return None
+
+    first, _, last = spec.strip().partition("-")
+    if (first and not first.isdigit()) or (last and not last.isdigit()) or not (first or last):
+        return None
+
+    if not first:
+        length = int(last)
+        if length == 0:
+            raise ValueError("empty suffix range")
+        start, end = max(size - length, 0), size - 1
+    else:
+        start = int(first)
+        if start >= size:
+            raise ValueError("range not satisfiable")
+        end = int(last) if last else size - 1
+        if end < start:
+            return None
+
+    return start, min(end, size - 1)
+
+
+def etag_matches(header: str, etag: str) -> bool:
+    if header.strip() == "*":
+        return True
+    candidates = [tag.strip() for tag in header.split(",")]
+    return any(tag == etag or tag == f"W/{etag}" for tag in candidates)
+
+
+class CachedStaticFiles(StaticFiles):
+    """StaticFiles with immutable caching, precompressed variants and ranges"""
+
+    def __init__(self, *args, immutable_pattern: str = CONTENT_ADDRESSED_PATTERN, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.immutable_pattern = re.compile(immutable_pattern)
+
+    def is_immutable(self, full_path) -> bool:
+        return bool(self.immutable_pattern.search(os.path.basename(full_path)))
+
+    def file_response(self, full_path, stat_result: os.stat_result, scope: Scope, status_code: int = 200) -> Response:
+        method = scope["method"]
+        request_headers = Headers(scope=scope)
+        full_path = str(full_path)
+        name = os.path.basename(full_path)
+        immutable = self.is_immutable(full_path)
+        range_header = request_headers.get("range") if status_code == 200 else None
+
+        # Pick the representation first: each encoding gets its own ETag
+        encoding, served_path, served_stat = None, full_path, stat_result
+        if not range_header:
+            accept_encoding = request_headers.get("accept-encoding", "")
+            for candidate, suffix in PRECOMPRESSED_ENCODINGS:
+                if candidate in accept_encoding:
+                    try:
+                        served_stat = os.stat(full_path + suffix)
+                    except OSError:
+                        continue
+                    encoding, served_path = candidate, full_path + suffix
+                    break
+
+        if immutable:
+            # The name already encodes the content, so it is a strong validator
+            etag = f'"{name}"' if encoding is None else f'"{name}.{encoding}"'
+        else:
+            etag = f'"{served_stat.st_size:x}-{served_stat.st_mtime_ns:x}"'
+
+        headers = {
+            "etag": etag,
+            "last-modified": formatdate(stat_result.st_mtime, usegmt=True),
+            "cache-control": IMMUTABLE_CACHE_CONTROL if immutable else REVALIDATE_CACHE_CONTROL,
+            "accept-ranges": "bytes",
+            "vary": "Accept-Encoding",
+        }
+        if encoding is not None:
+            headers["content-encoding"] = encoding
+
+        if_none_match = request_headers.get("if-none-match")
+        if if_none_match is not None:
+            if etag_matches(if_none_match, etag):
+                return NotModifiedResponse(Headers(headers))
+        elif self.is_not_modified(Headers(headers), request_headers):
+            return NotModifiedResponse(Headers(headers))
+
+        media_type = mimetypes.guess_type(name)[0] or "text/plain"
+
+        if range_header:
+            if_range = request_headers.get("if-range")
+            if if_range is None or if_range.strip() == etag:
+                size = stat_result.st_size
+                try:
+                    byte_range = parse_range(range_header, size)
+                except ValueError:
+                    return Response(
+                        status_code=416,
+                        headers={**headers, "content-range": f"bytes */{size}"}
+                    )
+                if byte_range is not None:
+                    start, end = byte_range
+                    headers["content-range"] = f"bytes {start}-{end}/{size}"
+                    headers["content-length"] = str(end - start + 1)
+                    return FileRangeResponse(full_path, start, end, headers, media_type, method)
+
+        return FileResponse(
+            served_path,
+            status_code=status_code,
+            headers=headers,
+            media_type=media_type,
+            stat_result=served_stat,
+            method=method
+        )
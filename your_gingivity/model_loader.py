@@ -8,6 +8,8 @@ import time
 from pathlib import Path
 from typing import Dict, Any
 
+from dental_common.metrics import timed
+
 # Disable TensorFlow warnings and logs
 os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
 tf.get_logger().setLevel('ERROR')
@@ -98,21 +100,24 @@ class ModelPredictor:
     def preprocess_image_simple(self, image_path: str) -> np.ndarray:
         """Simple preprocessing to save memory"""
         try:
-            # Read with PIL (lighter than OpenCV)
-            img = Image.open(image_path)
-            
-            # Convert to RGB if needed
-            if img.mode != 'RGB':
-                img = img.convert('RGB')
-            
-            # Resize
-            img = img.resize(self.img_size)
-            
-            # Convert to numpy array and normalize
-            img_array = np.array(img, dtype=np.float32) / 255.0
-            
-            # Add batch dimension
-            img_array = np.expand_dims(img_array, axis=0)
+            with timed("decode", "gingivitis"):
+                # Read with PIL (lighter than OpenCV)
+                img = Image.open(image_path)
+                img.load()
+                
+                # Convert to RGB if needed
+                if img.mode != 'RGB':
+                    img = img.convert('RGB')
+            
+            with timed("preprocess", "gingivitis"):
+                # Resize
+                img = img.resize(self.img_size)
+                
+                # Convert to numpy array and normalize
+                img_array = np.array(img, dtype=np.float32) / 255.0
+                
+                # Add batch dimension
+                img_array = np.expand_dims(img_array, axis=0)
             
             return img_array
             
@@ -138,11 +143,12 @@ class ModelPredictor:
             processed_image = self.preprocess_image_simple(image_path)
             
             # Make prediction with small batch size
-            prediction = self.model.predict(
-                processed_image, 
-                verbose=0, 
-                batch_size=1
-            )
+            with timed("inference", "gingivitis", 1):
+                prediction = self.model.predict(
+                    processed_image, 
+                    verbose=0, 
+                    batch_size=1
+                )
             
             probability = float(prediction[0][0])
             
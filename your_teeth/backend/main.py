@@ -3,23 +3,38 @@ os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
 os.environ['CUDA_VISIBLE_DEVICES'] = '-1'
 
 import io
+import sys
 import uuid
 import traceback
 import numpy as np
+import tensorflow as tf
 from pathlib import Path
 from PIL import Image
 from fastapi import FastAPI, UploadFile, File, Request
 from fastapi.responses import JSONResponse
-from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 
+# Scheduler, retention, metrics and static-file modules are shared with
+# the other backends and live in dental_common/ at the repository root
+sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
+
 # Import model - IMPORTANT: Use relative import
 try:
     from .model import DentalDiseasePredictor
 except ImportError:
     from model import DentalDiseasePredictor
+from dental_common.janitor import Janitor
+from dental_common.scheduler import InferenceScheduler, LaneFull, DeadlineMiddleware, DeadlineExceeded, check_deadline, EXPLANATION
+from dental_common.metrics import MetricsMiddleware, watch_scheduler, metrics_response, label_request, timed, attach_timing, registry as metrics_registry
+from dental_common.static_cache import CachedStaticFiles
 
 app = FastAPI(title="Dental AI System")
+
+# Per-request deadlines (X-Request-Timeout / X-Request-Deadline)
+app.add_middleware(DeadlineMiddleware)
+
+# Stage latency histograms and request counters, served at /metrics
+app.add_middleware(MetricsMiddleware, routes={"/api/analyze"})
 BASE_DIR = Path(__file__).resolve().parent
 
 # Setup folders
@@ -28,9 +43,24 @@ GRADCAM_DIR = "static/gradcam"
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 os.makedirs(GRADCAM_DIR, exist_ok=True)
 
-app.mount("/static", StaticFiles(directory="static"), name="static")
+# Background retention (TTL + quota) for uploads and Grad-CAM renders
+janitor = Janitor()
+janitor.add_directory("uploads", Path(UPLOAD_DIR))
+janitor.add_directory("gradcam", Path(GRADCAM_DIR))
+
+# Uploads and Grad-CAM renders get unique, write-once names: cache them forever
+app.mount(
+    "/static",
+    CachedStaticFiles(directory="static", immutable_pattern=r"^(original|gradcam|simple_gradcam)_[0-9a-f]{8}\."),
+    name="static"
+)
 templates = Jinja2Templates(directory="templates")
 
+# Grad-CAM runs off the event loop in the explanation lane, with its own
+# concurrency limit and queue budget
+scheduler = InferenceScheduler(workers=int(os.getenv("DENTAL_INFERENCE_WORKERS", "1")))
+watch_scheduler(scheduler)
+
 # Model paths to try (in order)
 MODEL_PATHS = [
     "DENTAL_MODEL_TF215.keras",      # Fixed version
@@ -40,6 +70,11 @@ MODEL_PATHS = [
 
 predictor = None
 
+metrics_registry.gauge(
+    "dental_models_loaded", "Whether each model is loaded (1) or missing (0)", ("model",),
+    lambda: {("dental",): predictor is not None}
+)
+
 def load_model():
     global predictor
     
@@ -72,6 +107,15 @@ def load_model():
         traceback.print_exc()
         return None
 
+@app.on_event("startup")
+async def startup_event():
+    janitor.start()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await janitor.stop()
+    scheduler.shutdown()
+
 @app.get("/")
 async def home(request: Request):
     return templates.TemplateResponse("index.html", {"request": request})
@@ -95,11 +139,26 @@ async def check_files():
             "files": [os.path.basename(f) for f in gradcam],
             "count": len(gradcam)
         },
+        "storage": janitor.metrics(),
         "url_examples": {
             "upload_example": "/static/uploads/test_image.png",
             "gradcam_example": "/static/gradcam/test_gradcam.png"
         }
     })
+@app.get("/clear")
+async def clear_files():
+    """Clear uploaded images and Grad-CAM renders"""
+    deleted = await janitor.purge("uploads") + await janitor.purge("gradcam")
+    
+    return JSONResponse({
+        "message": f"Cleared {deleted} files",
+        "status": "success"
+    })
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics: stage latency histograms, queue and model gauges"""
+    return metrics_response()
+
 @app.get("/health")
 async def health_check():
     predictor_instance = load_model()
@@ -115,7 +174,8 @@ async def health_check():
         "status": "healthy",
         "message": "Server is running",
         "model_loaded": True,
-        "tensorflow_version": tf.__version__
+        "tensorflow_version": tf.__version__,
+        "scheduler": scheduler.stats()
     })
 @app.post("/api/analyze")
 async def analyze_image(file: UploadFile = File(...)):
@@ -131,6 +191,7 @@ async def analyze_image(file: UploadFile = File(...)):
                 "error": "Model not available"
             }
         )
+    label_request(model="dental")
     
     try:
         # Read file
@@ -143,21 +204,33 @@ async def analyze_image(file: UploadFile = File(...)):
             )
         
         # Open image
-        img = Image.open(io.BytesIO(contents)).convert('RGB')
-        img_array = np.array(img)
+        with timed("decode"):
+            img = Image.open(io.BytesIO(contents)).convert('RGB')
+            img_array = np.array(img)
         
         print(f"📏 Image loaded: {img_array.shape}")
         
+        # Grad-CAM is the expensive part; skip everything if we are already late
+        check_deadline()
+        
         # Save original
         unique_id = str(uuid.uuid4())[:8]
         file_ext = file.filename.split('.')[-1] if '.' in file.filename else 'png'
         original_name = f"original_{unique_id}.{file_ext}"
         original_path = os.path.join(UPLOAD_DIR, original_name)
-        img.save(original_path)
+        with timed("persist"):
+            img.save(original_path)
         
         # Make prediction WITH REAL Grad-CAM
         print("🎯 Making prediction with Grad-CAM...")
-        result = predictor_instance.predict_with_gradcam(img_array)
+        try:
+            result = await scheduler.run(EXPLANATION, predictor_instance.predict_with_gradcam, img_array)
+        except LaneFull as e:
+            return JSONResponse(
+                status_code=503,
+                content={"status": "error", "error": e.message},
+                headers={"Retry-After": str(e.retry_after)}
+            )
         
         if 'error' in result:
             print(f"❌ Prediction error: {result['error']}")
@@ -172,12 +245,13 @@ async def analyze_image(file: UploadFile = File(...)):
         # Save BOTH visualizations
         gradcam_name = f"gradcam_{unique_id}.png"
         gradcam_path = os.path.join(GRADCAM_DIR, gradcam_name)
-        result['gradcam_image'].save(gradcam_path)
-        
-        # Also save the simple superimposed image
         simple_name = f"simple_gradcam_{unique_id}.png"
         simple_path = os.path.join(GRADCAM_DIR, simple_name)
-        result['simple_gradcam_image'].save(simple_path)
+        with timed("persist"):
+            result['gradcam_image'].save(gradcam_path)
+            
+            # Also save the simple superimposed image
+            result['simple_gradcam_image'].save(simple_path)
         
         print(f"✅ Prediction successful: {result['class']}")
         print(f"📍 Detected regions: {result['heatmap_data']['num_regions']}")
@@ -191,21 +265,24 @@ async def analyze_image(file: UploadFile = File(...)):
         print(f"📁 Simple GradCAM saved: {simple_path}")
         
         # Return response WITH heatmap data
-        return JSONResponse({
-            "status": "success",
-            "prediction": {
-                "class": result['class'],
-                "confidence": result['confidence'],
-                "all_probabilities": result['all_probabilities'],
-                "message": result['message']
-            },
-            "images": {
-                "original": original_url,
-                "gradcam": gradcam_url  # This now has green overlay
-            },
-            "heatmap_data": result['heatmap_data']  # Add heatmap data for green dots
-        })
+        with timed("serialize"):
+            return JSONResponse(attach_timing({
+                "status": "success",
+                "prediction": {
+                    "class": result['class'],
+                    "confidence": result['confidence'],
+                    "all_probabilities": result['all_probabilities'],
+                    "message": result['message']
+                },
+                "images": {
+                    "original": original_url,
+                    "gradcam": gradcam_url  # This now has green overlay
+                },
+                "heatmap_data": result['heatmap_data']  # Add heatmap data for green dots
+            }))
         
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         print(f"❌ Server error: {e}")
         traceback.print_exc()
@@ -9,9 +9,12 @@ import tensorflow as tf
 import numpy as np
 from PIL import Image
 import io
+import time
 import traceback
 import cv2
 
+from dental_common.metrics import timed, observe
+
 print(f"TensorFlow version: {tf.__version__}")
 
 class DentalDiseasePredictor:
@@ -136,10 +139,12 @@ class DentalDiseasePredictor:
         """Simple prediction"""
         try:
             # Preprocess
-            processed_image = self.preprocess_image(image_array)
+            with timed("preprocess", "dental"):
+                processed_image = self.preprocess_image(image_array)
             
             # Predict
-            predictions = self.model.predict(processed_image, verbose=0)
+            with timed("inference", "dental", 1):
+                predictions = self.model.predict(processed_image, verbose=0)
             
             # Get results
             pred_idx = np.argmax(predictions[0])
@@ -283,12 +288,16 @@ class DentalDiseasePredictor:
             pred_index = np.argmax(result['raw_predictions'])
             print(f"🔍 Generating Grad-CAM for class index: {pred_index}")
             
+            # Heatmap, overlay and figure rendering make up the explanation stage
+            explain_started = time.perf_counter()
             heatmap = self.make_gradcam_heatmap(image_array, pred_index)
             
             if heatmap is None:
                 print("⚠️ Could not generate heatmap, using fallback")
                 # Fallback to simple green overlay
-                return self._create_simple_overlay(image_array, result)
+                overlay = self._create_simple_overlay(image_array, result)
+                observe("explanation", time.perf_counter() - explain_started, "dental")
+                return overlay
             
             # Detect hotspots
             hotspots = self.detect_hotspots(heatmap)
@@ -345,6 +354,7 @@ class DentalDiseasePredictor:
                        facecolor='white', edgecolor='none')
             plt.close(fig)
             buf.seek(0)
+            observe("explanation", time.perf_counter() - explain_started, "dental")
             
             return {
                 'class': result['class'],